@@ -1,11 +1,29 @@
+import os
 from game2d import *
 from Twenty import *
 from consts import *
+import board
+from hints import HintEngine
+from autoplay import Autoplayer
+from replay import Timeline
+from history import HUMAN, Leaderboard
+import savegame
 
 class TwentyGUI(GameApp):
+    # A recorded game (seed, moves) to play back instead of a new game, or None
+    recording = None
     
     def start(self):
         self.game = Twenty()
+        if self.recording is None and os.path.exists(SAVE_FILE):
+            # Any save that cannot be restored (restore leaves the game unchanged) is
+            # treated as no save, and replaced by the first autosave of the new game
+            try:
+                self.game.restore(savegame.load(SAVE_FILE))
+            except Exception:
+                pass
+        self.saver = None if self.recording is not None else savegame.Autosaver(SAVE_FILE)
+        self.game_saved = self.game.moves
         self.backdrop = GRectangle(x = GAME_WIDTH/2, y = GAME_HEIGHT/2, width = GAME_HEIGHT, height = GAME_HEIGHT, fillcolor = BACK_COLOR)
         self.block_list = []
         rect_list = []
@@ -16,16 +34,247 @@ class TwentyGUI(GameApp):
                                                  y = BORDER + BORDER * row + REC_SIDE * row + REC_SIDE/2, 
                                                  width = REC_SIDE, height = REC_SIDE, fillcolor = DEFAULT_REC_COLOR))
         self.recs = rect_list
+        self.hints = None
+        self.hint_pressed = False
+        self.arrows = [self.make_arrow(direction) for direction in range(4)]
+        self.autoplay = None
+        self.autoplay_pressed = False
+        self.tile_labels = {}
+        self.shown_board = 0
+        self.auto_rate = None
+        self.status = GLabel(x = GAME_WIDTH/2, y = BORDER/2, width = GAME_WIDTH, height = BORDER,
+                             font_name = 'ClearSans', font_size = 12, linecolor = AUTOPLAY_COLOR, text = '')
+        self.leaderboard = None
+        self.game_time = 0
+        self.game_checked = self.game.moves
+        self.game_recorded = False
+        self.scores_pressed = False
+        self.scores_version = None
+        self.scores_shown = False
+        self.scores = GLabel(x = GAME_WIDTH/2, y = GAME_HEIGHT/2, width = GAME_HEIGHT - 2*BORDER,
+                             height = GAME_HEIGHT - 2*BORDER, fillcolor = BACK_COLOR,
+                             font_name = 'ClearSans', font_size = 20, text = '')
+        self.replay = None
+        if self.recording is None:
+            self.leaderboard = Leaderboard(HISTORY_FILE, HISTORY_TOP)
+        else:
+            self.replay = Timeline(self.recording[0], self.recording[1], REPLAY_KEYFRAMES)
+            self.replay_move = None
+            self.replay_shown = None
+            self.replay_target = 0
+            self.replay_playing = False
+            self.replay_speed = REPLAY_SPEED
+            self.replay_keys = set()
+            self.progress = GRectangle(x = 0, y = REPLAY_BAR/2, width = 1, height = REPLAY_BAR,
+                                       fillcolor = AUTOPLAY_COLOR)
+
+    def make_arrow(self, direction):
+        """
+        Returns: the triangle drawn over the board to suggest a direction
+
+        Parameter direction: the direction the arrow points
+        Precondition: [int] one of board.UP, board.DOWN, board.LEFT or board.RIGHT
+        """
+        s = HINT_SIZE
+        corners = ((0, s), (-s, -s/2), (s, -s/2))
+        turn = {board.UP: lambda x, y: (x, y), board.DOWN: lambda x, y: (x, -y),
+                board.LEFT: lambda x, y: (-y, x), board.RIGHT: lambda x, y: (y, -x)}[direction]
+        points = []
+        for x, y in corners:
+            x, y = turn(x, y)
+            points.extend([GAME_WIDTH/2 + x, GAME_HEIGHT/2 + y])
+        return GTriangle(points = points, fillcolor = HINT_COLOR)
+
+    def update_hints(self):
+        """
+        Toggles the hint engine on the hint key, and keeps it searching the current board
+
+        The search runs in another process, so this only sends the board (when it has
+        changed, which cancels the old search) and collects any finished results.
+        """
+        pressed = self.input.is_key_down(HINT_KEY)
+        if pressed and not self.hint_pressed:
+            if self.hints is None:
+                self.hints = HintEngine(HINT_DEPTH, HINT_BOOK)
+            else:
+                self.hints.stop()
+                self.hints = None
+        self.hint_pressed = pressed
+        if self.hints is not None:
+            self.hints.request(board.from_grid(self.game.getGrid()))
+            self.hints.poll()
+
+    def tile_label(self, row, col, value):
+        """
+        Returns: the label for a tile of the given value at (row, col), without animation
+
+        This is for the autoplay and replay modes.  Labels are built the first time they
+        are needed and then reused, so drawing a frame in these modes builds no labels.
+
+        Parameter row: the row of the tile
+        Precondition: [int] 0 <= row < 4
+
+        Parameter col: the column of the tile
+        Precondition: [int] 0 <= col < 4
+
+        Parameter value: the tile value
+        Precondition: [int] a power of two >= 2
+        """
+        key = (row, col, value)
+        tile = self.tile_labels.get(key)
+        if tile is None:
+            tile = GLabel(y = GAME_HEIGHT - (BORDER + BORDER * row + REC_SIDE * row + REC_SIDE/2),
+                          x = BORDER + BORDER * col + REC_SIDE * col + REC_SIDE/2,
+                          width = REC_SIDE, height = REC_SIDE, fillcolor = tile_color(value),
+                          font_name = 'ClearSans', font_size = 30 if value < 10000 else 24, text = str(value))
+            self.tile_labels[key] = tile
+        return tile
+
+    def autosave(self):
+        """
+        Saves the game after every move, and removes the save once the game is over
+
+        Encoding a save takes microseconds (see the module savegame), and the file is
+        written on the thread of the autosaver, so this never holds up the frame.
+        """
+        if self.game.moves != self.game_saved:
+            self.game_saved = self.game.moves
+            if not board.is_over(board.from_grid(self.game.getGrid())):
+                self.saver.put(self.game.snapshot())
+            else:
+                self.saver.remove()
+
+    def update_scores(self, dt):
+        """
+        Records the game when it is over, and toggles the leaderboard on the scores key
+
+        The leaderboard thread does the writing and reading, so this never waits for the
+        database.  It only rebuilds the leaderboard text when the thread has read it again.
+
+        Parameter dt: the time since the last frame
+        Precondition: [int or float] dt >= 0
+        """
+        self.game_time += dt
+        if not self.game_recorded and self.game.moves != self.game_checked:
+            self.game_checked = self.game.moves
+            b = board.from_grid(self.game.getGrid())
+            if board.is_over(b):
+                self.game_recorded = True
+                self.scores_shown = True
+                self.leaderboard.record(HUMAN, None, self.game.score, board.max_tile(b),
+                                        self.game.moves, self.game_time)
+        pressed = self.input.is_key_down(HISTORY_KEY)
+        if pressed and not self.scores_pressed:
+            self.scores_shown = not self.scores_shown
+        self.scores_pressed = pressed
+        top = self.leaderboard.top
+        if self.scores_shown and top is not None and self.leaderboard.version != self.scores_version:
+            self.scores_version = self.leaderboard.version
+            lines = ['High scores', '']
+            for rank, (score, tile, moves, duration, finished, agent) in enumerate(top, 1):
+                lines.append('%2d.  %6d   %5d' % (rank, score, tile))
+            if not top:
+                lines.append('No games yet')
+            if self.game_recorded:
+                lines.extend(['', 'This game: %d' % self.game.score])
+            self.scores.text = '\n'.join(lines)
+
+    def update_autoplay(self):
+        """
+        Toggles autoplay on the autoplay key, and samples the latest autoplay state
+
+        The agent plays in another process as fast as it can, starting from the board
+        on screen.  Each frame simply shows whatever board it last published, so the
+        speed of play does not depend on the frame rate (and there are no animations).
+        """
+        pressed = self.input.is_key_down(AUTOPLAY_KEY)
+        if pressed and not self.autoplay_pressed:
+            if self.autoplay is None:
+                if self.hints is not None:
+                    self.hints.stop()
+                    self.hints = None
+                self.autoplay = Autoplayer(AUTOPLAY_AGENT, start = board.from_grid(self.game.getGrid()))
+                self.auto_rate = None
+            else:
+                self.autoplay.stop()
+                self.autoplay = None
+        self.autoplay_pressed = pressed
+        if self.autoplay is not None:
+            self.shown_board, score, moves, games = self.autoplay.sample()
+            rate = self.autoplay.rate()
+            if rate != self.auto_rate:
+                self.auto_rate = rate
+                self.status.text = '%s: %d moves/s, game %d, move %d' % (AUTOPLAY_AGENT, rate, games+1, moves)
+
+    def update_replay(self, dt):
+        """
+        Plays back the recording, and handles the playback controls
+
+        Space plays or pauses, left and right step one move, page up and down jump
+        REPLAY_JUMP moves, up and down change the speed, and clicking or dragging the
+        mouse across the window seeks to that point of the game.  Every seek goes
+        through the keyframes of the timeline, so it takes the same short time anywhere
+        in the game.
+
+        Parameter dt: the time since the last frame
+        Precondition: [int or float] dt >= 0
+        """
+        down = set(key for key in REPLAY_KEYS if self.input.is_key_down(key))
+        pressed = down - self.replay_keys
+        self.replay_keys = down
+        last = len(self.replay)
+        if 'spacebar' in pressed:
+            self.replay_playing = not self.replay_playing
+            if self.replay_target >= last:
+                self.replay_target = 0
+        if 'up' in pressed:
+            self.replay_speed = min(self.replay_speed+1, len(REPLAY_SPEEDS)-1)
+        if 'down' in pressed:
+            self.replay_speed = max(self.replay_speed-1, 0)
+        step = {'left': -1, 'right': 1, 'pageup': -REPLAY_JUMP, 'pagedown': REPLAY_JUMP}
+        for key in pressed & set(step):
+            self.replay_playing = False
+            self.replay_target += step[key]
+        touch = self.input.touch
+        if touch is not None:
+            self.replay_playing = False
+            self.replay_target = round(touch.x/GAME_WIDTH*last)
+        if self.replay_playing:
+            self.replay_target += REPLAY_SPEEDS[self.replay_speed]*dt
+            if self.replay_target >= last:
+                self.replay_playing = False
+        self.replay_target = min(max(self.replay_target, 0), last)
+
+        move = int(self.replay_target)
+        if move != self.replay_move:
+            self.replay_move = move
+            self.shown_board, self.replay_score = self.replay.position(move)
+            self.progress.width = max(GAME_WIDTH*move/max(last, 1), 1)
+            self.progress.x = self.progress.width/2
+        shown = (move, self.replay_speed, self.replay_playing)
+        if shown != self.replay_shown:
+            self.replay_shown = shown
+            self.status.text = 'move %d/%d   score %d   %s moves/s%s' % (move, last, self.replay_score,
+                REPLAY_SPEEDS[self.replay_speed], '' if self.replay_playing else '   (paused)')
 
     def update(self,dt):
+        if self.replay is not None:
+            self.update_replay(dt)
+            return
+        self.update_autoplay()
+        if self.autoplay is not None:
+            return
         self.game.update(self.input, dt)
-        active_blocks = self.game.getBlocks()
-        self.block_list = []
-        for block in active_blocks:
-            block.set_rect(GLabel(y = GAME_HEIGHT - (BORDER + BORDER * block.get_row() + REC_SIDE * block.get_row() + REC_SIDE/2),
-                           x = BORDER + BORDER * block.get_col() + REC_SIDE * block.get_col() + REC_SIDE/2,
-                           width = REC_SIDE, height = REC_SIDE, fillcolor = COLORS[block.get_val()], font_name = 'ClearSans', font_size = 30, text = str(block.get_val())))
-            self.block_list.append(block)
+        self.autosave()
+        self.update_scores(dt)
+        self.update_hints()
+        # Plan the next move (one direction per frame) while the blocks animate
+        self.game.speculate()
+        # The labels are built with their blocks, and change only when a block doubles,
+        # so a frame only slides (and grows and pulses) the labels it already has
+        self.block_list = list(self.game.getBlocks())
+        for block in self.block_list:
+            block.aim()
             block.update()
 
     def draw(self):
@@ -33,8 +282,59 @@ class TwentyGUI(GameApp):
         for row in self.recs:
             for rect in row:
                 rect.draw(self.view)
+        if self.autoplay is not None or self.replay is not None:
+            grid = board.to_grid(self.shown_board)
+            for row in range(4):
+                for col in range(4):
+                    if grid[row][col]:
+                        self.tile_label(row, col, grid[row][col]).draw(self.view)
+            self.status.draw(self.view)
+            if self.replay is not None:
+                self.progress.draw(self.view)
+            return
         for block in self.block_list:
             block.get_rect().draw(self.view)
+        if self.hints is not None and self.hints.hint is not None:
+            self.arrows[self.hints.hint].draw(self.view)
+        if self.scores_shown and self.scores_version is not None:
+            self.scores.draw(self.view)
+
+    def on_stop(self):
+        """
+        Stops the leaderboard and autosave threads, once they have written what they
+        were given
+
+        This is a Kivy event handler, called when the window closes.
+        """
+        if self.leaderboard is not None:
+            self.leaderboard.stop()
+        if self.saver is not None:
+            self.saver.stop()
+
+
+def main(argv=None):
+    """
+    Plays back one game of a replay file or replay archive.
+    """
+    import argparse
+    from archive import ArchiveReader
+    from replay import ReplayReader
+    parser = argparse.ArgumentParser(prog='view', description=main.__doc__.strip())
+    parser.add_argument('input', help='the replay file or archive')
+    parser.add_argument('index', type=int, nargs='?', default=0, help='the game number')
+    args = parser.parse_args(argv)
+
+    try:
+        reader = ArchiveReader(args.input)
+        recording = reader.game(args.index) if 0 <= args.index < len(reader) else None
+    except IOError:
+        reader = ReplayReader(args.input)
+        recording = next((game for index, game in enumerate(reader) if index == args.index), None)
+    reader.close()
+    if recording is None:
+        parser.error('%s has no game %d' % (repr(args.input), args.index))
+    TwentyGUI.recording = recording
+    TwentyGUI(width=GAME_WIDTH,height=GAME_HEIGHT).run()
 
 
 if __name__ == '__main__':
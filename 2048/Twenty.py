@@ -1,7 +1,42 @@
+import array
 import random
-import copy
+import collections
 from game2d import *
 from consts import *
+import board
+import savegame
+
+MOVES = ('up', 'down', 'left', 'right')
+
+# The step toward the wall and the order positions are visited, for each direction
+STEPS = {'up': (-1,0), 'down': (1,0), 'left': (0,-1), 'right': (0,1)}
+ORDERS = {'up': [(row,col) for row in range(1,4) for col in range(4)],
+          'down': [(row,col) for row in range(2,-1,-1) for col in range(4)],
+          'left': [(row,col) for row in range(4) for col in range(1,4)],
+          'right': [(row,col) for row in range(4) for col in range(2,-1,-1)]}
+
+# Everything a move will do, worked out ahead of time.  cells maps each new (row,col)
+# to the block that ends there, doubled lists merge targets (once per merge), removed
+# lists merged-away blocks, score is the points the merges make, and spawn is
+# (row,col,value) or None if the move is illegal.  rng_before and rng_after are the
+# random module states around the spawn, and block is the prebuilt spawned block (or
+# None).
+Plan = collections.namedtuple('Plan', ['grid', 'cells', 'doubled', 'removed', 'score',
+                                       'spawn', 'rng_before', 'rng_after', 'block'])
+
+
+def cell_center(row, col):
+    """
+    Returns: the position (x, y) of the center of the cell at (row, col) on screen
+
+    Parameter row: the row of the cell
+    Precondition: [int] 0 <= row < 4
+
+    Parameter col: the column of the cell
+    Precondition: [int] 0 <= col < 4
+    """
+    return (BORDER + BORDER * col + REC_SIDE * col + REC_SIDE/2,
+            GAME_HEIGHT - (BORDER + BORDER * row + REC_SIDE * row + REC_SIDE/2))
 
 class Twenty():
     """
@@ -10,6 +45,11 @@ class Twenty():
     Instance Variables:
         playGrid: [list] a 2D list which keeps track of the blocks at each position
             0 represents no block, any other value represents a block with that value
+        plans: [dict] the Plan for each direction already worked out from this state
+        score: [int >= 0] the sum of the values of all the blocks made by merging
+        moves: [int >= 0] the number of moves made
+        undos: [array] the packed board, score and moves of each of the last UNDO_LIMIT
+            states before a move, oldest first, three 64-bit words per state
     
     Class Variables:
         SPAWNABLE: [tuple] a list of the possible values for spawning blocks into the game
@@ -40,25 +80,109 @@ class Twenty():
         self.blocks = []
         self.playGrid = [[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]]
         self.pressed = []
+        self.plans = {}
+        self.score = 0
+        self.moves = 0
+        self.undos = array.array('Q')
         self.spawn_block()
         self.spawn_block()
 
     def spawn_block(self):
+        row, col, value = self.choose_spawn(self.playGrid)
+        self.place_block(self.make_block(row, col, value))
+
+    def choose_spawn(self, grid):
+        """
+        Returns: a tuple (row, col, value) for a new block on the given grid
+
+        Parameter grid: the grid to spawn on
+        Precondition: [list] a 4x4 grid with at least one empty position
+        """
         value = random.choice(self.SPAWNABLE)
         acc = []
         for row in range(4):
             for col in range(4):
-                if self.playGrid[row][col] == 0:
+                if grid[row][col] == 0:
                     acc.append((row,col))
         new_location = random.choice(acc)
-        self.playGrid[new_location[0]][new_location[1]] = value
-        block = Block(new_location[0],new_location[1],value)
-        self.blocks.append(block)
-        block.set_rect(GLabel(y = GAME_HEIGHT - (BORDER + BORDER * block.get_row() + REC_SIDE * block.get_row() + REC_SIDE/2),
-                           x = BORDER + BORDER * block.get_col() + REC_SIDE * block.get_col() + REC_SIDE/2,
-                           width = STARTING_WIDTH, height = STARTING_WIDTH, fillcolor = COLORS[block.get_val()], 
+        return new_location[0], new_location[1], value
+
+    def make_block(self, row, col, value):
+        """
+        Returns: a new (not yet placed) block, with the label it starts growing from
+        """
+        block = Block(row,col,value)
+        x, y = cell_center(row, col)
+        block.set_rect(GLabel(x = x, y = y, width = STARTING_WIDTH, height = STARTING_WIDTH, fillcolor = tile_color(value), 
                            font_name = 'ClearSans', font_size = 30, text = str(block.get_val())))
+        return block
+
+    def place_block(self, block):
+        self.playGrid[block.get_row()][block.get_col()] = block.get_val()
+        self.blocks.append(block)
+
+    def plan(self, direction):
+        """
+        Returns: the Plan for moving all blocks in the direction specified
+
+        This works out everything that move would do, including the block that would
+        spawn, without changing the game.  The random module is put back the way it
+        was, and the plan remembers the state it will be left in.
+
+        Parameter directon: the direction to move
+        Precondition: [str] either up, down, left or right
+        """
+        grid = [row[:] for row in self.playGrid]
+        cells = {}
+        for block in self.blocks:
+            cells[(block.get_row(), block.get_col())] = block
+        doubled = []
+        removed = []
+        score = 0
+        dr, dc = STEPS[direction]
+        for row, col in ORDERS[direction]:
+            if grid[row][col] != 0:
+                r = row; c = col
+                while 0 <= r+dr < 4 and 0 <= c+dc < 4 and grid[r+dr][c+dc] == 0:
+                    grid[r+dr][c+dc] = grid[r][c]
+                    grid[r][c] = 0
+
+                    cells[(r+dr,c+dc)] = cells.pop((r,c))
+                    r += dr; c += dc
+                if 0 <= r+dr < 4 and 0 <= c+dc < 4 and grid[r+dr][c+dc] == grid[r][c]:
+                    grid[r+dr][c+dc] *= 2
+                    grid[r][c] = 0
+                    score += grid[r+dr][c+dc]
+
+                    doubled.append(cells[(r+dr,c+dc)])
+                    removed.append(cells.pop((r,c)))
+
+        if grid == self.playGrid:
+            return Plan(grid, cells, doubled, removed, 0, None, None, None, None)
+        before = random.getstate()
+        spawn = self.choose_spawn(grid)
+        after = random.getstate()
+        random.setstate(before)
+        return Plan(grid, cells, doubled, removed, score, spawn, before, after, None)
+
+    def speculate(self):
+        """
+        Plans one more direction from the current state, if any are left
 
+        The GUI calls this once per frame, so that the plans (and the labels of the
+        blocks they would spawn) are built while the blocks are still sliding.  The
+        next move is then just a lookup.
+
+        Returns: True if a direction was planned, False if all four are done
+        """
+        for direction in MOVES:
+            if direction not in self.plans:
+                plan = self.plan(direction)
+                if plan.spawn is not None:
+                    plan = plan._replace(block=self.make_block(*plan.spawn))
+                self.plans[direction] = plan
+                return True
+        return False
 
     def move(self,direction):
         """
@@ -67,85 +191,107 @@ class Twenty():
         Parameter directon: the direction to move
         Precondition: [str] either up, down, left or right
         """
-        old_grid = copy.deepcopy(self.playGrid)
-        if direction == 'up':
-            for row in range(1,4):
-                for col in range(4):
-                    if self.playGrid[row][col] != 0:
-                        r = row; c = col
-                        while r > 0 and self.playGrid[r-1][c] == 0:
-                            self.playGrid[r-1][c] = self.playGrid[r][c]
-                            self.playGrid[r][c] = 0
-
-                            self.getBlock(r,c).move(r-1, c)
-                            r -= 1
-                        if r > 0 and self.playGrid[r-1][c] == self.playGrid[r][c]:
-                            self.playGrid[r-1][c] *= 2
-                            self.playGrid[r][c] = 0
-
-                            self.getBlock(r-1,c).double()
-                            self.getBlock(r-1,c).pulse()
-                            self.removeBlock(self.getBlock(r,c))
-
-        if direction == 'down':
-            for row in range(2,-1,-1):
-                for col in range(4):
-                    if self.playGrid[row][col] != 0:
-                        r = row; c = col
-                        while r < 3 and self.playGrid[r+1][c] == 0:
-                            self.playGrid[r+1][c] = self.playGrid[r][c]
-                            self.playGrid[r][c] = 0
-
-                            self.getBlock(r,c).move(r+1, c)
-                            r += 1
-                        if r < 3 and self.playGrid[r+1][c] == self.playGrid[r][c]:
-                            self.playGrid[r+1][c] *= 2
-                            self.playGrid[r][c] = 0
-
-                            self.getBlock(r+1,c).double()
-                            self.getBlock(r+1,c).pulse()
-                            self.removeBlock(self.getBlock(r,c))
-
-        if direction == 'right':
-            for row in range(4):
-                for col in range(2,-1,-1):
-                    if self.playGrid[row][col] != 0:
-                        r = row; c = col
-                        while c < 3 and self.playGrid[r][c+1] == 0:
-                            self.playGrid[r][c+1] = self.playGrid[r][c]
-                            self.playGrid[r][c] = 0
-
-                            self.getBlock(r,c).move(r, c+1)
-                            c += 1
-                        if c < 3 and self.playGrid[r][c+1] == self.playGrid[r][c]:
-                            self.playGrid[r][c+1] *= 2
-                            self.playGrid[r][c] = 0
-
-                            self.getBlock(r,c+1).double()
-                            self.getBlock(r,c+1).pulse()
-                            self.removeBlock(self.getBlock(r,c))
-
-        if direction == 'left':
-            for row in range(4):
-                for col in range(1,4):
-                    if self.playGrid[row][col] != 0:
-                        r = row; c = col
-                        while c > 0 and self.playGrid[r][c-1] == 0:
-                            self.playGrid[r][c-1] = self.playGrid[r][c]
-                            self.playGrid[r][c] = 0
-
-                            self.getBlock(r,c).move(r, c-1)
-                            c -= 1
-                        if c > 0 and self.playGrid[r][c-1] == self.playGrid[r][c]:
-                            self.playGrid[r][c-1] *= 2
-                            self.playGrid[r][c] = 0
-
-                            self.getBlock(r,c-1).double()
-                            self.getBlock(r,c-1).pulse()
-                            self.removeBlock(self.getBlock(r,c))
-        if old_grid != self.playGrid:
+        plan = self.plans.get(direction)
+        if plan is None:
+            plan = self.plan(direction)
+        if plan.spawn is None:
+            return
+
+        self.undos.extend((board.from_grid(self.playGrid), self.score, self.moves))
+        if len(self.undos) > 3*UNDO_LIMIT:
+            del self.undos[:3]
+        for (row, col), block in plan.cells.items():
+            block.move(row, col)
+        for block in plan.doubled:
+            block.double()
+            block.pulse()
+        for block in plan.removed:
+            self.removeBlock(block)
+        for row in range(4):
+            self.playGrid[row][:] = plan.grid[row]
+        self.plans = {}
+        self.score += plan.score
+        self.moves += 1
+
+        if plan.block is not None and random.getstate() == plan.rng_before:
+            random.setstate(plan.rng_after)
+            self.place_block(plan.block)
+        else:
             self.spawn_block()
 
+    def set_board(self, b):
+        """
+        Replaces all the blocks with new ones for the given board
+
+        Parameter b: the board
+        Precondition: [int] a packed board
+        """
+        self.install(self.make_blocks(b))
+
+    def make_blocks(self, b):
+        """
+        Returns: a list of new (not yet placed) blocks for the tiles of a packed board
+
+        Parameter b: the board
+        Precondition: [int] a packed board
+        """
+        grid = board.to_grid(b)
+        return [self.make_block(row, col, grid[row][col])
+                for row in range(4) for col in range(4) if grid[row][col]]
+
+    def install(self, blocks):
+        """
+        Replaces all the blocks with the given ones
+
+        Parameter blocks: the blocks
+        Precondition: [list] of blocks made by make_block, at most one per position
+        """
+        self.blocks = []
+        self.plans = {}
+        for row in range(4):
+            self.playGrid[row][:] = [0,0,0,0]
+        for block in blocks:
+            self.place_block(block)
+
+    def undo(self):
+        """
+        Takes back the last move, if there is one in the undo history
+
+        The random module is not wound back, so the move may spawn differently if it
+        is made again.
+        """
+        if self.undos:
+            b, self.score, self.moves = self.undos[-3:]
+            del self.undos[-3:]
+            self.set_board(b)
+
+    def snapshot(self):
+        """
+        Returns: the state of this game (with the random module) as a save
+
+        See the module savegame for the format.
+        """
+        return savegame.encode(board.from_grid(self.playGrid), self.score, self.moves,
+                               random.getstate(), self.undos)
+
+    def restore(self, data):
+        """
+        Puts this game (and the random module) in the state of a save
+
+        Parameter data: the save
+        Precondition: [bytes] returned by snapshot
+
+        Raises ValueError if data is not a valid save, leaving this game unchanged.
+        """
+        b, score, moves, rng, undos = savegame.decode(data)
+        # Everything that can fail comes before the first change
+        blocks = self.make_blocks(b)
+        random.setstate(rng)
+        self.install(blocks)
+        self.score = score
+        self.moves = moves
+        self.undos = undos
+
     def print_grid(self):
         """
         Prints current state of the game in an easy to read 
@@ -165,14 +311,18 @@ class Twenty():
         print(' ------- ------- ------- -------')
     
     def check_for_moves(self, theInput):
-        moves = ('up', 'down', 'left', 'right')
-        for direction in moves:
+        for direction in MOVES:
             if theInput.is_key_down(direction) and direction not in self.pressed:
                 self.move(direction)
                 self.print_grid()
                 self.pressed.append(direction)
             elif not theInput.is_key_down(direction) and direction in self.pressed:
                 self.pressed.remove(direction)
+        if theInput.is_key_down(UNDO_KEY) and UNDO_KEY not in self.pressed:
+            self.undo()
+            self.pressed.append(UNDO_KEY)
+        elif not theInput.is_key_down(UNDO_KEY) and UNDO_KEY in self.pressed:
+            self.pressed.remove(UNDO_KEY)
 
 
     def update(self, theInput, dt):
@@ -202,8 +352,26 @@ class Block():
                 self.rect.width += GROWTH_RATE
             if self.rect.height < REC_SIDE:
                 self.rect.height += GROWTH_RATE
-            self.rect.x += self.dx * MOVE_TIME
-            self.rect.y += self.dy * MOVE_TIME
+            if self.dx or self.dy:
+                self.rect.x += self.dx * MOVE_TIME
+                self.rect.y += self.dy * MOVE_TIME
+
+    def aim(self):
+        """
+        Aims the label of this block at the center of its cell, for the next update
+
+        Each update slides the label a fraction MOVE_TIME of the rest of the way.  Once
+        it is within SNAP_DISTANCE it is put exactly on the center, so a block at rest
+        changes nothing about its label from frame to frame.
+        """
+        x, y = cell_center(self.row, self.col)
+        self.dx = x - self.rect.x
+        self.dy = y - self.rect.y
+        if (self.dx or self.dy) and abs(self.dx) < SNAP_DISTANCE and abs(self.dy) < SNAP_DISTANCE:
+            self.rect.x = x
+            self.rect.y = y
+            self.dx = 0
+            self.dy = 0
 
     def pulse(self):
         self.pulsing = True
@@ -238,6 +406,9 @@ class Block():
 
     def double(self):
         self.val *= 2
+        if self.rect is not None:
+            self.rect.text = str(self.val)
+            self.rect.fillcolor = tile_color(self.val)
 
     def __init__(self, row, col, value):
         self.row = row
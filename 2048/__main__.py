@@ -0,0 +1,40 @@
+"""
+Runs the game, or one of the command line tools.
+
+    python 2048                     plays the game
+    python 2048 <tool> [options]    runs a tool (see TOOLS), e.g.
+
+    python 2048 simulate greedy --games 100000
+"""
+import importlib
+import os
+import sys
+
+# The command line tools, and the modules that implement them
+TOOLS = {'simulate': 'simulate', 'evaluate': 'evaluate', 'tune': 'tuner',
+         'merge': 'merge', 'replay': 'replay', 'archive': 'archive', 'book': 'openingbook',
+         'spectate': 'spectator', 'view': 'GUI',
+         'dataset': 'dataset', 'history': 'history',
+         'server': 'server', 'cluster': 'cluster', 'arena': 'arena',
+         'fuzz': 'fuzz', 'bench': 'bench', 'perfgate': 'perfgate'}
+
+
+def main(argv):
+    """
+    Runs the game, or the tool named by the first argument.
+    """
+    if not argv:
+        from consts import GAME_WIDTH, GAME_HEIGHT
+        from GUI import TwentyGUI
+        TwentyGUI(width=GAME_WIDTH, height=GAME_HEIGHT).run()
+    elif argv[0] in TOOLS:
+        # Keep Kivy from parsing the options of the tool
+        os.environ.setdefault('KIVY_NO_ARGS', '1')
+        importlib.import_module(TOOLS[argv[0]]).main(argv[1:])
+    else:
+        print('usage: python 2048 [%s] [options]' % '|'.join(sorted(TOOLS)), file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
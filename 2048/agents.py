@@ -0,0 +1,322 @@
+"""
+Bots that play the 2048 rules headlessly, on packed boards.
+
+An agent is any object with two methods:
+
+    reset(seed) is called once at the start of every game
+    choose(board) returns a direction from the module board, or None to give up
+
+Agents are deterministic once reset, so a game is fully determined by its seed and
+its agent.  That is what lets tools compare agents on common random numbers (the same
+seeds for every agent).
+
+The dict AGENTS maps a short name to each agent class, for command line tools.
+"""
+import collections
+import json
+import random
+
+import board
+import search
+from openingbook import OpeningBook
+from transposition import LocalTable
+
+GameResult = collections.namedtuple('GameResult', ['seed', 'score', 'max_tile', 'moves'])
+
+
+class Agent(object):
+    """
+    The base class for agents.  Subclasses must implement choose.
+    """
+
+    def reset(self, seed):
+        """
+        Prepares the agent for a new game.
+
+        Parameter seed: the seed of the new game
+        Precondition: [int]
+        """
+        pass
+
+    def choose(self, b):
+        """
+        Returns: the direction to move on board b, or None to end the game
+
+        Parameter b: the current board
+        Precondition: [int] a packed board
+        """
+        raise NotImplementedError()
+
+
+class RandomAgent(Agent):
+    """
+    An agent that picks uniformly among the legal moves.
+    """
+
+    def __init__(self):
+        self._rng = random.Random()
+
+    def reset(self, seed):
+        # Offset so the agent does not replay the spawn sequence of the game
+        self._rng.seed(seed ^ 0x5EED)
+
+    def choose(self, b):
+        moves = board.legal_moves(b)
+        return self._rng.choice(moves) if moves else None
+
+
+class GreedyAgent(Agent):
+    """
+    An agent that picks the move whose afterstate has the best heuristic value.
+
+    Instance Variables:
+        weights: [search.Weights] the heuristic feature weights
+    """
+
+    def __init__(self, weights=search.DEFAULT_WEIGHTS):
+        """
+        Creates a new greedy agent.
+
+        Parameter weights: the heuristic feature weights
+        Precondition: [search.Weights] (or any sequence of 4 numbers)
+        """
+        self._search = search.Search(weights)
+        self.weights = self._search.weights
+
+    def choose(self, b):
+        best = None
+        value = None
+        for direction in range(4):
+            after = board.shift(b, direction)
+            if after != b:
+                score = self._search.evaluate(after)
+                if best is None or score > value:
+                    best = direction
+                    value = score
+        return best
+
+
+class ExpectimaxAgent(Agent):
+    """
+    An agent that picks moves with a depth-limited expectimax search.
+
+    The search caches chance nodes in a LocalTable, which is cleared between games.
+
+    Instance Variables:
+        search: [search.Expectimax] the search used to choose moves
+    """
+
+    def __init__(self, depth=2, weights=search.DEFAULT_WEIGHTS, table=None):
+        """
+        Creates a new expectimax agent.
+
+        Parameter depth: the number of chance layers to search
+        Precondition: [int] depth > 0
+
+        Parameter weights: the heuristic feature weights
+        Precondition: [search.Weights] (or any sequence of 4 numbers)
+
+        Parameter table: the transposition table, or None for a fresh LocalTable
+        Precondition: a transposition table or None
+        """
+        self._own_table = table is None
+        self.search = search.Expectimax(depth, weights, LocalTable() if table is None else table)
+
+    def reset(self, seed):
+        if self._own_table:
+            self.search.table.clear()
+
+    def choose(self, b):
+        return self.search.choose(b)
+
+
+class BeamAgent(Agent):
+    """
+    An agent that picks moves with a beam search, so every move costs about the same.
+
+    Instance Variables:
+        search: [search.BeamSearch] the search used to choose moves
+    """
+
+    def __init__(self, width=8, depth=3, samples=4, weights=search.DEFAULT_WEIGHTS):
+        """
+        Creates a new beam agent.
+
+        Parameter width: the number of afterstates kept per ply
+        Precondition: [int] width > 0
+
+        Parameter depth: the number of plies searched
+        Precondition: [int] depth > 0
+
+        Parameter samples: the number of spawns sampled per chance node
+        Precondition: [int] samples > 0
+
+        Parameter weights: the heuristic feature weights
+        Precondition: [search.Weights] (or any sequence of 4 numbers)
+        """
+        self.search = search.BeamSearch(width, depth, samples, weights)
+
+    def reset(self, seed):
+        self.search.rng.seed(seed ^ 0xBEA5)
+
+    def choose(self, b):
+        return self.search.choose(b)
+
+
+class BookAgent(Agent):
+    """
+    An agent that plays from an opening book, and searches once out of book.
+
+    Instance Variables:
+        book: [OpeningBook] the opening book
+        fallback: [ExpectimaxAgent] the agent used for positions not in the book
+    """
+
+    def __init__(self, path, depth=2, weights=search.DEFAULT_WEIGHTS):
+        """
+        Creates a new book agent.
+
+        Parameter path: the opening book file
+        Precondition: [str] a file written by openingbook.build
+
+        Parameter depth: the search depth out of book
+        Precondition: [int] depth > 0
+
+        Parameter weights: the heuristic feature weights out of book
+        Precondition: [search.Weights] (or any sequence of 4 numbers)
+        """
+        self.book = OpeningBook(path)
+        self.fallback = ExpectimaxAgent(depth, weights)
+
+    def reset(self, seed):
+        self.fallback.reset(seed)
+
+    def choose(self, b):
+        move = self.book.lookup(b)
+        return self.fallback.choose(b) if move is None else move
+
+
+AGENTS = {'random': RandomAgent, 'greedy': GreedyAgent, 'expectimax': ExpectimaxAgent,
+          'beam': BeamAgent, 'book': BookAgent}
+
+
+def make_agent(name, **options):
+    """
+    Returns: a new agent of the given kind
+
+    Parameter name: the kind of agent
+    Precondition: [str] a key of AGENTS
+
+    Parameter options: keyword arguments for the agent constructor
+    Precondition: valid for that agent
+    """
+    assert name in AGENTS, '%s is not a known agent' % repr(name)
+    return AGENTS[name](**options)
+
+
+def game_seed(run_seed, index):
+    """
+    Returns: the seed of game number index in a run
+
+    Seeds are a hash (splitmix64) of the run seed and the index, so any game of a
+    run can be replayed on its own, in any order and on any worker.
+
+    Parameter run_seed: the seed of the whole run
+    Precondition: [int] run_seed >= 0
+
+    Parameter index: the game number
+    Precondition: [int] index >= 0
+    """
+    mask = 0xFFFFFFFFFFFFFFFF
+    z = (run_seed*0x9E3779B97F4A7C15 + (index+1)*0xD1B54A32D192ED03) & mask
+    z = ((z ^ (z >> 30))*0xBF58476D1CE4E5B9) & mask
+    z = ((z ^ (z >> 27))*0x94D049BB133111EB) & mask
+    return (z ^ (z >> 31)) >> 1
+
+
+def play_game(agent, seed, max_moves=None, record=None):
+    """
+    Returns: the GameResult of agent playing one game from the given seed
+
+    The game ends when there are no legal moves, when the agent returns None, or
+    after max_moves moves.
+
+    Parameter agent: the agent to play
+    Precondition: [Agent] an agent
+
+    Parameter seed: the seed for the spawns
+    Precondition: [int]
+
+    Parameter max_moves: the move limit, or None for no limit
+    Precondition: [int] max_moves > 0, or None
+
+    Parameter record: a list to append every move to, or None
+    Precondition: [list] or None
+    """
+    rng = random.Random(seed)
+    agent.reset(seed)
+    b = board.new_board(rng)
+    score = 0
+    moves = 0
+    while max_moves is None or moves < max_moves:
+        direction = agent.choose(b)
+        if direction is None:
+            break
+        if record is not None:
+            record.append(direction)
+        b, gain = board.play(b, direction, rng)
+        score += gain
+        moves += 1
+    return GameResult(seed, score, board.max_tile(b), moves)
+
+
+def parse_agent(spec):
+    """
+    Returns: a tuple (name, options) for a command line agent description
+
+    A description is an agent name, optionally followed by a colon and a comma
+    separated list of key=value options.  Values are read as JSON where possible,
+    so 'expectimax:depth=1,weights=[2,1,0,1]' gives the name 'expectimax' and the
+    options {'depth': 1, 'weights': [2,1,0,1]}.
+
+    Parameter spec: the agent description
+    Precondition: [str] a description whose name is a key of AGENTS
+    """
+    name, _, rest = spec.partition(':')
+    assert name in AGENTS, '%s is not a known agent' % repr(name)
+    items = []
+    nesting = 0
+    start = 0
+    for i, char in enumerate(rest):
+        if char in '[{':
+            nesting += 1
+        elif char in ']}':
+            nesting -= 1
+        elif char == ',' and nesting == 0:
+            items.append(rest[start:i])
+            start = i+1
+    if rest:
+        items.append(rest[start:])
+
+    options = {}
+    for item in items:
+        key, _, value = item.partition('=')
+        try:
+            options[key] = json.loads(value)
+        except ValueError:
+            options[key] = value
+    return name, options
+
+
+def describe_agent(spec):
+    """
+    Returns: the command line description of an agent, the inverse of parse_agent
+
+    Parameter spec: the agent
+    Precondition: [tuple] a pair (name, options) as returned by parse_agent
+    """
+    name, options = spec
+    if not options:
+        return name
+    return '%s:%s' % (name, ','.join('%s=%s' % (key, json.dumps(options[key], separators=(',', ':')))
+                                     for key in sorted(options)))
@@ -0,0 +1,351 @@
+"""
+A replay archive with random access to any game.
+
+A replay file (see the module replay) can only be read from the start.  An archive
+holds the same records, but in compressed blocks of a fixed number of games, with an
+index of the blocks at the end of the file:
+
+    magic    6 bytes   b'2048RA'
+    version  uint16    FORMAT_VERSION
+    codec    uint16    CODECS.index(codec)
+    pad      uint16    0
+    block    uint32    the number of games in every block but the last
+    length   uint32    the size of the metadata
+    metadata length bytes of UTF-8 JSON
+
+    blocks   one compressed block after another
+
+    index    for every block, its offset and compressed size (2 x uint64)
+    trailer  index offset, block count and game count (3 x uint64), then the magic
+
+A block, once decompressed, is the number of games in it (uint32), then the offset
+of every game from the end of this table (uint32 each), then the games themselves
+in the record format of a replay file.  All numbers are little-endian.
+
+ArchiveReader memory-maps the file.  Game i is in block i // block, so reading it
+takes one index lookup and one block decompression, however big the archive is.
+"""
+import array
+import json
+import lzma
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+import replay
+
+MAGIC = b'2048RA'
+FORMAT_VERSION = 1
+CODECS = ('none', 'zlib', 'lzma')
+_HEADER = struct.Struct('<6sHHHII')
+_TRAILER = struct.Struct('<QQQ6s')
+_RECORD = struct.Struct('<QI')
+
+
+def _compress(data, codec):
+    """
+    Returns: data compressed with the given codec
+    """
+    if codec == 'zlib':
+        return zlib.compress(data, 6)
+    elif codec == 'lzma':
+        return lzma.compress(data, preset=6)
+    return bytes(data)
+
+
+def _decompress(data, codec):
+    """
+    Returns: data decompressed with the given codec
+    """
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    elif codec == 'lzma':
+        return lzma.decompress(data)
+    return bytes(data)
+
+
+class ArchiveWriter(object):
+    """
+    An instance writes games to a new archive.
+
+    The archive is written to a temporary file, which replaces path when it is closed.
+
+    Instance Variables:
+        path: [str] the archive file
+        codec: [str] the compression, one of CODECS
+        block: [int > 0] the number of games in a block
+        count: [int >= 0] the number of games written
+    """
+
+    def __init__(self, path, codec='zlib', block=1024, metadata=None):
+        """
+        Creates an archive and writes its header.
+
+        Parameter path: the archive file
+        Precondition: [str] a file name
+
+        Parameter codec: the compression
+        Precondition: [str] one of CODECS
+
+        Parameter block: the number of games in a block
+        Precondition: [int] block > 0
+
+        Parameter metadata: information about the games, such as the agent
+        Precondition: [dict] JSON-friendly, or None
+        """
+        assert codec in CODECS, '%s is not a known codec' % repr(codec)
+        assert type(block) == int and block > 0, '%s is not a valid block size' % repr(block)
+        self.path = path
+        self.codec = codec
+        self.block = block
+        self.count = 0
+        self._index = []
+        self._offsets = []
+        self._records = bytearray()
+        text = json.dumps(metadata or {}).encode('utf-8')
+        self._file = open(path+'.tmp', 'wb')
+        self._file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, CODECS.index(codec), 0, block,
+                                      len(text)))
+        self._file.write(text)
+
+    def write(self, seed, moves):
+        """
+        Appends a game.
+
+        Parameter seed: the seed of the game
+        Precondition: [int] 0 <= seed < 2**64
+
+        Parameter moves: the moves of the game
+        Precondition: [bytes, bytearray or list] of directions from the module board
+        """
+        self._offsets.append(len(self._records))
+        self._records += _RECORD.pack(seed, len(moves))
+        self._records += replay.pack_moves(moves)
+        self.count += 1
+        if len(self._offsets) == self.block:
+            self._flush()
+
+    def _flush(self):
+        """
+        Compresses and writes the games of the current block.
+        """
+        count = len(self._offsets)
+        data = struct.pack('<I%dI' % count, count, *self._offsets)+self._records
+        data = _compress(data, self.codec)
+        self._index.append((self._file.tell(), len(data)))
+        self._file.write(data)
+        self._offsets = []
+        self._records = bytearray()
+
+    def close(self):
+        """
+        Writes the last block and the index, and moves the archive into place.
+        """
+        if self._offsets:
+            self._flush()
+        start = self._file.tell()
+        for entry in self._index:
+            self._file.write(struct.pack('<QQ', *entry))
+        self._file.write(_TRAILER.pack(start, len(self._index), self.count, MAGIC))
+        self._file.close()
+        os.replace(self.path+'.tmp', self.path)
+
+
+class ArchiveReader(object):
+    """
+    An instance gives random access to the games of an archive.
+
+    Instance Variables:
+        path: [str] the archive file
+        codec: [str] the compression, one of CODECS
+        block: [int > 0] the number of games in a block
+        metadata: [dict] the metadata written with the archive
+    """
+
+    def __init__(self, path):
+        """
+        Opens an archive.
+
+        Parameter path: the archive file
+        Precondition: [str] a file written by ArchiveWriter
+        """
+        self.path = path
+        with open(path, 'rb') as file:
+            try:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # An empty file cannot be mapped
+                raise IOError('%s is not a replay archive' % repr(path))
+        try:
+            self._open()
+        except (IOError, ValueError):
+            self._map.close()
+            raise IOError('%s is not a replay archive' % repr(path))
+
+    def _open(self):
+        """
+        Reads the header, trailer and index of the mapped archive
+
+        Raises IOError if they are not those of an archive (a bad codec included), or
+        ValueError if the metadata is not JSON.
+        """
+        if len(self._map) < _HEADER.size+_TRAILER.size:
+            raise IOError('the file is too short')
+        magic, version, codec, _, self.block, length = _HEADER.unpack_from(self._map, 0)
+        start, blocks, self._count, end = _TRAILER.unpack_from(self._map,
+                                                               len(self._map)-_TRAILER.size)
+        if magic != MAGIC or version != FORMAT_VERSION or end != MAGIC:
+            raise IOError('the file has no archive header and trailer')
+        if start+16*blocks > len(self._map)-_TRAILER.size:
+            raise IOError('the index is truncated')
+        if codec >= len(CODECS):
+            raise IOError('unknown codec %d' % codec)
+        self.codec = CODECS[codec]
+        self.metadata = json.loads(self._map[_HEADER.size:_HEADER.size+length].decode('utf-8'))
+        self._view = memoryview(self._map)
+        index = self._view[start:start+16*blocks]
+        if sys.byteorder == 'little':
+            self._index = index.cast('Q')
+        else:
+            self._index = array.array('Q', index.tobytes())
+            self._index.byteswap()
+        self._cached = None
+        self._data = None
+
+    def __len__(self):
+        return self._count
+
+    def _load(self, number):
+        """
+        Returns: the decompressed block with the given number
+
+        The last block read is cached, so reading a range of games decompresses each
+        block only once.
+        """
+        if self._cached != number:
+            offset = self._index[2*number]
+            size = self._index[2*number+1]
+            self._data = _decompress(self._view[offset:offset+size], self.codec)
+            self._cached = number
+        return self._data
+
+    def game(self, index):
+        """
+        Returns: a pair (seed, moves) for the game with the given index
+
+        Parameter index: the index of the game
+        Precondition: [int] 0 <= index < len(self)
+        """
+        if not 0 <= index < self._count:
+            raise IndexError('%s has no game %s' % (repr(self.path), repr(index)))
+        data = self._load(index // self.block)
+        count = struct.unpack_from('<I', data, 0)[0]
+        offset = 4+4*count+struct.unpack_from('<I', data, 4+4*(index % self.block))[0]
+        seed, moves = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        return seed, replay.unpack_moves(data[offset:offset+(moves+3)//4], moves)
+
+    def games(self, start=0, stop=None):
+        """
+        Yields: a pair (seed, moves) for every game from start to stop-1
+
+        Parameter start: the index of the first game
+        Precondition: [int] 0 <= start <= len(self)
+
+        Parameter stop: the end of the range, or None for the end of the archive
+        Precondition: [int] start <= stop <= len(self), or None
+        """
+        stop = self._count if stop is None else stop
+        for index in range(start, stop):
+            yield self.game(index)
+
+    def close(self):
+        """
+        Unmaps the archive file.
+        """
+        self._data = None
+        if isinstance(self._index, memoryview):
+            self._index.release()
+        self._view.release()
+        self._map.close()
+
+
+def convert(source, path, codec='zlib', block=1024):
+    """
+    Returns: the number of games copied from a replay file into a new archive
+
+    Parameter source: the replay file
+    Precondition: [str] a file written by replay.ReplayWriter
+
+    Parameter path: the archive file
+    Precondition: [str] a file name
+
+    Parameter codec: the compression
+    Precondition: [str] one of CODECS
+
+    Parameter block: the number of games in a block
+    Precondition: [int] block > 0
+    """
+    reader = replay.ReplayReader(source)
+    writer = ArchiveWriter(path, codec, block, reader.metadata)
+    for seed, moves in reader:
+        writer.write(seed, moves)
+    writer.close()
+    reader.close()
+    return writer.count
+
+
+def main(argv=None):
+    """
+    Builds replay archives and reads games from them.
+    """
+    import argparse, time
+    parser = argparse.ArgumentParser(prog='archive', description=main.__doc__.strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('build', help='convert a replay file to an archive')
+    command.add_argument('input', help='the replay file')
+    command.add_argument('output', help='the archive to write')
+    command.add_argument('--codec', choices=CODECS, default='zlib')
+    command.add_argument('--block', type=int, default=1024, help='games per block')
+    command = commands.add_parser('info', help='describe an archive')
+    command.add_argument('input', help='the archive')
+    command = commands.add_parser('get', help='extract one game or a range of games')
+    command.add_argument('input', help='the archive')
+    command.add_argument('start', type=int, help='the index of the (first) game')
+    command.add_argument('stop', type=int, nargs='?', help='the end of the range')
+    command.add_argument('--output', help='write the games to this replay file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        count = convert(args.input, args.output, args.codec, args.block)
+        print('%d games in %.1fs: %d bytes (replay file %d bytes)' %
+              (count, time.perf_counter()-start, os.path.getsize(args.output),
+               os.path.getsize(args.input)))
+        return
+
+    reader = ArchiveReader(args.input)
+    if args.command == 'info':
+        print('%d games in blocks of %d, %s, metadata %s' %
+              (len(reader), reader.block, reader.codec, json.dumps(reader.metadata)))
+    else:
+        stop = args.start+1 if args.stop is None else args.stop
+        if not 0 <= args.start < stop <= len(reader):
+            parser.error('%s has games 0 to %d' % (repr(args.input), len(reader)-1))
+        games = reader.games(args.start, stop)
+        if args.output is not None:
+            writer = replay.ReplayWriter(args.output, reader.metadata)
+            for seed, moves in games:
+                writer.write(seed, moves)
+            writer.close()
+        else:
+            for index, (seed, moves) in enumerate(games, args.start):
+                score = replay.fast_forward(seed, moves)[1]
+                print('game %d: seed %d, %d moves, score %d' % (index, seed, len(moves), score))
+    reader.close()
+
+
+if __name__ == '__main__':
+    main()
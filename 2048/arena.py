@@ -0,0 +1,531 @@
+"""
+An arena where bots in other processes, written in any language, play 2048.
+
+The arena listens on a Unix or TCP socket.  A bot connects, and the arena plays a
+fixed set of games with it (the same seeds for every bot, see agents.game_seed), by
+the rules of Twenty: it sends the bot the board of a game, the bot answers with a
+move, and the arena applies the move, spawns a tile and sends the next board.  Many
+games are in flight at once on one connection, up to a window, so a bot never waits
+for the arena and the connection is never idle.
+
+The protocol is binary, with all numbers little-endian.  On connecting, the arena
+sends HELLO (the magic b'2048AR', the protocol version and the window).  Then every
+frame from the arena is STATE, 12 bytes:
+
+    game     uint32    the number of the game on this connection
+    board    uint64    the packed board (see the module board)
+
+and every frame from the bot is MOVE, 5 bytes:
+
+    game     uint32    the game of the board being answered
+    move     uint8     UP, DOWN, LEFT or RIGHT (0-3), or RESIGN (255)
+
+A bot may answer the boards of different games in any order.  Games are numbered
+from 0 in the order they start, so a number higher than any before is a new game.  An
+illegal move leaves the board as it is (it still counts as a move, as in
+agents.play_game), and the same board is sent again.  A game ends when no move is
+legal, when the bot resigns, after STUCK illegal moves in a row, after the move
+limit if there is one, or when the bot takes longer than the timeout to answer.
+When every game is over the arena closes the connection.  A bot that sends anything
+else is disconnected.
+
+The arena reads into one buffer per connection, reused for the whole match, and parses
+the frames in place through a memoryview.  The window is the backpressure: no more
+than window boards of a bot are ever waiting for an answer, and the arena also stops
+sending when the bot stops reading.
+
+Run a match of 1000 games against a bot, here the built-in bot client playing greedy
+(which shows the protocol from the bot side), as
+
+    python 2048 arena run --unix /tmp/arena.sock --games 1000 --window 64
+    python 2048 arena bot greedy --unix /tmp/arena.sock
+
+or let the arena start the bots itself with --spawn greedy.
+"""
+import asyncio
+import json
+import random
+import socket
+import struct
+import time
+
+import agents
+import board
+import stats
+from evaluate import AgentStats
+
+MAGIC = b'2048AR'
+PROTOCOL_VERSION = 1
+
+HELLO = struct.Struct('<6sHH')
+STATE = struct.Struct('<IQ')
+MOVE = struct.Struct('<IB')
+
+# The move of a bot that gives up the game
+RESIGN = 255
+
+# The illegal moves in a row that end a game (the board does not change, so a bot
+# that keeps answering the same move would otherwise play it forever)
+STUCK = 16
+
+# The size of the receive buffer of a connection
+BUFFER = 1 << 16
+
+
+class Match(asyncio.BufferedProtocol):
+    """
+    An instance plays the games of one arena with one bot connection.
+
+    Instance Variables:
+        results: [AgentStats] the finished games
+        latency: [stats.Histogram] the microseconds from sending a board to its answer
+        timeouts: [int >= 0] the games ended because the bot was too slow
+        resigned: [int >= 0] the games the bot gave up
+        illegal: [int >= 0] the illegal moves
+        stuck: [int >= 0] the games ended after STUCK illegal moves in a row
+        error: [str] why the bot was disconnected, or None
+        seconds: [float >= 0] the length of the match, once it is over
+        done: [asyncio.Future] completed when the match is over
+    """
+
+    def __init__(self, arena):
+        """
+        Creates a match for the next connection to an arena.
+
+        Parameter arena: the arena
+        Precondition: [Arena]
+        """
+        self.results = AgentStats()
+        self.latency = stats.Histogram()
+        self.timeouts = 0
+        self.resigned = 0
+        self.illegal = 0
+        self.stuck = 0
+        self.error = None
+        self.seconds = 0.0
+        self.done = asyncio.get_running_loop().create_future()
+        self._arena = arena
+        self._buffer = bytearray(BUFFER)
+        self._view = memoryview(self._buffer)
+        self._filled = 0
+        self._out = bytearray()
+        self._paused = False
+        self._transport = None
+        self._sweeper = None
+        # The live games by number, each a list
+        # [seed, rng, board, score, moves, sent, illegal moves in a row]
+        self._games = {}
+        self._started = 0
+        self._start = 0.0
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._start = time.perf_counter()
+        self._out += HELLO.pack(MAGIC, PROTOCOL_VERSION, self._arena.window)
+        while self._started < self._arena.games and len(self._games) < self._arena.window:
+            self._new_game()
+        self._flush()
+        self._sweeper = asyncio.ensure_future(self._sweep())
+
+    def connection_lost(self, exc):
+        if self._games and self.error is None:
+            self.error = 'the bot disconnected'
+        self._finish()
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._flush()
+
+    def get_buffer(self, sizehint):
+        return self._view[self._filled:]
+
+    def buffer_updated(self, nbytes):
+        self._filled += nbytes
+        view = self._view
+        size = MOVE.size
+        end = self._filled-self._filled % size
+        for offset in range(0, end, size):
+            if not self._answer(*MOVE.unpack_from(view, offset)):
+                return
+        # Keep the start of an incomplete frame for the next read
+        self._buffer[:self._filled-end] = view[end:self._filled]
+        self._filled -= end
+        self._flush()
+
+    def _new_game(self):
+        """
+        Starts the next game, sending its first board.
+        """
+        seed = agents.game_seed(self._arena.seed, self._started)
+        rng = random.Random(seed)
+        game = [seed, rng, board.new_board(rng), 0, 0, 0.0, 0]
+        self._games[self._started] = game
+        self._send(self._started, game)
+        self._started += 1
+
+    def _send(self, number, game):
+        """
+        Queues the board of a game, to go out with the next flush.
+        """
+        game[5] = time.perf_counter()
+        self._out += STATE.pack(number, game[2])
+
+    def _flush(self):
+        """
+        Writes the queued boards in one write, unless the bot has stopped reading.
+        """
+        if self._out and not self._paused and self._transport is not None:
+            self._transport.write(bytes(self._out))
+            del self._out[:]
+
+    def _answer(self, number, move):
+        """
+        Returns: True if the answer of the bot is valid, after playing it
+
+        A late answer, to a game that has timed out, is ignored.
+        """
+        game = self._games.get(number)
+        if game is None:
+            if number < self._started:
+                return True
+            return self._disconnect('the bot answered game %d, which has not started' % number)
+        if move > board.RIGHT and move != RESIGN:
+            return self._disconnect('the bot sent the move %d' % move)
+        self.latency.add(int(1e6*(time.perf_counter()-game[5])))
+        if move == RESIGN:
+            self.resigned += 1
+            self._end_game(number)
+            return True
+        after, gain = board.play(game[2], move, game[1])
+        if after == game[2]:
+            self.illegal += 1
+            game[6] += 1
+        else:
+            game[6] = 0
+        game[2] = after
+        game[3] += gain
+        game[4] += 1
+        limit = self._arena.max_moves
+        if game[6] >= STUCK:
+            self.stuck += 1
+            self._end_game(number)
+        elif board.is_over(after) or (limit is not None and game[4] >= limit):
+            self._end_game(number)
+        else:
+            self._send(number, game)
+        return True
+
+    def _end_game(self, number):
+        """
+        Records a finished game, and starts the next one if there is one.
+        """
+        seed, rng, b, score, moves, sent, illegal = self._games.pop(number)
+        self.results.add(agents.GameResult(seed, score, board.max_tile(b), moves))
+        if self._started < self._arena.games:
+            self._new_game()
+        elif not self._games:
+            self._transport.close()
+
+    def _disconnect(self, error):
+        """
+        Returns: False, after dropping a bot that broke the protocol
+        """
+        self.error = error
+        self._transport.abort()
+        return False
+
+    async def _sweep(self):
+        """
+        Ends the games whose bot has not answered within the timeout.
+        """
+        timeout = self._arena.timeout
+        while True:
+            await asyncio.sleep(timeout/4)
+            late = time.perf_counter()-timeout
+            for number in [number for number, game in self._games.items() if game[5] < late]:
+                self.timeouts += 1
+                self._end_game(number)
+            self._flush()
+
+    def _finish(self):
+        """
+        Ends the match.
+        """
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        self.seconds = time.perf_counter()-self._start
+        if not self.done.done():
+            self.done.set_result(self)
+
+    def report(self, confidence=0.95):
+        """
+        Returns: a JSON-friendly dict summarizing the match
+
+        This is the agent report of AgentStats, plus the timeouts, resignations,
+        illegal moves and the games they ended, the moves per second, and the median
+        and 99th percentile time the bot took to answer, in milliseconds.
+
+        Parameter confidence: the confidence level of the intervals
+        Precondition: [float] 0 < confidence < 1
+        """
+        result = self.results.report(confidence)
+        moves = self.results.moves.total
+        result.update({'timeouts': self.timeouts, 'resigned': self.resigned,
+                       'illegal_moves': self.illegal, 'stuck': self.stuck,
+                       'error': self.error,
+                       'seconds': self.seconds,
+                       'moves_per_second': moves/self.seconds if self.seconds else 0.0})
+        if self.latency.count:
+            result['latency_median_ms'] = self.latency.percentile(50)/1000.0
+            result['latency_p99_ms'] = self.latency.percentile(99)/1000.0
+        return result
+
+
+class Arena(object):
+    """
+    An instance runs matches with the bots that connect to it.
+
+    Instance Variables:
+        games: [int > 0] the number of games of a match
+        seed: [int >= 0] the run seed of the games
+        window: [int > 0] the most games of a bot waiting for its answer at once
+        timeout: [float > 0] the seconds a bot has to answer a board
+        max_moves: [int > 0] the move limit of a game, or None for no limit
+    """
+
+    def __init__(self, games, seed=0, window=64, timeout=1.0, max_moves=None):
+        """
+        Creates an arena.
+
+        Parameter games: the number of games of a match
+        Precondition: [int] games > 0
+
+        Parameter seed: the run seed of the games
+        Precondition: [int] seed >= 0
+
+        Parameter window: the most games of a bot waiting for its answer at once
+        Precondition: [int] 0 < window < 65536
+
+        Parameter timeout: the seconds a bot has to answer a board
+        Precondition: [int or float] timeout > 0
+
+        Parameter max_moves: the move limit of a game, or None for no limit
+        Precondition: [int] max_moves > 0, or None
+        """
+        assert type(games) == int and games > 0, '%s is not a valid game count' % repr(games)
+        assert type(window) == int and 0 < window < 65536, '%s is not a valid window' % repr(window)
+        assert timeout > 0, '%s is not a valid timeout' % repr(timeout)
+        self.games = games
+        self.seed = seed
+        self.window = window
+        self.timeout = timeout
+        self.max_moves = max_moves
+
+    async def run(self, host=None, port=None, path=None, bots=1, ready=None):
+        """
+        Returns: the list of the Matches of the first bots bots to connect, in order
+
+        Listens on a Unix socket if path is given, or else on TCP, until every match
+        is over.
+
+        Parameter host: the TCP host, or None for all interfaces
+        Precondition: [str] or None
+
+        Parameter port: the TCP port
+        Precondition: [int] 0 <= port < 65536, or None with a path
+
+        Parameter path: the Unix socket, or None for TCP
+        Precondition: [str] or None
+
+        Parameter bots: the number of bots
+        Precondition: [int] bots > 0
+
+        Parameter ready: a function to call once the arena is listening, or None
+        Precondition: [callable] taking no arguments, or None
+        """
+        loop = asyncio.get_running_loop()
+        matches = []
+        everyone = loop.create_future()
+
+        def connect():
+            match = Match(self)
+            matches.append(match)
+            if len(matches) == bots:
+                everyone.set_result(None)
+            return match
+
+        if path is not None:
+            listener = await loop.create_unix_server(connect, path)
+        else:
+            listener = await loop.create_server(connect, host, port)
+        if ready is not None:
+            ready()
+        await everyone
+        listener.close()
+        await asyncio.gather(*[match.done for match in matches])
+        return matches
+
+
+def _connect(host, port, path):
+    """
+    Returns: a blocking socket connected to an arena
+    """
+    if path is not None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(path)
+    else:
+        connection = socket.create_connection((host, port))
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return connection
+
+
+def _receive(connection, view, size):
+    """
+    Returns: the number of bytes read into view, at least size, or 0 at the end
+    """
+    filled = 0
+    while filled < size:
+        count = connection.recv_into(view[filled:])
+        if not count:
+            return 0
+        filled += count
+    return filled
+
+
+def play_bot(spec, host='127.0.0.1', port=None, path=None):
+    """
+    Returns: the number of boards answered, once the arena closes the connection
+
+    This is a complete bot: it plays every board it receives with an agent (see the
+    module agents), answering all the boards of one read in one write.  Its agent is
+    reset, with the game number as seed, whenever a new game starts.
+
+    Parameter spec: the agent
+    Precondition: [tuple] a pair (name, options) as returned by agents.parse_agent
+
+    Parameter host: the TCP host
+    Precondition: [str]
+
+    Parameter port: the TCP port, or None with a path
+    Precondition: [int] or None
+
+    Parameter path: the Unix socket, or None for TCP
+    Precondition: [str] or None
+    """
+    agent = agents.make_agent(spec[0], **spec[1])
+    connection = _connect(host, port, path)
+    buffer = bytearray(BUFFER)
+    view = memoryview(buffer)
+    out = bytearray()
+    try:
+        filled = _receive(connection, view, HELLO.size)
+        if not filled:
+            return 0
+        magic, version, window = HELLO.unpack_from(view, 0)
+        if magic != MAGIC or version != PROTOCOL_VERSION:
+            raise IOError('the server is not an arena of version %d' % PROTOCOL_VERSION)
+        # Boards may have come in the same read as the hello
+        buffer[:filled-HELLO.size] = view[HELLO.size:filled]
+        filled -= HELLO.size
+        answered = 0
+        newest = -1
+        size = STATE.size
+        while True:
+            if filled < size:
+                count = connection.recv_into(view[filled:])
+                if not count:
+                    return answered
+                filled += count
+            end = filled-filled % size
+            for offset in range(0, end, size):
+                number, b = STATE.unpack_from(view, offset)
+                if number > newest:
+                    newest = number
+                    agent.reset(number)
+                move = agent.choose(b)
+                out += MOVE.pack(number, RESIGN if move is None else move)
+            buffer[:filled-end] = view[end:filled]
+            filled -= end
+            answered += end//size
+            connection.sendall(out)
+            del out[:]
+    finally:
+        connection.close()
+
+
+def _bot(spec, host, port, path):
+    """
+    The body of a bot process started by the arena.
+    """
+    try:
+        play_bot(spec, host, port, path)
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    """
+    Runs an arena for bots in other processes, or a bot that plays in one.
+    """
+    import argparse
+    import multiprocessing
+    parser = argparse.ArgumentParser(prog='arena', description=main.__doc__.strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('run', help='play a match with each bot that connects')
+    command.add_argument('--games', type=int, default=1000, help='the games of each match')
+    command.add_argument('--seed', type=int, default=0)
+    command.add_argument('--window', type=int, default=64,
+                         help='the most boards a bot may have waiting')
+    command.add_argument('--timeout', type=float, default=1.0,
+                         help='the seconds a bot has to answer a board')
+    command.add_argument('--max-moves', type=int, default=None, help='the move limit of a game')
+    command.add_argument('--bots', type=int, default=1, help='the number of bots to wait for')
+    command.add_argument('--spawn', help="start the bots as processes playing this agent, "
+                                         "e.g. 'greedy'")
+    command.add_argument('--output', help='write the summary to this file instead of stdout')
+    command = commands.add_parser('bot', help='play the matches of an arena with an agent')
+    command.add_argument('agent', help="the agent, e.g. 'greedy' or 'expectimax:depth=1'")
+    for command in commands.choices.values():
+        command.add_argument('--host', default='127.0.0.1')
+        command.add_argument('--port', type=int, default=2049)
+        command.add_argument('--unix', help='use this Unix socket instead of TCP')
+    args = parser.parse_args(argv)
+
+    if args.command == 'bot':
+        print('%d boards answered' % play_bot(agents.parse_agent(args.agent), args.host,
+                                               args.port, args.unix))
+        return
+    arena = Arena(args.games, args.seed, args.window, args.timeout, args.max_moves)
+    processes = []
+
+    def spawn():
+        for bot in range(args.bots if args.spawn else 0):
+            process = multiprocessing.get_context('spawn').Process(
+                target=_bot, daemon=True,
+                args=(agents.parse_agent(args.spawn), args.host, args.port, args.unix))
+            process.start()
+            processes.append(process)
+
+    try:
+        matches = asyncio.run(arena.run(args.host, args.port, args.unix, args.bots, spawn))
+    except KeyboardInterrupt:
+        return
+    finally:
+        for process in processes:
+            process.join(5.0)
+    result = {'games': args.games, 'seed': args.seed, 'window': args.window,
+              'timeout': args.timeout, 'agent': args.spawn,
+              'bots': [match.report() for match in matches]}
+    text = json.dumps(result, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(text+'\n')
+
+
+if __name__ == '__main__':
+    main()
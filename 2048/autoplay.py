@@ -0,0 +1,245 @@
+"""
+High-speed autoplay for the GUI.
+
+An AutoplayGroup lets agents (see the module agents) play any number of games on
+packed boards, in one or more background processes.  The workers never wait for the
+display.  After every move they write the board, score and counters of that game into
+a block of shared memory, and the GUI reads the block once per frame to draw whatever
+the latest state happens to be.  The simulation is therefore limited only by the speed
+of the agents (or by an optional pace), not by the frame rate.
+
+The shared block holds one record of RECORD slots per board, followed by a stop flag.
+When a game ends, its board starts the next game straight away.  Boards are dealt the
+agents in turn, and the boards of one deal (one per agent) play the same seeds, so
+the agents can be compared on identical games side by side.
+
+This module must never import Kivy, as the worker processes import it too.
+"""
+import multiprocessing
+import os
+import time
+
+import agents
+import board
+
+# Slots of a board record in the shared state array
+BOARD    = 0
+SCORE    = 1
+MOVES    = 2
+GAMES    = 3
+TOTAL    = 4
+FINISHED = 5
+RECORD   = 6
+
+
+def _run(state, specs, boards, seed, start, pace, worker, workers):
+    """
+    The body of a worker process.
+
+    Board i plays agent specs[i % len(specs)], and its game j uses the seed
+    agents.game_seed(seed, j*deals + i//len(specs)), where deals is the number of
+    boards per agent (rounded up).
+
+    Parameter state: the shared state array
+    Precondition: [multiprocessing.Array] of type 'Q' and length RECORD*boards+1
+
+    Parameter specs: the agents
+    Precondition: [list] of pairs (name, options) as returned by agents.parse_agent
+
+    Parameter boards: the number of boards
+    Precondition: [int] boards > 0
+
+    Parameter seed: the run seed
+    Precondition: [int] seed >= 0
+
+    Parameter start: the board every first game continues from, or None for new games
+    Precondition: [int] a packed board, or None
+
+    Parameter pace: the moves per second on each board, or None for full speed
+    Precondition: [int or float] pace > 0, or None
+
+    Parameter worker: the number of this worker (it plays the boards i with
+    i % workers == worker)
+    Precondition: [int] 0 <= worker < workers
+
+    Parameter workers: the number of workers
+    Precondition: [int] workers > 0
+    """
+    import random
+    if hasattr(os, 'nice'):
+        # Yield to the GUI when they must share a core
+        os.nice(10)
+    stop = RECORD*boards
+    deals = -(-boards // len(specs))
+    mine = list(range(worker, boards, workers))
+    players = {}
+    for i in mine:
+        spec = specs[i % len(specs)]
+        players[i] = [agents.make_agent(spec[0], **spec[1]), None, None, 0, 0]
+
+    def deal(i):
+        # Starts the next game on board i
+        player = players[i]
+        base = RECORD*i
+        game_seed = agents.game_seed(seed, state[base+GAMES]*deals + i//len(specs))
+        player[1] = random.Random(game_seed)
+        player[0].reset(game_seed)
+        player[2] = board.new_board(player[1]) if start is None or state[base+GAMES] else start
+        player[3] = player[4] = 0
+        state[base+BOARD] = player[2]
+        state[base+SCORE] = 0
+        state[base+MOVES] = 0
+
+    for i in mine:
+        deal(i)
+    period = None if pace is None else 1.0/pace
+    deadline = time.perf_counter()
+    while not state[stop]:
+        for i in mine:
+            agent, rng, b, score, moves = players[i]
+            base = RECORD*i
+            direction = agent.choose(b)
+            if direction is None:
+                state[base+FINISHED] += score
+                state[base+GAMES] += 1
+                deal(i)
+                continue
+            b, gain = board.play(b, direction, rng)
+            players[i][2:] = [b, score+gain, moves+1]
+            state[base+SCORE] = score+gain
+            state[base+MOVES] = moves+1
+            state[base+TOTAL] += 1
+            state[base+BOARD] = b
+        if period is not None:
+            deadline += period
+            delay = deadline-time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline -= delay
+
+
+class AutoplayGroup(object):
+    """
+    An instance runs agents on many boards at once in background processes.
+
+    Instance Variables:
+        specs: [list] the agents, as pairs (name, options)
+        boards: [int > 0] the number of boards
+    """
+
+    def __init__(self, specs, boards, seed=0, pace=None, workers=1, start=None):
+        """
+        Creates and starts a group of autoplayed boards.
+
+        Parameter specs: the agents, e.g. ['greedy', 'expectimax:depth=1']
+        Precondition: [list] of descriptions accepted by agents.parse_agent
+
+        Parameter boards: the number of boards
+        Precondition: [int] boards > 0
+
+        Parameter seed: the run seed
+        Precondition: [int] seed >= 0
+
+        Parameter pace: the moves per second on each board, or None for full speed
+        Precondition: [int or float] pace > 0, or None
+
+        Parameter workers: the number of processes
+        Precondition: [int] 0 < workers <= boards
+
+        Parameter start: the board every first game continues from, or None
+        Precondition: [int] a packed board, or None
+        """
+        assert type(boards) == int and boards > 0, '%s is not a valid board count' % repr(boards)
+        assert type(workers) == int and 0 < workers <= boards, \
+            '%s is not a valid worker count' % repr(workers)
+        self.specs = [agents.parse_agent(spec) for spec in specs]
+        self.boards = boards
+        self._state = multiprocessing.Array('Q', RECORD*boards+1, lock=False)
+        if start is not None:
+            for i in range(boards):
+                self._state[RECORD*i+BOARD] = start
+        self._clock = time.perf_counter()
+        self._total = 0
+        self._rate = 0.0
+        self._processes = []
+        for worker in range(workers):
+            process = multiprocessing.Process(target=_run, daemon=True,
+                args=(self._state, self.specs, boards, seed, start, pace, worker, workers))
+            process.start()
+            self._processes.append(process)
+
+    def snapshot(self):
+        """
+        Returns: a copy of the records of every board, as a flat list
+
+        The record of board i starts at RECORD*i, and its slots are BOARD, SCORE,
+        MOVES, GAMES, TOTAL (the moves made on the board) and FINISHED (the sum of the
+        final scores of its games).
+        """
+        return self._state[:RECORD*self.boards]
+
+    def results(self):
+        """
+        Returns: a list with a pair (games, score sum) of finished games for each agent
+        """
+        totals = [[0, 0] for _ in self.specs]
+        state = self._state
+        for i in range(self.boards):
+            total = totals[i % len(self.specs)]
+            total[0] += state[RECORD*i+GAMES]
+            total[1] += state[RECORD*i+FINISHED]
+        return [tuple(total) for total in totals]
+
+    def rate(self):
+        """
+        Returns: the moves per second since the previous call (at most every half second)
+        """
+        now = time.perf_counter()
+        if now-self._clock >= 0.5:
+            state = self._state
+            total = sum(state[RECORD*i+TOTAL] for i in range(self.boards))
+            self._rate = (total-self._total)/(now-self._clock)
+            self._total = total
+            self._clock = now
+        return self._rate
+
+    def stop(self):
+        """
+        Stops the worker processes.
+        """
+        self._state[RECORD*self.boards] = 1
+        for process in self._processes:
+            process.join(1.0)
+            if process.is_alive():
+                process.terminate()
+
+
+class Autoplayer(AutoplayGroup):
+    """
+    An instance runs one agent at full speed on one board.
+    """
+
+    def __init__(self, spec, seed=0, start=None):
+        """
+        Creates and starts an autoplayer.
+
+        Parameter spec: the agent, e.g. 'greedy' or 'expectimax:depth=1'
+        Precondition: [str] a description accepted by agents.parse_agent
+
+        Parameter seed: the run seed
+        Precondition: [int] seed >= 0
+
+        Parameter start: the board to continue from, or None for a new game
+        Precondition: [int] a packed board, or None
+        """
+        AutoplayGroup.__init__(self, [spec], 1, seed, start=start)
+
+    def sample(self):
+        """
+        Returns: a tuple (board, score, moves, games) with the latest published state
+
+        Here moves counts the moves of the current game, and games the games finished.
+        """
+        state = self._state
+        return state[BOARD], state[SCORE], state[MOVES], state[GAMES]
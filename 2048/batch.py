@@ -0,0 +1,187 @@
+"""
+The board functions of the module board, vectorized over NumPy arrays of boards.
+
+Every function here takes a uint64 array of packed boards (see the module board) and
+treats all of them at once, with a fixed number of NumPy operations whatever the
+length of the array.  Rows are moved with the same lookup tables as board, as arrays,
+so a move here gives exactly the same result and score as board.move.
+
+Spawns use a NumPy random Generator rather than random.Random, so they do not follow
+the spawns of board.spawn or Twenty.  Only the rules are the same.
+
+Requires NumPy.
+"""
+import numpy as np
+
+import board
+
+# The row tables of the module board, as arrays: the rows moved left, then the same
+# rows moved right, so that row+RIGHT_ROWS looks up the move right of row
+ROWS = np.array(board.ROW_LEFT+board.ROW_RIGHT, dtype=np.uint64)
+RIGHT_ROWS = 65536
+# The merge scores of the same moves
+ROW_SCORES = np.array(board.ROW_SCORE+[board.ROW_SCORE[board._reverse_row(row)]
+                                       for row in range(65536)], dtype=np.uint64)
+
+# The shift of every cell in a packed board
+SHIFTS = np.arange(0, 64, 4, dtype=np.uint64)
+
+_U = np.uint64
+_ROW = _U(board.ROW_MASK)
+
+
+def cells(boards):
+    """
+    Returns: an n x 16 uint8 array of the cell exponents of n packed boards
+
+    Cell (row, col) is in column 4*row+col.
+
+    Parameter boards: the boards
+    Precondition: [numpy.ndarray] of n uint64 values
+    """
+    return ((boards[:, None] >> SHIFTS) & _U(board.CELL_MASK)).astype(np.uint8)
+
+
+def flip_rows(boards):
+    """
+    Returns: the boards mirrored left to right, as in board.flip_rows
+
+    Parameter boards: the boards
+    Precondition: [numpy.ndarray] of uint64 values
+    """
+    low = _U(0x0F0F0F0F0F0F0F0F)
+    pairs = ((boards & low) << _U(4)) | ((boards >> _U(4)) & low)
+    low = _U(0x00FF00FF00FF00FF)
+    return ((pairs & low) << _U(8)) | ((pairs >> _U(8)) & low)
+
+
+def flip_columns(boards):
+    """
+    Returns: the boards mirrored top to bottom, as in board.flip_columns
+
+    Parameter boards: the boards
+    Precondition: [numpy.ndarray] of uint64 values
+    """
+    low = _U(0x0000FFFF0000FFFF)
+    pairs = ((boards & low) << _U(16)) | ((boards >> _U(16)) & low)
+    return (pairs << _U(32)) | (pairs >> _U(32))
+
+
+def transpose(boards):
+    """
+    Returns: the boards with rows and columns swapped, as in board.transpose
+
+    Parameter boards: the boards
+    Precondition: [numpy.ndarray] of uint64 values
+    """
+    a = ((boards & _U(0xF0F00F0FF0F00F0F)) | ((boards & _U(0x0000F0F00000F0F0)) << _U(12)) |
+         ((boards & _U(0x0F0F00000F0F0000)) >> _U(12)))
+    return ((a & _U(0xFF00FF0000FF00FF)) | ((a & _U(0x00FF00FF00000000)) >> _U(24)) |
+            ((a & _U(0x00000000FF00FF00)) << _U(24)))
+
+
+def transform(boards, symmetry):
+    """
+    Returns: the array of the images of boards under the given symmetries
+
+    Board i becomes board.symmetries(boards[i])[symmetry[i]].
+
+    Parameter boards: the boards
+    Precondition: [numpy.ndarray] of n uint64 values
+
+    Parameter symmetry: the symmetry of each board
+    Precondition: [numpy.ndarray] of n integers in 0..7
+    """
+    result = np.where(symmetry & 1, flip_rows(boards), boards)
+    result = np.where(symmetry & 2, flip_columns(result), result)
+    return np.where(symmetry & 4, transpose(result), result)
+
+
+def _rows(boards):
+    """
+    Returns: the four rows of the boards, as a list of index arrays
+    """
+    return [((boards >> _U(16*i)) & _ROW).astype(np.intp) for i in range(4)]
+
+
+def move(boards, directions):
+    """
+    Returns: a pair (afterstates, scores) of arrays, as board.move for every board
+
+    Board i is moved in directions[i].  Where an afterstate equals its board, that
+    move is illegal (and its score is 0).
+
+    Parameter boards: the boards
+    Precondition: [numpy.ndarray] of n uint64 values
+
+    Parameter directions: the direction of each move
+    Precondition: [numpy.ndarray] of n ints, each UP, DOWN, LEFT or RIGHT
+    """
+    vertical = directions <= board.DOWN
+    right = np.where((directions == board.DOWN) | (directions == board.RIGHT), RIGHT_ROWS, 0)
+    lines = np.where(vertical, transpose(boards), boards)
+    rows = [row+right for row in _rows(lines)]
+    moved = (ROWS[rows[0]] | (ROWS[rows[1]] << _U(16)) | (ROWS[rows[2]] << _U(32)) |
+             (ROWS[rows[3]] << _U(48)))
+    scores = ROW_SCORES[rows[0]]+ROW_SCORES[rows[1]]+ROW_SCORES[rows[2]]+ROW_SCORES[rows[3]]
+    return np.where(vertical, transpose(moved), moved), scores
+
+
+def count_empty(boards):
+    """
+    Returns: the array of the number of empty cells of every board
+
+    Parameter boards: the boards
+    Precondition: [numpy.ndarray] of uint64 values
+    """
+    return (cells(boards) == 0).sum(axis=1)
+
+
+def spawn(boards, rng):
+    """
+    Returns: the boards with one new tile added in a random empty cell of each
+
+    As in board.spawn, the value is 2 or 4 with equal chances, and every empty cell
+    is equally likely.
+
+    Parameter boards: the boards
+    Precondition: [numpy.ndarray] of n uint64 values, each with an empty cell
+
+    Parameter rng: the random number generator
+    Precondition: [numpy.random.Generator]
+    """
+    empty = cells(boards) == 0
+    # One draw picks both the cell (among the empty ones) and the value
+    draw = rng.integers(0, len(board.SPAWNABLE)*empty.sum(axis=1))
+    pick, value = np.divmod(draw, len(board.SPAWNABLE))
+    # The cell is the first empty one with pick empty cells before it
+    cell = np.argmax(empty & (np.cumsum(empty, axis=1) == pick[:, None]+1), axis=1)
+    return boards | ((value+1).astype(np.uint64) << SHIFTS[cell])
+
+
+def new_boards(count, rng):
+    """
+    Returns: an array of count starting boards, each with two spawned tiles
+
+    Parameter count: the number of boards
+    Precondition: [int] count >= 0
+
+    Parameter rng: the random number generator
+    Precondition: [numpy.random.Generator]
+    """
+    return spawn(spawn(np.zeros(count, dtype=np.uint64), rng), rng)
+
+
+def is_over(boards):
+    """
+    Returns: a boolean array, True for every board that no move changes
+
+    A full board can move exactly when two neighbouring cells are equal, so this only
+    looks at the cells, without making any moves.
+
+    Parameter boards: the boards
+    Precondition: [numpy.ndarray] of uint64 values
+    """
+    grid = cells(boards).reshape(-1, 4, 4)
+    return ~((grid == 0).any(axis=(1, 2)) | (grid[:, :, 1:] == grid[:, :, :-1]).any(axis=(1, 2)) |
+             (grid[:, 1:, :] == grid[:, :-1, :]).any(axis=(1, 2)))
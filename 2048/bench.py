@@ -0,0 +1,504 @@
+"""
+Micro-benchmarks of the game, the GUI and the graphics classes underneath them.
+
+Every benchmark (a case) times some number of calls of one operation, in rounds.  The
+first rounds are warmup and are thrown away; the time of every other round, divided
+by the number of calls, is one sample.  The report has the samples themselves (so
+that two reports can be compared statistically later) and their mean, median,
+minimum, maximum and standard deviation.  Anything a call needs (a game on a given
+board, a fresh matrix) is built before its round starts, outside of the timing.
+
+The cases are
+
+    twenty.move.<direction>.<n>   Twenty.move on boards of n tiles where the move is legal
+    twenty.spawn_block.<n>        Twenty.spawn_block on boards of n tiles
+    twenty.getBlock.<n>           Twenty.getBlock of the occupied cells of n-tile boards
+    gui.update.<n>                TwentyGUI.update of one frame, with n tiles on the board
+    gui.draw.<n>                  TwentyGUI.draw of one frame, with n tiles on the board
+    gui.frame.<n>                 a whole frame (clear, update and draw), as GameApp runs it
+    gui.slide.<n>                 the frames of the half second after a move left
+    matrix.<operation>            the operations of cornell.geom.Matrix
+    gobject.<property>            the property setters of GObject, on a GRectangle
+    glabel.<property>             the property setters GLabel adds or replaces
+
+The games in the twenty.move and twenty.getBlock cases have no labels (as in the
+module fuzz), so that they time only the rules of the game.  The label of a new
+block is part of twenty.spawn_block.  The GUI cases run a real TwentyGUI, without
+a window: its view only counts the drawing commands, no key is ever down, and its
+save and history files go to a temporary folder, which is removed afterwards.  The
+GUI runs a second of frames before any timing, so that gui.update, gui.draw and
+gui.frame time a board at rest (the labels done growing), and gui.slide the frames
+while the blocks slide (and merged blocks pulse).
+
+Run it as
+
+    python 2048 bench --output bench.json
+    python 2048 bench --cases twenty.move gui --repeat 50
+
+Requires Kivy (for Twenty and game2d) and NumPy (for cornell.geom).
+"""
+import array
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import board
+
+# The number of tiles on the boards of the game and GUI cases
+DENSITIES = (2, 6, 10, 14)
+# The number of different boards each game case cycles through
+BOARDS = 64
+
+
+def _boards(tiles, count, rng, direction=None):
+    """
+    Returns: a list of count random packed boards with the given number of tiles
+
+    The tiles are 2 to 256, smaller tiles more likely, as in real games.
+
+    Parameter tiles: the number of tiles
+    Precondition: [int] 1 <= tiles <= 16
+
+    Parameter count: the number of boards
+    Precondition: [int] count >= 0
+
+    Parameter rng: the random number generator
+    Precondition: [random.Random]
+
+    Parameter direction: if not None, only boards on which this move is legal
+    Precondition: [int] None, or one of UP, DOWN, LEFT or RIGHT
+    """
+    result = []
+    while len(result) < count:
+        b = 0
+        for cell in rng.sample(range(16), tiles):
+            b |= min(int(rng.expovariate(0.6))+1, 8) << 4*cell
+        if direction is None or board.move(b, direction)[0] != b:
+            result.append(b)
+    return result
+
+
+def _game(b):
+    """
+    Returns: a Twenty on the given packed board, whose blocks have no labels
+    """
+    import Twenty
+    game = Twenty.Twenty.__new__(Twenty.Twenty)
+    game.blocks = []
+    game.playGrid = [[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]]
+    game.pressed = []
+    game.plans = {}
+    game.score = 0
+    game.moves = 0
+    game.undos = array.array('Q')
+    game.make_block = Twenty.Block
+    game.set_board(b)
+    return game
+
+
+def _kivy():
+    """
+    Opens the window of Kivy, and adds the Fonts folder to its resource paths
+
+    GameApp does both on start.  The window is never shown, but the shapes of game2d
+    need the graphics context that comes with it (without it they crash Python).
+    """
+    import kivy.resources
+    from kivy.core.window import Window
+    kivy.resources.resource_add_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Fonts'))
+
+
+class _View(object):
+    """
+    A stand-in for GView, which counts the drawing commands instead of drawing them
+
+    Instance Variables:
+        commands: [int >= 0] the number of drawing commands since the last clear
+    """
+
+    def __init__(self):
+        self.commands = 0
+
+    def draw(self, cmd):
+        self.commands += 1
+
+    def clear(self):
+        self.commands = 0
+
+
+class _Input(object):
+    """
+    A stand-in for GInput, on which no key is ever down
+    """
+    touch = None
+
+    def is_key_down(self, key):
+        return False
+
+
+def _cycle(values, number):
+    """
+    Returns: a list of number values, repeating values from the start
+    """
+    return [values[i % len(values)] for i in range(number)]
+
+
+# The cases, each a function make(rng) -> (prepare, close).  prepare(number) does the
+# untimed work for a round and returns the function that makes the number calls;
+# close (or None) cleans up once the case is done.
+
+def _move_case(direction, tiles):
+    def make(rng):
+        boards = _boards(tiles, BOARDS, rng, board.DIRECTIONS.index(direction))
+
+        def prepare(number):
+            games = [_game(b) for b in _cycle(boards, number)]
+            random.seed(rng.random())
+            def run():
+                for game in games:
+                    game.move(direction)
+            return run
+        return prepare, None
+    return make
+
+
+def _spawn_case(tiles):
+    def make(rng):
+        _kivy()
+        boards = _boards(tiles, BOARDS, rng)
+
+        def prepare(number):
+            games = [_game(b) for b in _cycle(boards, number)]
+            for game in games:
+                del game.make_block
+            random.seed(rng.random())
+            def run():
+                for game in games:
+                    game.spawn_block()
+            return run
+        return prepare, None
+    return make
+
+
+def _getblock_case(tiles):
+    def make(rng):
+        calls = []
+        for b in _boards(tiles, BOARDS, rng):
+            game = _game(b)
+            cells = [(block.get_row(), block.get_col()) for block in game.getBlocks()]
+            rng.shuffle(cells)
+            calls.extend((game, row, col) for row, col in cells)
+
+        def prepare(number):
+            work = _cycle(calls, number)
+            def run():
+                for game, row, col in work:
+                    game.getBlock(row, col)
+            return run
+        return prepare, None
+    return make
+
+
+def _gui_case(method, tiles):
+    def make(rng):
+        slides = _boards(tiles, BOARDS, rng, board.LEFT) if method == 'slide' else None
+        from GUI import TwentyGUI
+        _kivy()
+        gui = TwentyGUI.__new__(TwentyGUI)
+        gui._setpaths()
+        # The save and history files are relative, and the leaderboard thread opens
+        # its file whenever it reads, so the case runs in the temporary folder
+        folder = tempfile.mkdtemp(prefix='bench')
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            gui.start()
+            gui._view = _View()
+            gui._input = _Input()
+            gui.game.set_board(_boards(tiles, 1, rng)[0])
+            # A second of frames first, so that the new labels are done growing
+            for frame in range(60):
+                gui.update(1/60)
+        except:
+            os.chdir(cwd)
+            shutil.rmtree(folder, ignore_errors=True)
+            raise
+
+        def prepare(number):
+            if method == 'update':
+                def run():
+                    for frame in range(number):
+                        gui.update(1/60)
+            elif method == 'slide':
+                # The frames of the animation of a move, which starts untimed
+                gui.game.set_board(rng.choice(slides))
+                for frame in range(60):
+                    gui.update(1/60)
+                gui.game.move('left')
+                def run():
+                    for frame in range(number):
+                        gui.view.clear()
+                        gui.update(1/60)
+                        gui.draw()
+            elif method == 'draw':
+                def run():
+                    for frame in range(number):
+                        gui.view.clear()
+                        gui.draw()
+            else:
+                # A whole frame, as GameApp runs it
+                def run():
+                    for frame in range(number):
+                        gui.view.clear()
+                        gui.update(1/60)
+                        gui.draw()
+            return run
+
+        def close():
+            gui.on_stop()
+            os.chdir(cwd)
+            shutil.rmtree(folder, ignore_errors=True)
+        return prepare, close
+    return make
+
+
+def _matrix_case(operation):
+    def make(rng):
+        from cornell.geom import Matrix, Point3
+        other = Matrix.CreateRotation(rng.uniform(0, 360))
+        other.translate(rng.uniform(-100, 100), rng.uniform(-100, 100))
+        point = Point3(rng.uniform(-100, 100), rng.uniform(-100, 100), 0)
+        calls = {'multiply': lambda m: m*other, 'imul': lambda m: m.__imul__(other),
+                 'copy': lambda m: m.copy(), 'inverse': lambda m: m.inverse(),
+                 'invert': lambda m: m.invert(), 'transpose': lambda m: m.transpose(),
+                 'translate': lambda m: m.translate(1, -1, 0), 'rotate': lambda m: m.rotate(30),
+                 'scale': lambda m: m.scale(1.001, 1.001, 1), 'transform': lambda m: m.transform(point),
+                 'create': lambda m: Matrix.CreateTranslation(1, 2, 0)}
+        call = calls[operation]
+
+        def prepare(number):
+            m = other.copy()
+            def run():
+                for i in range(number):
+                    call(m)
+            return run
+        return prepare, None
+    return make
+
+
+def _setter_case(kind, name, values):
+    def make(rng):
+        from game2d import GRectangle, GLabel
+        _kivy()
+        if kind == 'glabel':
+            shape = GLabel(x=100, y=100, width=100, height=100, fillcolor=[0.5, 0.5, 0.5, 1],
+                           font_name='ClearSans', font_size=30, text='2')
+        else:
+            shape = GRectangle(x=100, y=100, width=100, height=100, fillcolor=[0.5, 0.5, 0.5, 1])
+
+        def prepare(number):
+            work = _cycle(values, number)
+            def run():
+                for value in work:
+                    setattr(shape, name, value)
+            return run
+        return prepare, None
+    return make
+
+
+def cases():
+    """
+    Returns: a list of tuples (name, make, number) for all the cases, in order
+
+    number is the number of calls in a round, and make is the case (see above).
+    """
+    result = []
+    for tiles in DENSITIES:
+        for direction in board.DIRECTIONS:
+            result.append(('twenty.move.%s.%d' % (direction, tiles), _move_case(direction, tiles), 200))
+    for tiles in DENSITIES:
+        result.append(('twenty.spawn_block.%d' % tiles, _spawn_case(tiles), 20))
+    for tiles in DENSITIES:
+        result.append(('twenty.getBlock.%d' % tiles, _getblock_case(tiles), 2000))
+    for method, number in (('update', 2), ('draw', 200), ('frame', 2), ('slide', 30)):
+        for tiles in DENSITIES:
+            result.append(('gui.%s.%d' % (method, tiles), _gui_case(method, tiles), number))
+    for operation in ('create', 'multiply', 'imul', 'copy', 'inverse', 'invert', 'transpose',
+                      'translate', 'rotate', 'scale', 'transform'):
+        result.append(('matrix.%s' % operation, _matrix_case(operation), 1000))
+    colors = [[1, 0, 0, 1], [0, 0, 1, 1]]
+    for name, values in (('x', [100, 120]), ('y', [100, 120]), ('width', [100, 110]),
+                         ('height', [100, 110]), ('scale', [1, 1.5]), ('angle', [0, 45]),
+                         ('linecolor', colors), ('fillcolor', colors)):
+        result.append(('gobject.%s' % name, _setter_case('gobject', name, values), 1000))
+    for name, values, number in (('x', [100, 120], 1000), ('y', [100, 120], 1000),
+                                 ('fillcolor', colors, 1000), ('text', ['2', '4'], 20)):
+        result.append(('glabel.%s' % name, _setter_case('glabel', name, values), number))
+    return result
+
+
+def summarize(samples):
+    """
+    Returns: a dict of the mean, median, min, max and stdev of the samples, in
+    microseconds
+
+    Parameter samples: the seconds per call of every timed round
+    Precondition: [list] of at least one float
+    """
+    micro = [1e6*sample for sample in samples]
+    return {'mean_us': statistics.fmean(micro), 'median_us': statistics.median(micro),
+            'min_us': min(micro), 'max_us': max(micro),
+            'stdev_us': statistics.stdev(micro) if len(micro) > 1 else 0.0}
+
+
+def measure(make, number, repeat, warmup, seed=0):
+    """
+    Returns: the list of the seconds per call of every timed round of a case
+
+    Parameter make: the case
+    Precondition: [callable] as in _move_case
+
+    Parameter number: the number of calls in a round
+    Precondition: [int] number >= 1
+
+    Parameter repeat: the number of timed rounds
+    Precondition: [int] repeat >= 1
+
+    Parameter warmup: the number of rounds first, which are not timed
+    Precondition: [int] warmup >= 0
+
+    Parameter seed: the seed of the boards and spawns
+    Precondition: [int]
+    """
+    prepare, close = make(random.Random(seed))
+    samples = []
+    try:
+        for index in range(warmup+repeat):
+            calls = prepare(number)
+            start = time.perf_counter()
+            calls()
+            seconds = time.perf_counter()-start
+            if index >= warmup:
+                samples.append(seconds/number)
+    finally:
+        if close is not None:
+            close()
+    return samples
+
+
+def selected(name, names):
+    """
+    Returns: True if the case is one of names, or in one of the groups in names
+
+    Parameter name: the name of a case
+    Precondition: [str]
+
+    Parameter names: names of cases or groups (such as twenty.move), or None for all
+    Precondition: [list] of str, or None
+    """
+    return names is None or any(name == prefix or name.startswith(prefix+'.') for prefix in names)
+
+
+def time_case(make, number, repeat, warmup, seed=0):
+    """
+    Returns: the result of a case (a JSON-friendly dict), with its samples and summary
+
+    The parameters are as in measure.
+    """
+    samples = measure(make, number, repeat, warmup, seed)
+    result = {'number': number, 'warmup': warmup, 'repeat': repeat}
+    result.update(summarize(samples))
+    result['samples_us'] = [1e6*sample for sample in samples]
+    return result
+
+
+def environment():
+    """
+    Returns: a dict describing this machine and Python, for the report
+    """
+    import numpy
+    return {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'numpy': numpy.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def run(names=None, repeat=20, warmup=3, scale=1.0, seed=0, callback=None):
+    """
+    Returns: the report of the cases (a JSON-friendly dict)
+
+    Parameter names: if not None, only the cases whose names start with one of these
+    Precondition: [list] of str, or None
+
+    Parameter repeat: the number of timed rounds of every case
+    Precondition: [int] repeat >= 1
+
+    Parameter warmup: the number of untimed rounds before them
+    Precondition: [int] warmup >= 0
+
+    Parameter scale: a factor for the number of calls in a round
+    Precondition: [float] scale > 0
+
+    Parameter seed: the seed of the boards and spawns
+    Precondition: [int]
+
+    Parameter callback: if not None, called with the name and result of every case
+    Precondition: [callable] or None
+    """
+    results = {}
+    for name, make, number in cases():
+        if selected(name, names):
+            results[name] = time_case(make, max(int(number*scale), 1), repeat, warmup, seed)
+            if callback is not None:
+                callback(name, results[name])
+    report = environment()
+    report.update(seed=seed, cases=results)
+    return report
+
+
+def main(argv=None):
+    """
+    Times the game, the GUI and the graphics classes, and writes the results as JSON.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='bench', description=main.__doc__.strip())
+    parser.add_argument('--cases', nargs='+',
+                        help='only these cases, or the cases in these groups (e.g. twenty.move)')
+    parser.add_argument('--repeat', type=int, default=20, help='the timed rounds of every case')
+    parser.add_argument('--warmup', type=int, default=3, help='the untimed rounds first')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='a factor for the number of calls in a round')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--list', action='store_true', help='list the cases and stop')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    args = parser.parse_args(argv)
+    if args.list:
+        for name, make, number in cases():
+            print(name)
+        return
+    if args.repeat < 1 or args.warmup < 0 or args.scale <= 0:
+        parser.error('--repeat must be positive, --warmup not negative, and --scale positive')
+
+    def progress(name, result):
+        print('%-28s %12.2f us  (median %.2f, stdev %.2f)' %
+              (name, result['mean_us'], result['median_us'], result['stdev_us']), file=sys.stderr)
+
+    result = run(args.cases, args.repeat, args.warmup, args.scale, args.seed, progress)
+    if not result['cases']:
+        parser.error('no case matches %s' % ' '.join(args.cases))
+    text = json.dumps(result, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(text+'\n')
+
+
+if __name__ == '__main__':
+    main()
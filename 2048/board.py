@@ -0,0 +1,417 @@
+"""
+A headless, bit-packed model of the 2048 rules used by Twenty.
+
+The class Twenty keeps its state in a list of lists and a list of Block objects, each
+with its own GLabel.  That is perfect for the GUI, but far too slow (and far too tied
+to Kivy) for search, simulation or anything else that needs millions of positions.
+
+This module represents a board as a single 64-bit int.  Every cell is 4 bits holding
+the exponent of the tile (0 is empty, 1 is a 2, 2 is a 4, ...).  The cell at (row, col)
+lives at bit 4*(4*row+col), so each row is one 16-bit chunk.  Moves are done with
+lookup tables over those chunks, built once when the module is imported.
+
+The move rules match Twenty.move exactly, including the quirk that a tile can merge
+more than once in a single move ([2,2,4,0] moves left to [8,0,0,0]).  Spawns make the
+same sequence of calls on a random.Random as Twenty.spawn_block, so a seeded game here
+and a seeded Twenty stay in step.
+
+Directions are ints, in the order Twenty.check_for_moves tries them.
+"""
+UP    = 0
+DOWN  = 1
+LEFT  = 2
+RIGHT = 3
+
+# The direction names used by Twenty, indexed by the constants above
+DIRECTIONS = ('up', 'down', 'left', 'right')
+
+# Must agree with Twenty.SPAWNABLE (kept here so this module never imports Kivy)
+SPAWNABLE = (2, 4)
+
+# The largest exponent a cell can hold
+MAX_EXPONENT = 15
+
+ROW_MASK = 0xFFFF
+CELL_MASK = 0xF
+
+
+def _reverse_row(row):
+    """
+    Returns: the 16-bit row with its four cells in the opposite order
+
+    Parameter row: the row to reverse
+    Precondition: [int] 0 <= row < 65536
+    """
+    return ((row >> 12) | ((row >> 4) & 0x00F0) | ((row << 4) & 0x0F00) | (row << 12)) & ROW_MASK
+
+
+def _slide_line(line):
+    """
+    Returns: a tuple (line, score) for the given cells moved toward index 0
+
+    This is a line-at-a-time copy of the loop in Twenty.move, working on exponents.
+    A tile slides as far as it can and then merges with an equal neighbour, even if
+    that neighbour was itself created by a merge earlier in the same move.
+
+    Parameter line: the four exponents, index 0 first
+    Precondition: [list] a list of 4 ints in 0..MAX_EXPONENT
+    """
+    line = list(line)
+    score = 0
+    for i in range(1,4):
+        if line[i] != 0:
+            j = i
+            while j > 0 and line[j-1] == 0:
+                line[j-1] = line[j]
+                line[j] = 0
+                j -= 1
+            if j > 0 and line[j-1] == line[j]:
+                line[j-1] = min(line[j-1]+1, MAX_EXPONENT)
+                line[j] = 0
+                score += 1 << line[j-1]
+    return line, score
+
+
+def _build_tables():
+    """
+    Returns: the tuple (left, right, score) of row lookup tables
+
+    Each table has one entry for every possible 16-bit row.
+    """
+    left  = [0] * 65536
+    right = [0] * 65536
+    score = [0] * 65536
+    for row in range(65536):
+        line = [(row >> (4*i)) & CELL_MASK for i in range(4)]
+        moved, gain = _slide_line(line)
+        result = moved[0] | (moved[1] << 4) | (moved[2] << 8) | (moved[3] << 12)
+        left[row] = result
+        score[row] = gain
+    for row in range(65536):
+        right[row] = _reverse_row(left[_reverse_row(row)])
+    return left, right, score
+
+ROW_LEFT, ROW_RIGHT, ROW_SCORE = _build_tables()
+
+
+def transpose(board):
+    """
+    Returns: the board with rows and columns swapped
+
+    Parameter board: the board to transpose
+    Precondition: [int] a packed board
+    """
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def _apply_rows(board, table):
+    """
+    Returns: the board with the row table applied to each of its rows
+    """
+    return (table[board & ROW_MASK] |
+            (table[(board >> 16) & ROW_MASK] << 16) |
+            (table[(board >> 32) & ROW_MASK] << 32) |
+            (table[(board >> 48) & ROW_MASK] << 48))
+
+
+def _row_score(board):
+    """
+    Returns: the merge score of moving every row of the board left
+    """
+    return (ROW_SCORE[board & ROW_MASK] + ROW_SCORE[(board >> 16) & ROW_MASK] +
+            ROW_SCORE[(board >> 32) & ROW_MASK] + ROW_SCORE[(board >> 48) & ROW_MASK])
+
+
+def _row_score_right(board):
+    """
+    Returns: the merge score of moving every row of the board right
+    """
+    return (ROW_SCORE[_reverse_row(board & ROW_MASK)] +
+            ROW_SCORE[_reverse_row((board >> 16) & ROW_MASK)] +
+            ROW_SCORE[_reverse_row((board >> 32) & ROW_MASK)] +
+            ROW_SCORE[_reverse_row((board >> 48) & ROW_MASK)])
+
+
+def shift(board, direction):
+    """
+    Returns: the board after sliding every tile in the given direction
+
+    This is the move without the spawn that follows it (the "afterstate").  If the
+    result equals board, the move is illegal.
+
+    Parameter board: the board to move
+    Precondition: [int] a packed board
+
+    Parameter direction: the direction to move
+    Precondition: [int] one of UP, DOWN, LEFT or RIGHT
+    """
+    if direction == LEFT:
+        return _apply_rows(board, ROW_LEFT)
+    elif direction == RIGHT:
+        return _apply_rows(board, ROW_RIGHT)
+    elif direction == UP:
+        return transpose(_apply_rows(transpose(board), ROW_LEFT))
+    return transpose(_apply_rows(transpose(board), ROW_RIGHT))
+
+
+def move(board, direction):
+    """
+    Returns: a tuple (afterstate, score) for sliding the board in the given direction
+
+    The score is the sum of the values of all tiles created by merging.
+
+    Parameter board: the board to move
+    Precondition: [int] a packed board
+
+    Parameter direction: the direction to move
+    Precondition: [int] one of UP, DOWN, LEFT or RIGHT
+    """
+    if direction == LEFT:
+        return _apply_rows(board, ROW_LEFT), _row_score(board)
+    elif direction == RIGHT:
+        return _apply_rows(board, ROW_RIGHT), _row_score_right(board)
+    t = transpose(board)
+    if direction == UP:
+        return transpose(_apply_rows(t, ROW_LEFT)), _row_score(t)
+    return transpose(_apply_rows(t, ROW_RIGHT)), _row_score_right(t)
+
+
+def empty_cells(board):
+    """
+    Returns: a list of the shifts (4*(4*row+col)) of the empty cells, in row-major order
+
+    Parameter board: the board to inspect
+    Precondition: [int] a packed board
+    """
+    return [s for s in range(0,64,4) if (board >> s) & CELL_MASK == 0]
+
+
+def count_empty(board):
+    """
+    Returns: the number of empty cells on the board
+
+    Parameter board: the board to inspect
+    Precondition: [int] a packed board
+    """
+    count = 0
+    for s in range(0,64,4):
+        if (board >> s) & CELL_MASK == 0:
+            count += 1
+    return count
+
+
+def spawn(board, rng):
+    """
+    Returns: the board with one new tile added in a random empty cell
+
+    This makes the same two calls as Twenty.spawn_block: first a choice of value from
+    SPAWNABLE, then a choice among the empty cells in row-major order.
+
+    Parameter board: the board to add to
+    Precondition: [int] a packed board with at least one empty cell
+
+    Parameter rng: the random number generator
+    Precondition: [random.Random] (or the random module itself)
+    """
+    value = rng.choice(SPAWNABLE)
+    cell = rng.choice(empty_cells(board))
+    return board | (value.bit_length()-1) << cell
+
+
+def new_board(rng):
+    """
+    Returns: a starting board with two spawned tiles, like Twenty.__init__
+
+    Parameter rng: the random number generator
+    Precondition: [random.Random] (or the random module itself)
+    """
+    return spawn(spawn(0, rng), rng)
+
+
+def play(board, direction, rng):
+    """
+    Returns: a tuple (board, score) after a full turn, like Twenty.move
+
+    If the move changes the board, a new tile is spawned afterwards.  Otherwise the
+    board is returned unchanged with a score of 0.
+
+    Parameter board: the board to move
+    Precondition: [int] a packed board
+
+    Parameter direction: the direction to move
+    Precondition: [int] one of UP, DOWN, LEFT or RIGHT
+
+    Parameter rng: the random number generator
+    Precondition: [random.Random] (or the random module itself)
+    """
+    after, score = move(board, direction)
+    if after == board:
+        return board, 0
+    return spawn(after, rng), score
+
+
+def legal_moves(board):
+    """
+    Returns: the list of directions that change the board
+
+    Parameter board: the board to inspect
+    Precondition: [int] a packed board
+    """
+    return [d for d in range(4) if shift(board, d) != board]
+
+
+def is_over(board):
+    """
+    Returns: True if no move changes the board
+
+    Parameter board: the board to inspect
+    Precondition: [int] a packed board
+    """
+    if count_empty(board):
+        return False
+    t = transpose(board)
+    return _apply_rows(board, ROW_LEFT) == board and _apply_rows(t, ROW_LEFT) == t \
+        and _apply_rows(board, ROW_RIGHT) == board and _apply_rows(t, ROW_RIGHT) == t
+
+
+def max_exponent(board):
+    """
+    Returns: the largest exponent on the board (0 if the board is empty)
+
+    Parameter board: the board to inspect
+    Precondition: [int] a packed board
+    """
+    best = 0
+    while board:
+        cell = board & CELL_MASK
+        if cell > best:
+            best = cell
+        board >>= 4
+    return best
+
+
+def max_tile(board):
+    """
+    Returns: the value of the largest tile on the board (0 if the board is empty)
+
+    Parameter board: the board to inspect
+    Precondition: [int] a packed board
+    """
+    exp = max_exponent(board)
+    return 1 << exp if exp else 0
+
+
+def from_grid(grid):
+    """
+    Returns: the packed board for a grid of tile values like Twenty.playGrid
+
+    Parameter grid: the grid to pack
+    Precondition: [list] a 4x4 list of tile values (0 for empty, else a power of 2)
+    """
+    board = 0
+    for row in range(4):
+        for col in range(4):
+            value = grid[row][col]
+            if value:
+                board |= (value.bit_length()-1) << (4*(4*row+col))
+    return board
+
+
+def to_grid(board):
+    """
+    Returns: a 4x4 list of tile values like Twenty.playGrid
+
+    Parameter board: the board to unpack
+    Precondition: [int] a packed board
+    """
+    grid = []
+    for row in range(4):
+        grid.append([])
+        for col in range(4):
+            exp = (board >> (4*(4*row+col))) & CELL_MASK
+            grid[row].append(1 << exp if exp else 0)
+    return grid
+
+
+def flip_rows(board):
+    """
+    Returns: the board mirrored left to right (each row reversed)
+
+    Parameter board: the board to mirror
+    Precondition: [int] a packed board
+    """
+    return (_reverse_row(board & ROW_MASK) |
+            (_reverse_row((board >> 16) & ROW_MASK) << 16) |
+            (_reverse_row((board >> 32) & ROW_MASK) << 32) |
+            (_reverse_row((board >> 48) & ROW_MASK) << 48))
+
+
+def flip_columns(board):
+    """
+    Returns: the board mirrored top to bottom (the row order reversed)
+
+    Parameter board: the board to mirror
+    Precondition: [int] a packed board
+    """
+    return (((board & ROW_MASK) << 48) | (((board >> 16) & ROW_MASK) << 32) |
+            (((board >> 32) & ROW_MASK) << 16) | (board >> 48))
+
+
+def _symmetry_moves():
+    """
+    Returns: the direction maps of the eight symmetries, in the order of symmetries
+    """
+    result = []
+    for i in range(8):
+        table = []
+        for d in range(4):
+            if i & 1:
+                d = {LEFT: RIGHT, RIGHT: LEFT}.get(d, d)
+            if i & 2:
+                d = {UP: DOWN, DOWN: UP}.get(d, d)
+            if i & 4:
+                d = (LEFT, RIGHT, UP, DOWN)[d]
+            table.append(d)
+        result.append(tuple(table))
+    return tuple(result)
+
+# SYMMETRY_MOVES[i][d] is the direction on symmetries(b)[i] that matches d on b
+SYMMETRY_MOVES = _symmetry_moves()
+
+
+def symmetries(board):
+    """
+    Returns: the list of the eight boards equivalent to board under rotation and reflection
+
+    Symmetry i mirrors the rows if bit 0 of i is set, then mirrors the columns if bit
+    1 is set, then transposes if bit 2 is set.  SYMMETRY_MOVES gives the matching
+    directions.  Symmetry 0 is board itself.
+
+    Parameter board: the board to transform
+    Precondition: [int] a packed board
+    """
+    h = flip_rows(board)
+    v = flip_columns(board)
+    hv = flip_columns(h)
+    result = [board, h, v, hv]
+    return result+[transpose(b) for b in result]
+
+
+def canonical(board):
+    """
+    Returns: a tuple (key, symmetry) where key is the least of the eight symmetries of
+    board, and symmetry is the index (in symmetries) that produced it
+
+    Parameter board: the board to canonicalize
+    Precondition: [int] a packed board
+    """
+    boards = symmetries(board)
+    key = min(boards)
+    return key, boards.index(key)
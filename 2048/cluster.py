@@ -0,0 +1,586 @@
+"""
+A cluster of game servers on one machine, behind a router.
+
+The router is a single process that speaks exactly the protocol of the module server,
+so any client of a GameServer (the load generator included) can use it instead.  It
+holds no games itself.  It starts a number of worker processes, each a GameServer
+listening on its own Unix socket, and passes every request on to the worker that
+owns the game, with the worker's response going back to the client unchanged.
+
+The owner of a game is found by consistent hashing of its id (see HashRing).  The
+router chooses the id of every new game and creates it on the worker its id maps to,
+so it never needs a table of where the games are.  Every worker has many points on
+the ring, so the games are spread evenly, and when a worker leaves or comes back only
+the games of that worker change owner.
+
+The router checks the workers every HEALTH seconds.  A worker that has exited, closed
+its connection or not answered within HEALTH seconds is taken off the ring and
+restarted.  Its games are lost, as a worker keeps them only in memory, and new games
+of its ids go to the next workers on the ring meanwhile.  When it is back, it takes
+its place on the ring again, and the games of its ids created meanwhile are moved
+back to it: the router reads each one from the worker that has it (after any moves
+already sent), creates it again on the restarted worker, and closes the old copy.
+Requests for a game being moved wait until it has arrived.
+
+Every worker applies the moves of its games in vectorized ticks (see the module
+server), and the workers run in parallel, so the number of games the cluster can hold
+at a given latency grows with the number of cores.  The router only parses each
+request far enough to find its game, and batches what it writes to each worker and
+each client, so it can feed several workers.
+
+Run it, and the load generator of the module server against it, as
+
+    python 2048 cluster --workers 4 --port 2048
+    python 2048 server load --port 2048 --connections 8 --games 32
+
+Requires NumPy.  This module must never import Kivy, as the workers import it too.
+"""
+import asyncio
+import bisect
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+import secrets
+import shutil
+import tempfile
+
+import server
+
+# The number of points of every worker on the hash ring
+REPLICAS = 64
+
+# The seconds between two health checks, and the longest a worker may take to answer one
+HEALTH = 1.0
+
+# The longest a new worker may take to start listening, in seconds
+START_TIMEOUT = 30.0
+
+
+def _hash(key):
+    """
+    Returns: the 64-bit position of a string on the hash ring
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing(object):
+    """
+    An instance maps keys to nodes by consistent hashing.
+
+    Every node has replicas points on a ring of 64-bit hashes, and a key belongs to the
+    node of the first point at or after the hash of the key (going round the ring).
+    Adding or removing a node only moves the keys of that node.
+
+    Instance Variables:
+        replicas: [int > 0] the number of points of every node
+        nodes: [set] the nodes on the ring
+    """
+
+    def __init__(self, nodes=(), replicas=REPLICAS):
+        """
+        Creates a ring of the given nodes.
+
+        Parameter nodes: the nodes
+        Precondition: [iterable] of ints
+
+        Parameter replicas: the number of points of every node
+        Precondition: [int] replicas > 0
+        """
+        assert type(replicas) == int and replicas > 0, '%s is not a valid replica count' % repr(replicas)
+        self.replicas = replicas
+        self.nodes = set()
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def copy(self):
+        """
+        Returns: a copy of this ring
+        """
+        result = HashRing((), self.replicas)
+        result.nodes = set(self.nodes)
+        result._points = list(self._points)
+        result._owners = list(self._owners)
+        return result
+
+    def add(self, node):
+        """
+        Adds a node to the ring.
+
+        Parameter node: the node
+        Precondition: [int] a node not on the ring
+        """
+        assert node not in self.nodes, '%s is already on the ring' % repr(node)
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            point = _hash('%d#%d' % (node, replica))
+            at = bisect.bisect_left(self._points, point)
+            self._points.insert(at, point)
+            self._owners.insert(at, node)
+
+    def remove(self, node):
+        """
+        Removes a node from the ring.
+
+        Parameter node: the node
+        Precondition: [int] a node on the ring
+        """
+        self.nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, owner in kept]
+        self._owners = [owner for point, owner in kept]
+
+    def node(self, key):
+        """
+        Returns: the node that key belongs to, or None if the ring is empty
+
+        Parameter key: the key
+        Precondition: [str]
+        """
+        if not self._points:
+            return None
+        at = bisect.bisect_left(self._points, _hash(key))
+        return self._owners[at if at < len(self._points) else 0]
+
+
+def _work(path, tick):
+    """
+    The body of a worker process: a GameServer on the Unix socket path.
+    """
+    try:
+        asyncio.run(server.GameServer(server.GameTable(), tick).serve(path=path))
+    except KeyboardInterrupt:
+        pass
+
+
+class _Link(object):
+    """
+    An instance is the router's connection to one worker.
+
+    Requests are pipelined: call writes a request line and returns the future of its
+    response, and the responses, which come back in order, complete the futures in
+    turn.  The lines written in one round of the event loop go out in one write.  When
+    the connection breaks, every waiting request fails, and closed is set.
+
+    Instance Variables:
+        closed: [asyncio.Future] completed when the connection is closed
+    """
+
+    def __init__(self, reader, writer):
+        """
+        Starts reading the responses of a connection.
+        """
+        self.closed = asyncio.get_running_loop().create_future()
+        self._reader = reader
+        self._writer = writer
+        self._waiting = collections.deque()
+        self._lines = []
+        self._task = asyncio.ensure_future(self._receive())
+
+    async def _receive(self):
+        """
+        Completes the waiting requests with their responses, until the connection closes.
+        """
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                future, tag = self._waiting.popleft()
+                if not future.cancelled():
+                    future.set_result(line)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self.close()
+
+    def call(self, line, tag=None):
+        """
+        Returns: the future of the response line of a request
+
+        If the connection is closed, or breaks before the response comes, the response
+        is an error carrying tag.
+
+        Parameter line: the request line
+        Precondition: [bytes] a line ending with a newline
+
+        Parameter tag: the tag of the request, or None
+        Precondition: a JSON value, or None
+        """
+        future = asyncio.get_running_loop().create_future()
+        if self.closed.done():
+            future.set_result(server._error('the worker has failed', tag))
+            return future
+        if not self._lines:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._lines.append(line)
+        self._waiting.append((future, tag))
+        return future
+
+    def _flush(self):
+        """
+        Writes the request lines of this round of the event loop.
+        """
+        if self._lines and not self.closed.done():
+            self._writer.write(b''.join(self._lines))
+        self._lines = []
+
+    def close(self):
+        """
+        Closes the connection, failing every request still waiting.
+        """
+        if self.closed.done():
+            return
+        self.closed.set_result(None)
+        self._task.cancel()
+        self._writer.close()
+        while self._waiting:
+            future, tag = self._waiting.popleft()
+            if not future.done():
+                future.set_result(server._error('the worker has failed', tag))
+
+
+class Router(object):
+    """
+    An instance starts a cluster of workers and routes client requests to them.
+
+    Instance Variables:
+        workers: [int > 0] the number of workers
+        tick: [float >= 0] the least number of seconds between two ticks of a worker
+        ring: [HashRing] the workers that are up
+        restarts: [int >= 0] the number of times a worker was restarted
+        moved: [int >= 0] the number of games moved between workers
+    """
+
+    def __init__(self, workers, tick=server.TICK):
+        """
+        Creates a router; serve starts the workers.
+
+        Parameter workers: the number of workers
+        Precondition: [int] workers > 0
+
+        Parameter tick: the least number of seconds between two ticks of a worker
+        Precondition: [int or float] tick >= 0
+        """
+        assert type(workers) == int and workers > 0, '%s is not a valid worker count' % repr(workers)
+        self.workers = workers
+        self.tick = tick
+        self.ring = HashRing()
+        self.restarts = 0
+        self.moved = 0
+        self._directory = None
+        self._processes = [None]*workers
+        self._links = [None]*workers
+        # The live games, and the games being moved with the future of their arrival
+        self._games = set()
+        self._moving = {}
+
+    async def serve(self, host=None, port=None, path=None):
+        """
+        Starts the workers and serves clients until cancelled, on a Unix socket if path
+        is given, or else on TCP.  The workers are stopped on the way out.
+
+        Parameter host: the TCP host, or None for all interfaces
+        Precondition: [str] or None
+
+        Parameter port: the TCP port
+        Precondition: [int] 0 <= port < 65536, or None with a path
+
+        Parameter path: the Unix socket, or None for TCP
+        Precondition: [str] or None
+        """
+        self._directory = tempfile.mkdtemp(prefix='2048-cluster-')
+        try:
+            await asyncio.gather(*[self._start(worker) for worker in range(self.workers)])
+            for worker in range(self.workers):
+                self.ring.add(worker)
+            if path is not None:
+                listener = await asyncio.start_unix_server(self.handle, path,
+                                                           limit=server.LINE_LIMIT)
+            else:
+                listener = await asyncio.start_server(self.handle, host, port,
+                                                      limit=server.LINE_LIMIT)
+            watcher = asyncio.ensure_future(self._watch())
+            try:
+                async with listener:
+                    await listener.serve_forever()
+            finally:
+                watcher.cancel()
+        finally:
+            self._stop()
+
+    def _path(self, worker):
+        """
+        Returns: the Unix socket of a worker
+        """
+        return os.path.join(self._directory, 'worker-%d.sock' % worker)
+
+    async def _start(self, worker):
+        """
+        Starts a worker process and connects to it.
+        """
+        path = self._path(worker)
+        if os.path.exists(path):
+            os.remove(path)
+        # A fresh interpreter, rather than a fork of this one and its event loop
+        process = multiprocessing.get_context('spawn').Process(target=_work, daemon=True,
+                                                               args=(path, self.tick))
+        process.start()
+        self._processes[worker] = process
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()+START_TIMEOUT
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(path, limit=1 << 20)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if loop.time() > deadline or not process.is_alive():
+                    raise RuntimeError('worker %d did not start' % worker)
+                await asyncio.sleep(0.01)
+        link = _Link(reader, writer)
+        link.closed.add_done_callback(lambda closed: self._failed(worker, link))
+        self._links[worker] = link
+
+    def _failed(self, worker, link):
+        """
+        Takes a worker off the ring as soon as its connection breaks.
+
+        The next health check restarts it.
+        """
+        if self._links[worker] is link and worker in self.ring:
+            self._leave(worker)
+
+    def _stop(self):
+        """
+        Stops every worker and removes their sockets.
+        """
+        for link in self._links:
+            if link is not None:
+                link.close()
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join(1.0)
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    async def _watch(self):
+        """
+        Checks the workers every HEALTH seconds, restarting any that has failed.
+        """
+        while True:
+            await asyncio.sleep(HEALTH)
+            checks = [self._check(worker) for worker in range(self.workers)]
+            for worker, healthy in enumerate(await asyncio.gather(*checks)):
+                if not healthy:
+                    await self._restart(worker)
+
+    async def _check(self, worker):
+        """
+        Returns: True if a worker is running and answers in time
+        """
+        if not self._processes[worker].is_alive() or self._links[worker].closed.done():
+            return False
+        try:
+            response = await asyncio.wait_for(self._links[worker].call(b'{"op":"stats"}\n'),
+                                              HEALTH)
+        except asyncio.TimeoutError:
+            return False
+        return json.loads(response)['ok']
+
+    async def _restart(self, worker):
+        """
+        Replaces a failed worker with a new one, and moves its games back to it.
+        """
+        if worker in self.ring:
+            self._leave(worker)
+        self._links[worker].close()
+        process = self._processes[worker]
+        if process.is_alive():
+            process.kill()
+        process.join(1.0)
+        try:
+            await self._start(worker)
+        except RuntimeError:
+            # Try again at the next check
+            return
+        self.restarts += 1
+        await self._rebalance(worker)
+
+    def _leave(self, worker):
+        """
+        Takes a worker off the ring, forgetting its games, which died with it.
+        """
+        lost = [game for game in self._games if self.ring.node(game) == worker]
+        self._games.difference_update(lost)
+        self.ring.remove(worker)
+
+    async def _rebalance(self, worker):
+        """
+        Puts a worker back on the ring, moving to it the games of its ids that other
+        workers hold.
+        """
+        before = self.ring.copy()
+        self.ring.add(worker)
+        moves = []
+        for game in self._games:
+            if game not in self._moving and self.ring.node(game) == worker:
+                self._moving[game] = asyncio.get_running_loop().create_future()
+                moves.append(self._move(game, self._links[before.node(game)],
+                                        self._links[worker]))
+        await asyncio.gather(*moves)
+
+    async def _move(self, game, source, target):
+        """
+        Moves a game from the worker of source to the worker of target.
+
+        The get is pipelined after every request already sent for the game, so it sees
+        the game after them.  Until the game is created on the target, its requests wait.
+        """
+        try:
+            state = json.loads(await source.call(
+                server._encode({'op': 'get', 'id': game}, None)))
+            if not state['ok']:
+                self._games.discard(game)
+                return
+            request = {'op': 'new', 'id': game, 'cells': state['cells'],
+                       'score': state['score'], 'moves': state['moves']}
+            created = json.loads(await target.call(server._encode(request, None)))
+            source.call(server._encode({'op': 'close', 'id': game}, None))
+            if created['ok']:
+                self.moved += 1
+            else:
+                self._games.discard(game)
+        finally:
+            self._moving.pop(game).set_result(None)
+
+    def _forward(self, game, line, tag):
+        """
+        Returns: the future response of the worker of a game to a request line
+        """
+        moving = self._moving.get(game)
+        if moving is not None:
+            return asyncio.ensure_future(self._forward_later(moving, game, line, tag))
+        worker = self.ring.node(game)
+        if worker is None:
+            return server._error('no worker is running', tag)
+        return self._links[worker].call(line, tag)
+
+    async def _forward_later(self, moving, game, line, tag):
+        """
+        Returns: the response of the worker of a game to a request line, once the game
+        has finished moving
+
+        The future of the move is passed in, since the move may be over (and gone from
+        _moving) before this starts.
+        """
+        await asyncio.shield(moving)
+        response = self._forward(game, line, tag)
+        if isinstance(response, bytes):
+            # No worker is left to take the game
+            return response
+        return await response
+
+    def _request(self, message, owned):
+        """
+        Returns: the response to one request, as bytes or as a future of bytes
+
+        Parameter message: the request line
+        Precondition: [bytes]
+
+        Parameter owned: the ids of the games of the connection
+        Precondition: [set] of str
+        """
+        try:
+            request = json.loads(message)
+            op = request['op']
+        except (ValueError, TypeError, KeyError):
+            return server._error('the request is not a JSON object with an op', None)
+        tag = request.get('tag')
+        if op == 'new':
+            game = secrets.token_hex(8)
+            owned.add(game)
+            self._games.add(game)
+            return self._forward(game, server._encode({'op': 'new', 'id': game}, tag), tag)
+        if op == 'stats':
+            return asyncio.ensure_future(self._stats(tag))
+        if op not in ('get', 'close', 'move'):
+            return server._error('%s is not an op' % repr(op), tag)
+        game = request.get('id')
+        if type(game) != str or game not in owned:
+            return server._error('there is no game %s' % repr(game), tag)
+        if game not in self._games:
+            # Lost with its worker
+            owned.discard(game)
+            return server._error('the game has ended', tag)
+        if op == 'close':
+            owned.discard(game)
+            self._games.discard(game)
+        if not message.endswith(b'\n'):
+            message += b'\n'
+        return self._forward(game, message, tag)
+
+    async def _stats(self, tag):
+        """
+        Returns: the response to a stats request, the counters of all the workers
+        added up
+        """
+        workers = sorted(self.ring.nodes)
+        responses = await asyncio.gather(*[self._links[worker].call(b'{"op":"stats"}\n')
+                                           for worker in workers])
+        result = {'ok': True, 'games': 0, 'moves': 0, 'ticks': 0}
+        for response in map(json.loads, responses):
+            if response['ok']:
+                for key in ('games', 'moves', 'ticks'):
+                    result[key] += response[key]
+        result.update({'workers': len(workers), 'restarts': self.restarts, 'moved': self.moved})
+        return server._encode(result, tag)
+
+    async def handle(self, reader, writer):
+        """
+        Serves one connection until it closes, then ends its games.
+        """
+        owned = set()
+        try:
+            await server.serve_lines(reader, writer, lambda line: self._request(line, owned))
+        finally:
+            for game in owned:
+                if game in self._games:
+                    self._games.discard(game)
+                    self._forward(game, server._encode({'op': 'close', 'id': game}, None), None)
+            writer.close()
+
+
+def main(argv=None):
+    """
+    Runs a cluster of game servers behind a router.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='cluster', description=main.__doc__.strip())
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='the number of worker processes')
+    parser.add_argument('--tick', type=float, default=server.TICK,
+                        help='the least seconds between two ticks of a worker')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2048)
+    parser.add_argument('--unix', help='use this Unix socket instead of TCP')
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(Router(args.workers, args.tick).serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
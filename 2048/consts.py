@@ -7,15 +7,57 @@ STARTING_WIDTH = 10
 GROWTH_RATE = 5
 BLOCK_COLOR = RGB(238,228,218)
 MOVE_TIME = 0.25
+# A sliding block snaps to its cell once it is this close (in pixels)
+SNAP_DISTANCE = 0.5
 
 COLORS = {2: RGB(238,228,218) , 4:RGB(236,224,200) , 8:RGB(242,177,121) , 
          16: RGB(245,149,99), 32:RGB(245,124,95), 64:RGB(246,93,59), 
          128: RGB(237,206,113), 256:RGB(237,204,97), 512:RGB(236,200,80), 
          1024:RGB(237,197,63), 2048:RGB(237,194,46)}
 
+
+def tile_color(value):
+    """
+    Returns: the fill color of a tile, which is the color of 2048 for any tile above it
+
+    Parameter value: the tile value
+    Precondition: [int] a power of two >= 2
+    """
+    return COLORS.get(value, COLORS[2048])
+
 PULSE_RATE = 5
 PULSE_SIZE = 130
 
 BORDER = 20
 BACK_COLOR = RGB(193,178,155)
-DEFAULT_REC_COLOR = RGB(205,193,180)
\ No newline at end of file
+DEFAULT_REC_COLOR = RGB(205,193,180)
+
+HINT_KEY = 'h'
+HINT_DEPTH = 3
+HINT_BOOK = None
+HINT_SIZE = 60
+HINT_COLOR = RGB(119,110,101,160)
+
+AUTOPLAY_KEY = 'a'
+AUTOPLAY_AGENT = 'greedy'
+AUTOPLAY_COLOR = RGB(119,110,101)
+
+SPECTATOR_WIDTH = 800
+SPECTATOR_BOARDS = 16
+SPECTATOR_AGENTS = ('greedy', 'expectimax:depth=1', 'beam', 'random')
+SPECTATOR_PACE = 10
+
+REPLAY_KEYFRAMES = 64
+REPLAY_SPEEDS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+REPLAY_SPEED = 2
+REPLAY_JUMP = 100
+REPLAY_KEYS = ('spacebar', 'left', 'right', 'up', 'down', 'pageup', 'pagedown')
+REPLAY_BAR = 4
+
+HISTORY_FILE = 'history.db'
+HISTORY_TOP = 10
+HISTORY_KEY = 'l'
+
+UNDO_KEY = 'u'
+UNDO_LIMIT = 100
+SAVE_FILE = 'autosave.2048'
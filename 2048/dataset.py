@@ -0,0 +1,306 @@
+"""
+Training data for offline learning, exported from recorded games.
+
+The exporter replays the games of replay files or archives (see the modules replay
+and archive) and writes one sample per move, a tuple (board, move, reward, next):
+
+    board   the packed board before the move
+    move    the direction played
+    reward  the points scored by the move
+    next    the packed board after the move and the spawn that followed it
+
+The samples go into NumPy .npy shards of SHARD samples each (the last may be
+shorter), with dtype SAMPLE, and an index file listing them, which is written last.
+A directory without an index is an export that did not finish.
+
+A Sampler memory-maps the shards, so the operating system pages in only the samples
+that a minibatch touches, and the data may be much bigger than memory.  Every epoch
+shuffles the order of the shards, then draws the samples of a few shards at a time
+in random order.  With augment, every sample is also mapped through one of the eight
+symmetries of the board (see board.symmetries), chosen at random.  The symmetries are
+applied to whole minibatches at once (see batch.transform).
+
+Run it as
+
+    python 2048 dataset export greedy.rpl data
+    python 2048 dataset sample data --augment
+
+Requires NumPy.
+"""
+import json
+import os
+import random
+
+import numpy as np
+
+import batch
+import board
+import replay
+
+# The fields of a sample, aligned to 24 bytes
+SAMPLE = np.dtype([('board', '<u8'), ('next', '<u8'), ('reward', '<u4'), ('move', 'u1')],
+                  align=True)
+
+# The default number of samples in a shard
+SHARD = 1 << 20
+
+# The file listing the shards of an export
+INDEX = 'index.json'
+
+# SYMMETRY_MOVES as an array, to map a whole column of moves at once
+_MOVES = np.array(board.SYMMETRY_MOVES, dtype=np.uint8)
+
+
+def augment(samples, symmetry):
+    """
+    Returns: a copy of samples with every sample mapped through a symmetry
+
+    Sample i becomes its image under board.symmetries(...)[symmetry[i]]: both boards
+    are transformed the same way, and the move becomes the matching direction (see
+    board.SYMMETRY_MOVES).  The reward does not change.
+
+    Parameter samples: the samples
+    Precondition: [numpy.ndarray] of n values of dtype SAMPLE
+
+    Parameter symmetry: the symmetry of each sample
+    Precondition: [numpy.ndarray] of n integers in 0..7
+    """
+    result = samples.copy()
+    result['board'] = batch.transform(samples['board'], symmetry)
+    result['next'] = batch.transform(samples['next'], symmetry)
+    result['move'] = _MOVES[symmetry, samples['move']]
+    return result
+
+
+def _games(path):
+    """
+    Yields: a pair (seed, moves) for every game of a replay file or archive
+    """
+    from archive import ArchiveReader
+    try:
+        reader = ArchiveReader(path)
+        games = reader.games()
+    except IOError:
+        reader = replay.ReplayReader(path)
+        games = iter(reader)
+    try:
+        for game in games:
+            yield game
+    finally:
+        reader.close()
+
+
+def _write_shard(directory, number, columns):
+    """
+    Returns: the file name of a new shard holding the samples in columns
+
+    The shard is written to a temporary file first, so a shard file is always whole.
+    """
+    name = 'shard-%05d.npy' % number
+    data = np.empty(len(columns[0]), dtype=SAMPLE)
+    for field, values in zip(('board', 'move', 'reward', 'next'), columns):
+        data[field] = values
+    temp = os.path.join(directory, name+'.tmp')
+    with open(temp, 'wb') as file:
+        np.save(file, data)
+    os.replace(temp, os.path.join(directory, name))
+    return name
+
+
+def export(sources, directory, shard=SHARD):
+    """
+    Returns: the index of a new export of every move of the games in sources
+
+    The index is a dict with the shard files, their sizes, the total number of
+    samples and games, and the sources.  It is written to INDEX in directory once all
+    the shards are.
+
+    Parameter sources: the replay files or archives
+    Precondition: [list] of file names
+
+    Parameter directory: the directory to write the shards to (created if need be)
+    Precondition: [str] a directory name
+
+    Parameter shard: the number of samples in a shard
+    Precondition: [int] shard > 0
+    """
+    assert type(shard) == int and shard > 0, '%s is not a valid shard size' % repr(shard)
+    os.makedirs(directory, exist_ok=True)
+    index = os.path.join(directory, INDEX)
+    if os.path.exists(index):
+        os.remove(index)
+    result = {'shards': [], 'sizes': [], 'samples': 0, 'games': 0, 'sources': list(sources)}
+    columns = ([], [], [], [])
+    play = board.play
+    for path in sources:
+        for seed, moves in _games(path):
+            boards, played, rewards, nexts = columns
+            rng = random.Random(seed)
+            b = board.new_board(rng)
+            for direction in moves:
+                boards.append(b)
+                b, gain = play(b, direction, rng)
+                rewards.append(gain)
+                nexts.append(b)
+            played.extend(moves)
+            result['games'] += 1
+            while len(boards) >= shard:
+                chunk = [column[:shard] for column in columns]
+                for column in columns:
+                    del column[:shard]
+                result['shards'].append(_write_shard(directory, len(result['shards']), chunk))
+                result['sizes'].append(shard)
+    if columns[0]:
+        result['shards'].append(_write_shard(directory, len(result['shards']), columns))
+        result['sizes'].append(len(columns[0]))
+    result['samples'] = sum(result['sizes'])
+    with open(index+'.tmp', 'w') as file:
+        json.dump(result, file, indent=2)
+    os.replace(index+'.tmp', index)
+    return result
+
+
+class Sampler(object):
+    """
+    An instance draws shuffled minibatches from the shards of an export.
+
+    Iterating over a sampler yields the minibatches of one epoch, each an array of
+    batch values of dtype SAMPLE (the last may be smaller).  Every epoch has a new
+    order.  Only the shards being drawn from are touched, through memory maps, and the
+    shuffled indices of those shards are the only memory the sampler needs.
+
+    Instance Variables:
+        directory: [str] the export directory
+        batch: [int > 0] the number of samples in a minibatch
+        mix: [int > 0] the number of shards whose samples are shuffled together
+        symmetries: [bool] whether every sample goes through a random symmetry
+        samples: [int >= 0] the number of samples in the export
+    """
+
+    def __init__(self, directory, batch=256, seed=0, mix=4, symmetries=False):
+        """
+        Opens an export.
+
+        Parameter directory: the export directory
+        Precondition: [str] a directory written by export
+
+        Parameter batch: the number of samples in a minibatch
+        Precondition: [int] batch > 0
+
+        Parameter seed: the seed of the shuffles and symmetries
+        Precondition: [int] seed >= 0
+
+        Parameter mix: the number of shards whose samples are shuffled together
+        Precondition: [int] mix > 0
+
+        Parameter symmetries: whether to map every sample through a random symmetry
+        Precondition: [bool]
+        """
+        assert type(batch) == int and batch > 0, '%s is not a valid batch size' % repr(batch)
+        assert type(mix) == int and mix > 0, '%s is not a valid mix' % repr(mix)
+        path = os.path.join(directory, INDEX)
+        if not os.path.exists(path):
+            raise IOError('%s is not a finished export' % repr(directory))
+        with open(path) as file:
+            index = json.load(file)
+        self.directory = directory
+        self.batch = batch
+        self.mix = mix
+        self.symmetries = symmetries
+        self.samples = index['samples']
+        self._shards = [np.load(os.path.join(directory, name), mmap_mode='r')
+                        for name in index['shards']]
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        """
+        Returns: the number of minibatches in an epoch
+        """
+        return -(-self.samples // self.batch)
+
+    def _gather(self, shards, starts, picks):
+        """
+        Returns: the samples with the given positions in the concatenation of shards
+        """
+        owner = np.searchsorted(starts, picks, side='right')-1
+        result = np.empty(len(picks), dtype=SAMPLE)
+        for i in np.unique(owner):
+            where = np.flatnonzero(owner == i)
+            rows = picks[where]-starts[i]
+            # Reading the rows in file order keeps the page accesses sequential
+            order = np.argsort(rows)
+            result[where[order]] = shards[i][rows[order]]
+        return result
+
+    def __iter__(self):
+        rng = self._rng
+        order = rng.permutation(len(self._shards))
+        batch = self.batch
+        pending = None
+        for first in range(0, len(order), self.mix):
+            shards = [self._shards[i] for i in order[first:first+self.mix]]
+            starts = np.cumsum([0]+[len(shard) for shard in shards])
+            picks = rng.permutation(int(starts[-1]))
+            at = 0
+            if pending is not None:
+                # Fill the short minibatch left over from the previous shards
+                at = batch-len(pending)
+                pending = np.concatenate([pending, self._gather(shards, starts, picks[:at])])
+                if len(pending) < batch:
+                    continue
+                yield self._finish(pending)
+                pending = None
+            for start in range(at, len(picks), batch):
+                chunk = self._gather(shards, starts, picks[start:start+batch])
+                if len(chunk) < batch:
+                    pending = chunk
+                else:
+                    yield self._finish(chunk)
+        if pending is not None and len(pending):
+            yield self._finish(pending)
+
+    def _finish(self, samples):
+        """
+        Returns: a minibatch, mapped through random symmetries if asked for
+        """
+        if self.symmetries:
+            return augment(samples, self._rng.integers(0, 8, len(samples)))
+        return samples
+
+
+def main(argv=None):
+    """
+    Exports training samples from recorded games and draws minibatches from them.
+    """
+    import argparse, time
+    parser = argparse.ArgumentParser(prog='dataset', description=main.__doc__.strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('export', help='write the moves of recorded games to shards')
+    command.add_argument('inputs', nargs='+', help='the replay files or archives')
+    command.add_argument('output', help='the directory to write')
+    command.add_argument('--shard', type=int, default=SHARD, help='samples per shard')
+    command = commands.add_parser('sample', help='time one epoch of minibatches')
+    command.add_argument('input', help='the export directory')
+    command.add_argument('--batch', type=int, default=256)
+    command.add_argument('--seed', type=int, default=0)
+    command.add_argument('--mix', type=int, default=4, help='shards shuffled together')
+    command.add_argument('--augment', action='store_true', help='apply random symmetries')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.command == 'export':
+        index = export(args.inputs, args.output, args.shard)
+        seconds = time.perf_counter()-start
+        print('%d games, %d samples in %d shards in %.1fs (%.0f samples/s)' %
+              (index['games'], index['samples'], len(index['shards']), seconds,
+               index['samples']/seconds if seconds else 0))
+    else:
+        sampler = Sampler(args.input, args.batch, args.seed, args.mix, args.augment)
+        count = sum(len(chunk) for chunk in sampler)
+        seconds = time.perf_counter()-start
+        print('%d samples in %d minibatches in %.2fs (%.0f samples/s)' %
+              (count, len(sampler), seconds, count/seconds if seconds else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""
+Compares two agents on paired games, stopping as soon as the result is clear.
+
+Both agents play every seed, so each seed gives one paired difference in score.  Games
+run on a process pool in batches.  After each batch the mean difference is tested,
+and the run stops once it is significant or once the game limit is reached.
+
+Testing after every batch means testing many times, which would inflate the error
+rate of a fixed-sample test.  The limit on looks is known in advance (max_games
+divided by batch), so each look uses a Bonferroni-corrected threshold of alpha/looks.
+This is conservative, but the overall false decision rate stays below alpha however
+many looks are taken.  The test is a normal approximation, so no look is taken
+before MIN_PAIRS pairs, with one exception: if every paired difference so far is
+the same non-zero value (agents that never differ in luck), there is no noise to
+test against and the side that is ahead is decided at once.
+
+For each agent the report gives the mean score and its percentiles, the max-tile
+distribution and the rates of reaching 2048, 4096 and 8192, with confidence intervals.
+"""
+import collections
+import math
+
+import agents
+import stats
+from statistics import NormalDist
+
+# The tiles whose reach rate is reported
+MILESTONES = (2048, 4096, 8192)
+
+# The score percentiles that are reported
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+# The fewest pairs for which the normal approximation of the test is trusted
+MIN_PAIRS = 30
+
+
+class AgentStats(object):
+    """
+    An instance accumulates the results of one agent.
+
+    Every part is kept exactly, so aggregates of separate shards of games merge to
+    exactly the aggregate of all the games, whatever the order.  as_dict and from_dict
+    save and restore an aggregate as JSON.
+
+    Instance Variables:
+        score: [stats.Moments] the game scores
+        moves: [stats.Moments] the game lengths
+        tiles: [collections.Counter] the number of games ending with each max tile
+        scores: [stats.Histogram] the distribution of the game scores
+    """
+
+    def __init__(self):
+        self.score = stats.Moments()
+        self.moves = stats.Moments()
+        self.tiles = collections.Counter()
+        self.scores = stats.Histogram()
+
+    def add(self, result):
+        """
+        Adds a finished game.
+
+        Parameter result: the game
+        Precondition: [agents.GameResult]
+        """
+        self.score.add(result.score)
+        self.moves.add(result.moves)
+        self.tiles[result.max_tile] += 1
+        self.scores.add(result.score)
+
+    def merge(self, other):
+        """
+        Adds every game of another aggregate to this one.
+
+        Parameter other: the aggregate to merge
+        Precondition: [AgentStats]
+        """
+        self.score.merge(other.score)
+        self.moves.merge(other.moves)
+        self.tiles.update(other.tiles)
+        self.scores.merge(other.scores)
+
+    def as_dict(self):
+        """
+        Returns: a JSON-friendly dict with the state of this aggregate
+        """
+        return {'score': self.score.as_dict(), 'moves': self.moves.as_dict(),
+                'tiles': sorted(self.tiles.items()), 'scores': self.scores.as_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Returns: the aggregate saved by as_dict
+
+        Parameter data: the saved state
+        Precondition: [dict] a dict returned by as_dict
+        """
+        result = cls()
+        result.score = stats.Moments.from_dict(data['score'])
+        result.moves = stats.Moments.from_dict(data['moves'])
+        result.tiles = collections.Counter(dict((tile, count) for tile, count in data['tiles']))
+        result.scores = stats.Histogram.from_dict(data['scores'])
+        return result
+
+    def reached(self, tile):
+        """
+        Returns: the number of games whose max tile was at least tile
+
+        Parameter tile: the tile value
+        Precondition: [int] a power of 2
+        """
+        return sum(count for value, count in self.tiles.items() if value >= tile)
+
+    def report(self, confidence):
+        """
+        Returns: a JSON-friendly dict summarizing the results
+
+        The score interval is None for fewer than two games.
+
+        Parameter confidence: the confidence level of the intervals
+        Precondition: [float] 0 < confidence < 1
+        """
+        games = self.score.count
+        result = {'games': games, 'score': self.score.mean,
+                  'score_interval': self.score.interval(confidence) if games > 1 else None,
+                  'score_percentiles': dict(('p%d' % p, self.scores.percentile(p))
+                                            for p in PERCENTILES) if games else {},
+                  'moves': self.moves.mean,
+                  'max_tiles': dict((str(k), v) for k, v in sorted(self.tiles.items()))}
+        for tile in MILESTONES:
+            hits = self.reached(tile)
+            result['reach_%d' % tile] = float(hits)/games if games else 0.0
+            result['reach_%d_interval' % tile] = stats.wilson_interval(hits, games, confidence)
+        return result
+
+
+_worker_agents = None
+
+
+def _init_worker(specs):
+    """
+    Initializes a pool worker with one agent for each (name, options) spec.
+    """
+    global _worker_agents
+    _worker_agents = [agents.make_agent(name, **options) for name, options in specs]
+
+
+def _play(task):
+    """
+    Returns: a tuple (side, pair, result) for one game of one agent
+    """
+    side, pair, seed = task
+    return side, pair, agents.play_game(_worker_agents[side], seed)
+
+
+def compare(spec_a, spec_b, max_games=1000, batch=50, alpha=0.05, seed=0, workers=None,
+            callback=None):
+    """
+    Returns: a JSON-friendly dict comparing two agents
+
+    The dict has an entry for each agent (from AgentStats.report), the paired score
+    difference (a minus b) with its interval (None for fewer than two pairs), and a
+    decision: 'a', 'b' or None if the game limit was reached first.
+
+    Parameter spec_a: the first agent
+    Precondition: [tuple] a pair (name, options) as returned by agents.parse_agent
+
+    Parameter spec_b: the second agent
+    Precondition: [tuple] a pair (name, options) as returned by agents.parse_agent
+
+    Parameter max_games: the largest number of pairs to play
+    Precondition: [int] max_games >= batch
+
+    Parameter batch: the number of pairs played between tests
+    Precondition: [int] batch >= 2
+
+    Parameter alpha: the overall error rate of a decision
+    Precondition: [float] 0 < alpha < 1
+
+    Parameter seed: the run seed (game i uses agents.game_seed(seed, i))
+    Precondition: [int] seed >= 0
+
+    Parameter workers: the number of processes, or None for one per core
+    Precondition: [int] workers > 0, or None
+
+    Parameter callback: called with the partial comparison after every batch
+    Precondition: a function of one argument, or None
+    """
+    import multiprocessing
+    assert batch >= 2 and max_games >= batch, 'invalid batch %s' % repr(batch)
+    looks = int(math.ceil(float(max_games)/batch))
+    threshold = NormalDist().inv_cdf(1-alpha/(2.0*looks))
+
+    sides = [AgentStats(), AgentStats()]
+    diff = stats.RunningMean()
+    decision = None
+    played = 0
+    with multiprocessing.Pool(workers, _init_worker, ([spec_a, spec_b],)) as pool:
+        while played < max_games and decision is None:
+            count = min(batch, max_games-played)
+            tasks = [(side, i, agents.game_seed(seed, i))
+                     for i in range(played, played+count) for side in (0, 1)]
+            pairs = {}
+            for side, pair, result in pool.imap_unordered(_play, tasks):
+                sides[side].add(result)
+                pairs.setdefault(pair, [None, None])[side] = result.score
+            for pair in sorted(pairs):
+                diff.add(pairs[pair][0]-pairs[pair][1])
+            played += count
+
+            if diff.stderr == 0:
+                if diff.mean != 0:
+                    decision = 'a' if diff.mean > 0 else 'b'
+            elif diff.count >= MIN_PAIRS and abs(diff.mean/diff.stderr) >= threshold:
+                decision = 'a' if diff.mean > 0 else 'b'
+            if callback is not None:
+                callback(_summary(sides, diff, decision, threshold, alpha))
+    return _summary(sides, diff, decision, threshold, alpha)
+
+
+def _summary(sides, diff, decision, threshold, alpha):
+    """
+    Returns: the comparison dict for the given aggregates
+    """
+    confidence = 1-alpha
+    interval = None
+    if diff.count > 1:
+        half = threshold*diff.stderr
+        interval = (diff.mean-half, diff.mean+half)
+    return {'a': sides[0].report(confidence), 'b': sides[1].report(confidence),
+            'pairs': diff.count, 'difference': diff.mean,
+            'difference_interval': interval, 'decision': decision}
+
+
+def main(argv=None):
+    """
+    Compares two agents on paired games with sequential early stopping.
+    """
+    import argparse, json
+    parser = argparse.ArgumentParser(description=main.__doc__.strip())
+    parser.add_argument('a', help="first agent, e.g. 'expectimax:depth=1'")
+    parser.add_argument('b', help="second agent, e.g. 'greedy'")
+    parser.add_argument('--max-games', type=int, default=1000)
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', help='write the final comparison as JSON to this file')
+    args = parser.parse_args(argv)
+
+    def progress(result):
+        interval = result['difference_interval'] or (float('nan'), float('nan'))
+        print('%5d pairs: a-b = %.1f  [%.1f, %.1f]' %
+              ((result['pairs'], result['difference'])+tuple(interval)))
+
+    result = compare(agents.parse_agent(args.a), agents.parse_agent(args.b), args.max_games,
+                     args.batch, args.alpha, args.seed, args.workers, progress)
+    for side, spec in (('a', args.a), ('b', args.b)):
+        report = result[side]
+        low, high = report['score_interval'] or (float('nan'), float('nan'))
+        print('%s: score %.1f [%.1f, %.1f]  2048 %.1f%%  4096 %.1f%%  8192 %.1f%%' %
+              (spec, report['score'], low, high, 100*report['reach_2048'],
+               100*report['reach_4096'], 100*report['reach_8192']))
+    if result['decision'] is None:
+        print('undecided after %d pairs' % result['pairs'])
+    else:
+        winner = args.a if result['decision'] == 'a' else args.b
+        print('%s is better (decided after %d pairs)' % (winner, result['pairs']))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
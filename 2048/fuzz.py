@@ -0,0 +1,502 @@
+"""
+Differential fuzzing of fast move functions against Twenty.move.
+
+Twenty.move is the reference: whatever it does is the rule, including the quirk that
+a tile can merge more than once in a single move ([2,2,4,0] moves left to [8,0,0,0]).
+Every other implementation of the move (board.move, batch.move, or a new one) must
+give exactly the same board and score.  Spawns are not compared.
+
+Twenty.move moves every line of the board on its own, so the reference is taken
+line by line: every possible line (65536 of them) is moved in every direction by
+Twenty.move itself, once, at the start of a run, and the results become lookup tables.
+Whole boards are then moved by the tables, vectorized over millions of boards, and
+a sample of whole boards is also moved by Twenty.move directly, to check the tables.
+A board whose move would make a tile above 32768, which a packed board cannot hold,
+is left out.
+
+The boards are generated in batches, a third each of
+
+    random       uniform 4-bit cells
+    sparse       mostly empty cells and small tiles, as in real games
+    adversarial  lines built from patterns that stress merging: runs of equal tiles,
+                 chains like [2,2,4,8], gaps, and tiles near 32768, in rows or columns
+
+A candidate is a function (boards, directions) -> (boards, scores) on NumPy arrays, as
+batch.move is.  CANDIDATES has the built-in ones, and any other can be named as
+module:function.  For the first board on which a candidate differs from the
+reference, the report has the board and also a minimized board (cells cleared and
+lowered while the difference remains), which is usually much easier to read.
+
+Run it as
+
+    python 2048 fuzz --cases 10000000
+    python 2048 fuzz --candidates batch mymodule:move
+
+It exits with status 1 if any candidate differs.  Requires NumPy and Kivy (for Twenty).
+"""
+import array
+import importlib
+import time
+
+import numpy as np
+
+import batch
+import board
+
+# Patterns of adversarial lines, as exponent offsets from a random base (-1 is empty)
+PATTERNS = np.array([[0, 0, 1, 2], [0, 0, 0, 0], [0, -1, 0, 1], [2, 1, 0, 0], [0, 0, 1, 1],
+                     [0, 1, 0, 1], [-1, 0, 0, -1], [0, -1, -1, 0], [1, 0, 0, 1], [0, 0, 0, 1],
+                     [0, 0, 1, 0], [0, 1, 1, 2]], dtype=np.int64)
+
+# The largest tile a packed board can hold
+MAX_TILE = 1 << board.MAX_EXPONENT
+
+
+def _board_move(boards, directions):
+    """
+    Returns: board.move applied to every board, as arrays
+    """
+    move = board.move
+    results = [move(b, d) for b, d in zip(boards.tolist(), directions.tolist())]
+    return (np.array([after for after, score in results], dtype=np.uint64),
+            np.array([score for after, score in results], dtype=np.uint64))
+
+
+# The built-in candidates
+CANDIDATES = {'board': _board_move, 'batch': batch.move}
+
+
+def candidate(name):
+    """
+    Returns: the candidate move function with the given name
+
+    Parameter name: a key of CANDIDATES, or module:function
+    Precondition: [str]
+    """
+    if name in CANDIDATES:
+        return CANDIDATES[name]
+    module, _, function = name.partition(':')
+    assert function, '%s is not a known candidate' % repr(name)
+    return getattr(importlib.import_module(module), function)
+
+
+def _twenty(grid):
+    """
+    Returns: a headless Twenty holding a grid of tile values, which never spawns
+    """
+    import Twenty
+    game = Twenty.Twenty.__new__(Twenty.Twenty)
+    game.playGrid = [row[:] for row in grid]
+    game.blocks = [Twenty.Block(row, col, grid[row][col])
+                   for row in range(4) for col in range(4) if grid[row][col]]
+    game.pressed = []
+    game.plans = {}
+    game.score = 0
+    game.moves = 0
+    game.undos = array.array('Q')
+    game.spawn_block = lambda: None
+    return game
+
+
+def twenty_move(b, direction):
+    """
+    Returns: a pair (board, score) for Twenty.move on a packed board, or None if the
+    move makes a tile above MAX_TILE
+
+    Parameter b: the board
+    Precondition: [int] a packed board
+
+    Parameter direction: the direction
+    Precondition: [int] UP, DOWN, LEFT or RIGHT
+    """
+    game = _twenty(board.to_grid(b))
+    game.move(board.DIRECTIONS[direction])
+    if max(max(row) for row in game.playGrid) > MAX_TILE:
+        return None
+    return board.from_grid(game.playGrid), game.score
+
+
+def reference_tables():
+    """
+    Returns: a tuple (lines, scores, valid) of 4 x 65536 arrays, Twenty.move on every
+    line in every direction
+
+    A line is a row for LEFT and RIGHT, and a column for UP and DOWN, packed as 16
+    bits with its first cell (leftmost or top) lowest, as in a packed board and its
+    transpose.  lines[d][line] is the line after the move, scores[d][line] the points
+    it makes, and valid[d][line] is False where the move makes a tile above MAX_TILE.
+
+    Every call of Twenty.move moves four lines at once.  A tile that merges k times
+    in a move scores 2+4+...+2**k times its value, that is twice what it grows by, so
+    the score of each line is read from the growth of its tiles.
+    """
+    lines = np.zeros((4, 65536), dtype=np.uint64)
+    scores = np.zeros((4, 65536), dtype=np.uint64)
+    valid = np.ones((4, 65536), dtype=bool)
+    for direction, name in enumerate(board.DIRECTIONS):
+        vertical = direction <= board.DOWN
+        for first in range(0, 65536, 4):
+            cells = [[(line >> 4*i) & board.CELL_MASK for i in range(4)]
+                     for line in range(first, first+4)]
+            grid = [[1 << cells[k][i] if cells[k][i] else 0 for i in range(4)] for k in range(4)]
+            if vertical:
+                grid = [list(column) for column in zip(*grid)]
+            game = _twenty(grid)
+            before = dict((block, block.get_val()) for block in game.blocks)
+            game.move(name)
+            after = game.playGrid
+            if vertical:
+                after = [list(column) for column in zip(*after)]
+            gains = [0, 0, 0, 0]
+            # The blocks merged away are gone, and only the blocks they merged into grow
+            for block in game.blocks:
+                k = block.get_col() if vertical else block.get_row()
+                gains[k] += 2*(block.get_val()-before[block])
+            for k in range(4):
+                line = first+k
+                if max(after[k]) > MAX_TILE:
+                    valid[direction, line] = False
+                    continue
+                lines[direction, line] = sum((value.bit_length()-1 if value else 0) << 4*i
+                                             for i, value in enumerate(after[k]))
+                scores[direction, line] = gains[k]
+    return lines, scores, valid
+
+
+def reference_move(tables, boards, directions):
+    """
+    Returns: a tuple (boards, scores, valid) of arrays, the reference moves of boards
+
+    valid is False for the boards whose move would make a tile above MAX_TILE.
+
+    Parameter tables: the reference tables
+    Precondition: [tuple] returned by reference_tables
+
+    Parameter boards: the boards
+    Precondition: [numpy.ndarray] of n uint64 values
+
+    Parameter directions: the direction of each move
+    Precondition: [numpy.ndarray] of n ints, each UP, DOWN, LEFT or RIGHT
+    """
+    lines, scores, valid = tables
+    vertical = directions <= board.DOWN
+    rows = np.where(vertical, batch.transpose(boards), boards)
+    moved = np.zeros(len(boards), dtype=np.uint64)
+    total = np.zeros(len(boards), dtype=np.uint64)
+    ok = np.ones(len(boards), dtype=bool)
+    for i in range(4):
+        line = ((rows >> np.uint64(16*i)) & np.uint64(board.ROW_MASK)).astype(np.intp)
+        moved |= lines[directions, line] << np.uint64(16*i)
+        total += scores[directions, line]
+        ok &= valid[directions, line]
+    return np.where(vertical, batch.transpose(moved), moved), total, ok
+
+
+def _pack_cells(cells):
+    """
+    Returns: the packed boards of an n x 16 array of exponents
+    """
+    return (cells.astype(np.uint64) << batch.SHIFTS).sum(axis=1, dtype=np.uint64)
+
+
+def random_boards(count, rng):
+    """
+    Returns: count boards with uniform random cells
+
+    Parameter count: the number of boards
+    Precondition: [int] count >= 0
+
+    Parameter rng: the random number generator
+    Precondition: [numpy.random.Generator]
+    """
+    return rng.integers(0, 1 << 64, count, dtype=np.uint64)
+
+
+def sparse_boards(count, rng):
+    """
+    Returns: count boards of mostly empty cells and small tiles
+
+    Parameter count: the number of boards
+    Precondition: [int] count >= 0
+
+    Parameter rng: the random number generator
+    Precondition: [numpy.random.Generator]
+    """
+    cells = np.minimum(rng.geometric(0.35, (count, 16)), board.MAX_EXPONENT)
+    cells[rng.random((count, 16)) < 0.5] = 0
+    return _pack_cells(cells)
+
+
+def adversarial_boards(count, rng):
+    """
+    Returns: count boards whose lines come from PATTERNS, in rows or in columns
+
+    Every row is a pattern on a random base exponent, with tiles near the top of the
+    range as likely as small ones, and reversed half the time.  Half the boards are
+    transposed, so the patterns are in the columns.
+
+    Parameter count: the number of boards
+    Precondition: [int] count >= 0
+
+    Parameter rng: the random number generator
+    Precondition: [numpy.random.Generator]
+    """
+    offsets = PATTERNS[rng.integers(0, len(PATTERNS), 4*count)]
+    reverse = rng.random(4*count) < 0.5
+    offsets[reverse] = offsets[reverse, ::-1]
+    base = rng.integers(1, board.MAX_EXPONENT+1, (4*count, 1))
+    cells = np.where(offsets < 0, 0, np.minimum(base+offsets, board.MAX_EXPONENT))
+    boards = _pack_cells(cells.reshape(count, 16))
+    return np.where(rng.random(count) < 0.5, batch.transpose(boards), boards)
+
+
+# The board generators, each making a third of every batch
+GENERATORS = (random_boards, sparse_boards, adversarial_boards)
+
+
+def generate(count, rng):
+    """
+    Returns: a pair (boards, directions) of arrays of count test cases
+
+    Parameter count: the number of cases
+    Precondition: [int] count >= 0
+
+    Parameter rng: the random number generator
+    Precondition: [numpy.random.Generator]
+    """
+    sizes = [count//3, count//3, count-2*(count//3)]
+    boards = np.concatenate([make(size, rng) for make, size in zip(GENERATORS, sizes)])
+    return boards, rng.integers(0, 4, count)
+
+
+def _differs(tables, move, b, direction):
+    """
+    Returns: True if move and the reference differ on one valid case
+    """
+    boards = np.array([b], dtype=np.uint64)
+    directions = np.array([direction], dtype=np.intp)
+    expected, score, valid = reference_move(tables, boards, directions)
+    if not valid[0]:
+        return False
+    after, gain = move(boards, directions)
+    return int(after[0]) != int(expected[0]) or int(gain[0]) != int(score[0])
+
+
+def minimize(tables, move, b, direction):
+    """
+    Returns: a board, as small as this can make it, on which move still differs from
+    the reference in the given direction
+
+    All the tiles are halved together, and cells are cleared or lowered one at a
+    time, for as long as some change keeps the difference.
+
+    Parameter tables: the reference tables
+    Precondition: [tuple] returned by reference_tables
+
+    Parameter move: the candidate
+    Precondition: [callable] a candidate move function
+
+    Parameter b: the board
+    Precondition: [int] a packed board on which move differs from the reference
+
+    Parameter direction: the direction
+    Precondition: [int] UP, DOWN, LEFT or RIGHT
+    """
+    changed = True
+    while changed:
+        changed = False
+        cells = [(b >> shift) & board.CELL_MASK for shift in range(0, 64, 4)]
+        if min(cell for cell in cells if cell) > 1:
+            halved = sum(cell-1 << 4*i for i, cell in enumerate(cells) if cell)
+            if _differs(tables, move, halved, direction):
+                b = halved
+                changed = True
+                continue
+        for shift in range(0, 64, 4):
+            cell = (b >> shift) & board.CELL_MASK
+            for lower in range(cell):
+                smaller = b & ~(board.CELL_MASK << shift) | (lower << shift)
+                if _differs(tables, move, smaller, direction):
+                    b = smaller
+                    changed = True
+                    break
+    return b
+
+
+def _divergence(tables, move, b, direction):
+    """
+    Returns: a dict describing a case where move differs from the reference
+
+    The boards in it are packed boards.
+    """
+    boards = np.array([b], dtype=np.uint64)
+    directions = np.array([direction], dtype=np.intp)
+    after, gain = move(boards, directions)
+    small = minimize(tables, move, b, direction)
+    small_after, small_gain = move(np.array([small], dtype=np.uint64), directions)
+    # The minimized case is confirmed by Twenty.move itself
+    expected = twenty_move(b, direction)
+    small_expected = twenty_move(small, direction)
+    return {'direction': board.DIRECTIONS[direction],
+            'board': b, 'expected': expected[0], 'expected_score': expected[1],
+            'got': int(after[0]), 'got_score': int(gain[0]),
+            'minimized_board': small, 'minimized_expected': small_expected[0],
+            'minimized_expected_score': small_expected[1],
+            'minimized_got': int(small_after[0]), 'minimized_got_score': int(small_gain[0])}
+
+
+def check_tables(tables, count, rng):
+    """
+    Returns: the number of boards, of count random ones, on which the reference tables
+    differ from Twenty.move on the whole board
+
+    Parameter tables: the reference tables
+    Precondition: [tuple] returned by reference_tables
+
+    Parameter count: the number of boards
+    Precondition: [int] count >= 0
+
+    Parameter rng: the random number generator
+    Precondition: [numpy.random.Generator]
+    """
+    boards, directions = generate(count, rng)
+    expected, scores, valid = reference_move(tables, boards, directions)
+    wrong = 0
+    for i in range(count):
+        result = twenty_move(int(boards[i]), int(directions[i]))
+        if result is None:
+            wrong += bool(valid[i])
+        elif not valid[i] or result != (int(expected[i]), int(scores[i])):
+            wrong += 1
+    return wrong
+
+
+def fuzz(names, cases, chunk=1 << 18, seed=0, tables=None, callback=None):
+    """
+    Returns: a dict with the results of fuzzing the candidates
+
+    The result has the number of cases, the number left out as unrepresentable, and
+    for each candidate its first divergence (see above), or None if it never differed.
+    A candidate is not tested further once it has differed.
+
+    Parameter names: the candidates
+    Precondition: [list] of names accepted by candidate
+
+    Parameter cases: the number of cases
+    Precondition: [int] cases > 0
+
+    Parameter chunk: the number of cases generated and compared at once
+    Precondition: [int] chunk > 0
+
+    Parameter seed: the seed of the cases
+    Precondition: [int] seed >= 0
+
+    Parameter tables: the reference tables, or None to build them
+    Precondition: [tuple] returned by reference_tables, or None
+
+    Parameter callback: a function called after every chunk with the cases so far,
+    or None
+    Precondition: [callable] taking an int, or None
+    """
+    tables = reference_tables() if tables is None else tables
+    rng = np.random.default_rng(seed)
+    moves = dict((name, candidate(name)) for name in names)
+    result = {'cases': 0, 'unrepresentable': 0, 'divergences': dict((name, None) for name in names)}
+    while result['cases'] < cases:
+        boards, directions = generate(min(chunk, cases-result['cases']), rng)
+        expected, scores, valid = reference_move(tables, boards, directions)
+        for name, move in moves.items():
+            if result['divergences'][name] is not None:
+                continue
+            after, gains = move(boards, directions)
+            wrong = np.flatnonzero(valid & ((after != expected) | (gains != scores)))
+            if len(wrong):
+                i = wrong[0]
+                result['divergences'][name] = _divergence(tables, move, int(boards[i]),
+                                                          int(directions[i]))
+        result['cases'] += len(boards)
+        result['unrepresentable'] += int((~valid).sum())
+        if callback is not None:
+            callback(result['cases'])
+    return result
+
+
+def _side_by_side(titles, boards):
+    """
+    Returns: the lines of a row of boards, with their titles
+    """
+    grids = [board.to_grid(b) for b in boards]
+    lines = ['  '.join('%-23s' % title for title in titles).rstrip()]
+    for row in range(4):
+        lines.append('  '.join(''.join('%6d' % value for value in grid[row])[1:]
+                               for grid in grids))
+    return lines
+
+
+def describe(name, divergence):
+    """
+    Returns: a readable description of the result of a candidate, as a list of lines
+
+    Parameter name: the candidate
+    Precondition: [str]
+
+    Parameter divergence: its first divergence, or None
+    Precondition: [dict] as in the result of fuzz, or None
+    """
+    if divergence is None:
+        return ['%s: no divergence' % name]
+    lines = ['%s: differs from Twenty.move moving %s' % (name, divergence['direction'])]
+    for prefix in ('', 'minimized_'):
+        lines.extend(_side_by_side(
+            [prefix.replace('_', ' ')+'board', 'expected (score %d)' % divergence[prefix+'expected_score'],
+             'got (score %d)' % divergence[prefix+'got_score']],
+            [divergence[prefix+'board'], divergence[prefix+'expected'], divergence[prefix+'got']]))
+    return lines
+
+
+def main(argv=None):
+    """
+    Fuzzes fast move functions against Twenty.move.
+    """
+    import argparse, sys
+    parser = argparse.ArgumentParser(prog='fuzz', description=main.__doc__.strip())
+    parser.add_argument('--candidates', nargs='+', default=sorted(CANDIDATES),
+                        help='the candidates, names in CANDIDATES or module:function')
+    parser.add_argument('--cases', type=int, default=1000000)
+    parser.add_argument('--chunk', type=int, default=1 << 18, help='cases per batch')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--direct', type=int, default=2000,
+                        help='whole boards to check with Twenty.move against the tables')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    tables = reference_tables()
+    built = time.perf_counter()
+    print('reference tables built from Twenty.move in %.1fs' % (built-start), file=sys.stderr)
+    wrong = check_tables(tables, args.direct, np.random.default_rng(args.seed+1))
+    if wrong:
+        print('the reference tables differ from Twenty.move on %d of %d boards' %
+              (wrong, args.direct), file=sys.stderr)
+        sys.exit(1)
+    every = [built]
+
+    def progress(cases):
+        now = time.perf_counter()
+        if now-every[0] >= 10.0:
+            every[0] = now
+            print('%d/%d cases  %.0f cases/min' % (cases, args.cases, 60*cases/(now-built)),
+                  file=sys.stderr)
+
+    result = fuzz(args.candidates, args.cases, args.chunk, args.seed, tables, progress)
+    seconds = time.perf_counter()-built
+    print('%d cases (%d unrepresentable, %d checked directly) in %.1fs, %.0f cases/min' %
+          (result['cases'], result['unrepresentable'], args.direct, seconds,
+           60*result['cases']/seconds))
+    for name in args.candidates:
+        print('\n'.join(describe(name, result['divergences'][name])))
+    if any(divergence is not None for divergence in result['divergences'].values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -203,6 +203,7 @@ class GObject(object):
     @angle.setter
     def angle(self,value):
         assert type(value) in [int,float], '%s is not a number' % repr(value)
+        import numpy as np
         diff = np.allclose([self._rotate.angle],[value])
         self._rotate.angle = float(value)
         if not diff:
@@ -0,0 +1,162 @@
+"""
+A background hint engine for the GUI.
+
+Any search is far too slow to run inside GameApp.update, which must finish in a few
+milliseconds to keep the frame rate.  A HintEngine runs the search in a separate
+process instead, so it does not even compete with the GUI for the GIL.
+
+The GUI talks to the engine with two queues.  request sends a board to search and
+poll, called once per frame, drains the results without ever blocking.  Every request
+has a generation number, kept in shared memory.  When the player moves, the GUI simply
+makes a new request.  The worker notices that its generation is stale and abandons
+the search in progress, and any stale results still in the queue are discarded.
+
+The worker deepens its search one layer at a time and posts a result after each
+layer, so a hint appears almost immediately and then improves.  Positions found in an
+opening book (if one is given) are answered straight away.
+
+This module must never import Kivy, as the worker process imports it too.
+"""
+import multiprocessing
+import os
+import queue
+
+import board
+import search
+
+
+def _serve(requests, results, generation, depth, book_path):
+    """
+    The body of the worker process.
+
+    Parameter requests: the queue of (generation, board) requests, ended by None
+    Precondition: [multiprocessing.Queue]
+
+    Parameter results: the queue of (generation, depth, direction) results
+    Precondition: [multiprocessing.Queue]
+
+    Parameter generation: the number of the latest request
+    Precondition: [multiprocessing.Value] of type 'q'
+
+    Parameter depth: the deepest search to run
+    Precondition: [int] depth > 0
+
+    Parameter book_path: an opening book file, or None
+    Precondition: [str] or None
+    """
+    from transposition import LocalTable
+    if hasattr(os, 'nice'):
+        # Yield to the GUI when they must share a core
+        os.nice(10)
+    book = None
+    if book_path is not None:
+        from openingbook import OpeningBook
+        book = OpeningBook(book_path)
+    table = LocalTable()
+
+    while True:
+        message = requests.get()
+        # Skip straight to the newest request
+        while message is not None:
+            try:
+                message = requests.get_nowait()
+            except queue.Empty:
+                break
+        if message is None:
+            break
+        mine, b = message
+        if mine != generation.value:
+            continue
+
+        if book is not None:
+            move = book.lookup(b)
+            if move is not None:
+                results.put((mine, depth, move))
+                continue
+
+        table.clear()
+        for level in range(1, depth+1):
+            searcher = search.Expectimax(level, table=table)
+            searcher.abort = lambda: generation.value != mine
+            try:
+                move = searcher.choose(b)
+            except search.SearchAborted:
+                break
+            results.put((mine, level, move))
+
+
+class HintEngine(object):
+    """
+    An instance runs hint searches in a background process.
+
+    Instance Variables:
+        depth: [int > 0] the deepest search the engine runs
+        hint: [int or None] the latest suggested direction (board.UP, ...) for the
+            current request, or None if there is none yet
+        hint_depth: [int] the search depth of hint (0 if hint is None)
+    """
+
+    def __init__(self, depth=3, book=None):
+        """
+        Creates and starts a new hint engine.
+
+        Parameter depth: the deepest search to run
+        Precondition: [int] depth > 0
+
+        Parameter book: an opening book file, or None
+        Precondition: [str] or None
+        """
+        self.depth = depth
+        self.hint = None
+        self.hint_depth = 0
+        self._board = None
+        self._requests = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._generation = multiprocessing.Value('q', 0, lock=False)
+        self._process = multiprocessing.Process(target=_serve, daemon=True,
+            args=(self._requests, self._results, self._generation, depth, book))
+        self._process.start()
+
+    def request(self, b):
+        """
+        Asks for a hint on board b, cancelling any search in progress.
+
+        Nothing happens if b is the board already requested.
+
+        Parameter b: the board to search
+        Precondition: [int] a packed board
+        """
+        if b == self._board:
+            return
+        self._board = b
+        self.hint = None
+        self.hint_depth = 0
+        self._generation.value += 1
+        self._requests.put((self._generation.value, b))
+
+    def poll(self):
+        """
+        Returns: the latest hint, after draining any results that have arrived
+
+        This never blocks, so it is safe to call once per frame.
+        """
+        current = self._generation.value
+        while True:
+            try:
+                mine, level, move = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if mine == current and level >= self.hint_depth:
+                self.hint = move
+                self.hint_depth = level
+        return self.hint
+
+    def stop(self):
+        """
+        Stops the worker process.
+        """
+        self._generation.value += 1
+        self._requests.put(None)
+        self._process.join(1.0)
+        if self._process.is_alive():
+            self._process.terminate()
@@ -0,0 +1,279 @@
+"""
+A persistent history of finished games, with a leaderboard.
+
+Games are kept in a local SQLite database, one row per game: when it finished, the
+agent that played it ('human' for games played in the GUI), its seed (if it has one),
+score, highest tile, number of moves and duration.  The database is in WAL mode, so
+one process can write to it while others read it, and readers never wait.
+
+Inserts are batched: History.add only buffers a row, and the rows go to the database
+in one transaction of up to batch rows, which is what makes bulk runs of millions of
+games cheap (see the --history option of simulate).  The seeded games of an agent are
+unique, so writing the same games again, as a resumed simulation may, is harmless.
+
+The queries a leaderboard needs are served by indexes, overall or for one agent.  The
+games per highest tile are counted from covering indexes, without reading the table.
+The top n scores walk an index on the score, which is not covering, so they read just
+the n rows they return from the table (not every row).
+
+A Leaderboard does all its reading and writing on a background thread, with its own
+connection, so the GUI can record games and show the best scores without ever waiting
+for the disk.
+
+Run it as
+
+    python 2048 history top --agent human
+    python 2048 history tiles
+
+This module must never import Kivy.
+"""
+import queue
+import sqlite3
+import threading
+import time
+
+# The agent of games played in the GUI
+HUMAN = 'human'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    finished REAL NOT NULL,
+    agent TEXT NOT NULL,
+    seed INTEGER,
+    score INTEGER NOT NULL,
+    max_tile INTEGER NOT NULL,
+    moves INTEGER NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS games_seed ON games (agent, seed);
+CREATE INDEX IF NOT EXISTS games_score ON games (score DESC);
+CREATE INDEX IF NOT EXISTS games_agent_score ON games (agent, score DESC);
+CREATE INDEX IF NOT EXISTS games_max_tile ON games (max_tile);
+CREATE INDEX IF NOT EXISTS games_agent_max_tile ON games (agent, max_tile);
+"""
+
+_INSERT = ('INSERT OR IGNORE INTO games (finished, agent, seed, score, max_tile, moves, duration) '
+           'VALUES (?, ?, ?, ?, ?, ?, ?)')
+
+
+class History(object):
+    """
+    An instance is a connection to a game history database.
+
+    A History must be used only by the thread that created it.
+
+    Instance Variables:
+        path: [str] the database file
+        batch: [int > 0] the number of rows buffered before they are written
+    """
+
+    def __init__(self, path, batch=1000):
+        """
+        Opens a history database, creating it if need be.
+
+        Parameter path: the database file
+        Precondition: [str] a file name
+
+        Parameter batch: the number of rows buffered before they are written
+        Precondition: [int] batch > 0
+        """
+        assert type(batch) == int and batch > 0, '%s is not a valid batch size' % repr(batch)
+        self.path = path
+        self.batch = batch
+        self._db = sqlite3.connect(path, timeout=30.0)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # In WAL mode this is still safe from corruption, and commits need no fsync
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+        self._rows = []
+
+    def add(self, agent, seed, score, max_tile, moves, duration, finished=None):
+        """
+        Buffers a finished game, writing the buffer when it is full.
+
+        Parameter agent: the agent that played the game
+        Precondition: [str] an agent description, or HUMAN
+
+        Parameter seed: the seed of the game, or None if it has none
+        Precondition: [int] 0 <= seed < 2**63, or None
+
+        Parameter score: the final score
+        Precondition: [int] score >= 0
+
+        Parameter max_tile: the highest tile
+        Precondition: [int] a power of two
+
+        Parameter moves: the number of moves
+        Precondition: [int] moves >= 0
+
+        Parameter duration: the seconds the game took
+        Precondition: [int or float] duration >= 0
+
+        Parameter finished: the time the game finished, or None for now
+        Precondition: [float] seconds since the epoch, or None
+        """
+        finished = time.time() if finished is None else finished
+        self._rows.append((finished, agent, seed, score, max_tile, moves, duration))
+        if len(self._rows) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered games in one transaction.
+        """
+        if self._rows:
+            with self._db:
+                self._db.executemany(_INSERT, self._rows)
+            self._rows = []
+
+    def count(self, agent=None):
+        """
+        Returns: the number of games written, for one agent or all of them
+
+        Parameter agent: the agent, or None for all agents
+        Precondition: [str] or None
+        """
+        if agent is None:
+            return self._db.execute('SELECT COUNT(*) FROM games').fetchone()[0]
+        return self._db.execute('SELECT COUNT(*) FROM games WHERE agent = ?', (agent,)).fetchone()[0]
+
+    def top(self, n=10, agent=None):
+        """
+        Returns: a list of up to n tuples (score, max_tile, moves, duration, finished,
+        agent) for the best games, best first
+
+        Parameter n: the number of games
+        Precondition: [int] n > 0
+
+        Parameter agent: the agent, or None for all agents
+        Precondition: [str] or None
+        """
+        columns = 'SELECT score, max_tile, moves, duration, finished, agent FROM games '
+        if agent is None:
+            return self._db.execute(columns+'ORDER BY score DESC LIMIT ?', (n,)).fetchall()
+        return self._db.execute(columns+'WHERE agent = ? ORDER BY score DESC LIMIT ?',
+                                (agent, n)).fetchall()
+
+    def tiles(self, agent=None):
+        """
+        Returns: a list of pairs (max_tile, games), by increasing tile
+
+        Parameter agent: the agent, or None for all agents
+        Precondition: [str] or None
+        """
+        if agent is None:
+            return self._db.execute('SELECT max_tile, COUNT(*) FROM games '
+                                    'GROUP BY max_tile ORDER BY max_tile').fetchall()
+        return self._db.execute('SELECT max_tile, COUNT(*) FROM games WHERE agent = ? '
+                                'GROUP BY max_tile ORDER BY max_tile', (agent,)).fetchall()
+
+    def close(self):
+        """
+        Writes any buffered games and closes the database.
+        """
+        self.flush()
+        self._db.close()
+
+
+class Leaderboard(object):
+    """
+    An instance keeps a leaderboard up to date on a background thread.
+
+    The thread owns its own History.  record hands it a game through a queue, and the
+    thread writes it and reads the best games again, as it also does every few
+    seconds in case other processes have added games.  Neither record nor the
+    attributes below ever wait for the database.
+
+    Instance Variables:
+        top: [list] the latest result of History.top, or None before the first read
+        version: [int >= 0] the number of times top has been read
+    """
+
+    def __init__(self, path, n=10, agent=HUMAN, every=5.0):
+        """
+        Opens the history and starts the thread.
+
+        Parameter path: the database file
+        Precondition: [str] a file name
+
+        Parameter n: the number of games on the leaderboard
+        Precondition: [int] n > 0
+
+        Parameter agent: the agent of the leaderboard, or None for all agents
+        Precondition: [str] or None
+
+        Parameter every: the seconds between reads when nothing is recorded
+        Precondition: [int or float] every > 0
+        """
+        self.top = None
+        self.version = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, args=(path, n, agent, every),
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self, path, n, agent, every):
+        """
+        The body of the thread.
+        """
+        history = History(path, batch=1)
+        while True:
+            try:
+                row = self._queue.get(timeout=every)
+            except queue.Empty:
+                row = ()
+            if row is None:
+                break
+            if row:
+                history.add(*row)
+            self.top = history.top(n, agent)
+            self.version += 1
+        history.close()
+
+    def record(self, agent, seed, score, max_tile, moves, duration):
+        """
+        Records a finished game (see History.add), without waiting.
+        """
+        self._queue.put((agent, seed, score, max_tile, moves, duration, time.time()))
+
+    def stop(self):
+        """
+        Writes any games still queued and stops the thread.
+        """
+        self._queue.put(None)
+        self._thread.join(5.0)
+
+
+def main(argv=None):
+    """
+    Shows the leaderboard and the highest tiles of a game history database.
+    """
+    import argparse
+    from consts import HISTORY_FILE
+    parser = argparse.ArgumentParser(prog='history', description=main.__doc__.strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('top', help='show the best games')
+    command.add_argument('-n', type=int, default=10, help='the number of games')
+    command = commands.add_parser('tiles', help='count the games by highest tile')
+    for command in commands.choices.values():
+        command.add_argument('--db', default=HISTORY_FILE, help='the database file')
+        command.add_argument('--agent', help="only the games of this agent, e.g. 'human'")
+    args = parser.parse_args(argv)
+
+    history = History(args.db)
+    if args.command == 'top':
+        for rank, (score, tile, moves, duration, finished, agent) in enumerate(
+                history.top(args.n, args.agent), 1):
+            print('%3d. %7d  %5d  %5d moves  %7.1fs  %s  %s' %
+                  (rank, score, tile, moves, duration,
+                   time.strftime('%Y-%m-%d %H:%M', time.localtime(finished)), agent))
+    else:
+        games = history.count(args.agent)
+        for tile, count in history.tiles(args.agent):
+            print('%6d  %9d  %5.1f%%' % (tile, count, 100.0*count/games))
+    history.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Merges the summaries of simulation shards into one.
+
+A big simulation can be split into shards that play separate ranges of game numbers
+(see the module simulate), in separate runs or on separate machines.  Each shard
+writes a JSON summary holding its exact aggregate (an evaluate.AgentStats).  This
+tool merges any number of them, in any order, into the summary of all the games.
+
+Merging is exact: the means, intervals, max-tile counts and reach rates are the same
+as for one run over all the games, and the percentiles come from the merged score
+histograms, so they have the same bounded error (see stats.Histogram).  The output
+has the same form as the inputs, so merged summaries can be merged again.
+
+Run it as
+
+    python 2048 merge shard*.json --output all.json
+"""
+from evaluate import AgentStats
+
+
+def ranges(document):
+    """
+    Returns: the sorted list of game number ranges [first, end) covered by a summary
+
+    Parameter document: the summary
+    Precondition: [dict] a summary written by simulate or by this module
+    """
+    if 'ranges' in document:
+        return sorted(tuple(span) for span in document['ranges'])
+    return [(document['first'], document['first']+document['games'])]
+
+
+def merge(documents, confidence=0.95):
+    """
+    Returns: the summary of all the games of the given summaries
+
+    The summaries must be of the same agent and run seed, and cover separate games.
+
+    Parameter documents: the summaries to merge
+    Precondition: [list] of summaries written by simulate or by this module
+
+    Parameter confidence: the confidence level of the intervals
+    Precondition: [float] 0 < confidence < 1
+    """
+    assert len(documents) > 0, 'there are no summaries to merge'
+    for key in ('agent', 'seed'):
+        values = set(document[key] for document in documents)
+        if len(values) > 1:
+            raise ValueError('the summaries have different values of %s: %s' %
+                             (repr(key), ', '.join(map(repr, sorted(values)))))
+
+    spans = sorted(span for document in documents for span in ranges(document))
+    covered = []
+    for first, end in spans:
+        if covered and first < covered[-1][1]:
+            raise ValueError('games %d to %d are in more than one summary' %
+                             (first, min(end, covered[-1][1])-1))
+        if covered and first == covered[-1][1]:
+            covered[-1][1] = end
+        else:
+            covered.append([first, end])
+
+    total = AgentStats()
+    for document in documents:
+        total.merge(AgentStats.from_dict(document['summary']))
+    result = {'agent': documents[0]['agent'], 'seed': documents[0]['seed'],
+              'shards': sum(document.get('shards', 1) for document in documents),
+              'ranges': covered}
+    result.update(total.report(confidence))
+    result.update({'total_moves': total.moves.total, 'summary': total.as_dict()})
+    return result
+
+
+def main(argv=None):
+    """
+    Merges the JSON summaries of simulation shards.
+    """
+    import argparse, json
+    parser = argparse.ArgumentParser(prog='merge', description=main.__doc__.strip())
+    parser.add_argument('summaries', nargs='+', help='the summaries written by simulate')
+    parser.add_argument('--output', help='write the merged summary to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    documents = []
+    for path in args.summaries:
+        with open(path) as file:
+            documents.append(json.load(file))
+    try:
+        result = merge(documents)
+    except ValueError as e:
+        parser.error(str(e))
+    text = json.dumps(result, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(text+'\n')
+
+
+if __name__ == '__main__':
+    main()
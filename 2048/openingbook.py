@@ -0,0 +1,217 @@
+"""
+An opening book of precomputed best moves for the early game.
+
+The first few spawns of a game can only produce a small set of positions, and most of
+those are rotations or reflections of each other.  The builder enumerates every
+canonical position reachable within the first N spawns (see board.canonical), runs a
+deep expectimax search on each one on a process pool, and writes the answers to a
+compact binary file.
+
+The file is a 16-byte header, then the canonical boards as sorted little-endian 64-bit
+ints, then one byte per board with its best move (in the canonical orientation):
+
+    magic   6 bytes   b'2048BK'
+    version uint16    FORMAT_VERSION
+    count   uint64    the number of positions
+    keys    count x uint64, sorted
+    moves   count x uint8
+
+OpeningBook memory-maps the file and binary searches the keys, so opening even a big
+book is instant and a lookup touches only a few pages.
+"""
+import array
+import bisect
+import mmap
+import os
+import struct
+import sys
+
+import board
+import search
+
+MAGIC = b'2048BK'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<6sHQ')
+
+
+def reachable(spawns):
+    """
+    Returns: the sorted list of canonical boards reachable within the given spawns
+
+    The two starting tiles count as two spawns, and every legal move is followed by
+    one more.  Every value of SPAWNABLE is tried in every empty cell.
+
+    Parameter spawns: the number of spawns
+    Precondition: [int] spawns >= 2
+    """
+    assert type(spawns) == int and spawns >= 2, '%s is not a valid spawn count' % repr(spawns)
+    exps = [value.bit_length()-1 for value in board.SPAWNABLE]
+    level = set([0])
+    for _ in range(2):
+        level = set(board.canonical(b | e << c)[0]
+                    for b in level for c in board.empty_cells(b) for e in exps)
+    found = set(level)
+    for _ in range(2, spawns):
+        afters = set(board.shift(b, d) for b in level for d in board.legal_moves(b))
+        level = set(board.canonical(a | e << c)[0]
+                    for a in afters for c in board.empty_cells(a) for e in exps)
+        found |= level
+    return sorted(found)
+
+
+_worker_search = None
+
+
+def _init_worker(depth):
+    """
+    Initializes a pool worker with its own search and cache.
+    """
+    from transposition import LocalTable
+    global _worker_search
+    _worker_search = search.Expectimax(depth, table=LocalTable())
+
+
+def _best_move(key):
+    """
+    Returns: the best move for a canonical board, or 255 if there is none
+    """
+    choice = _worker_search.choose(key)
+    return 255 if choice is None else choice
+
+
+def build(path, spawns, depth=3, workers=None, progress=None):
+    """
+    Returns: the number of positions written to a new opening book
+
+    The book is written to a temporary file and renamed into place when complete.
+
+    Parameter path: the book file
+    Precondition: [str] a file name
+
+    Parameter spawns: the number of spawns covered by the book
+    Precondition: [int] spawns >= 2
+
+    Parameter depth: the search depth for each position
+    Precondition: [int] depth > 0
+
+    Parameter workers: the number of processes, or None for one per core
+    Precondition: [int] workers > 0, or None
+
+    Parameter progress: called with the number of positions searched so far
+    Precondition: a function of one argument, or None
+    """
+    import multiprocessing
+    keys = reachable(spawns)
+    moves = bytearray(len(keys))
+    with multiprocessing.Pool(workers, _init_worker, (depth,)) as pool:
+        for i, move in enumerate(pool.imap(_best_move, keys, chunksize=16)):
+            moves[i] = move
+            if progress is not None and (i+1) % 1000 == 0:
+                progress(i+1)
+
+    temp = path+'.tmp'
+    with open(temp, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(keys)))
+        file.write(struct.pack('<%dQ' % len(keys), *keys))
+        file.write(moves)
+    os.replace(temp, path)
+    return len(keys)
+
+
+class OpeningBook(object):
+    """
+    An instance is a read-only, memory-mapped opening book.
+
+    Instance Variables:
+        path: [str] the book file
+    """
+
+    def __init__(self, path):
+        """
+        Opens an opening book.
+
+        Parameter path: the book file
+        Precondition: [str] a file written by build
+        """
+        self.path = path
+        with open(path, 'rb') as file:
+            try:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # An empty file cannot be mapped
+                raise IOError('%s is not an opening book' % repr(path))
+        if len(self._map) < _HEADER.size:
+            self._map.close()
+            raise IOError('%s is not an opening book' % repr(path))
+        magic, version, count = _HEADER.unpack_from(self._map, 0)
+        start = _HEADER.size
+        if magic != MAGIC or version != FORMAT_VERSION or len(self._map) < start+9*count:
+            self._map.close()
+            raise IOError('%s is not an opening book' % repr(path))
+        self._view = memoryview(self._map)
+        keys = self._view[start:start+8*count]
+        if sys.byteorder == 'little':
+            self._keys = keys.cast('Q')
+        else:
+            self._keys = array.array('Q', keys.tobytes())
+            self._keys.byteswap()
+        self._moves = self._view[start+8*count:start+9*count]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, b):
+        return self.lookup(b) is not None
+
+    def lookup(self, b):
+        """
+        Returns: the book move for board b, or None if b is not in the book
+
+        The book stores canonical boards, so b is canonicalized first and the stored
+        move is mapped back to the orientation of b.
+
+        Parameter b: the board to look up
+        Precondition: [int] a packed board
+        """
+        key, symmetry = board.canonical(b)
+        i = bisect.bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            return None
+        move = self._moves[i]
+        if move > 3:
+            return None
+        return board.SYMMETRY_MOVES[symmetry].index(move)
+
+    def close(self):
+        """
+        Unmaps the book file.
+        """
+        if isinstance(self._keys, memoryview):
+            self._keys.release()
+        self._moves.release()
+        self._view.release()
+        self._map.close()
+
+
+def main(argv=None):
+    """
+    Builds an opening book for the first few spawns of a game.
+    """
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description=main.__doc__.strip())
+    parser.add_argument('output', help='the book file to write')
+    parser.add_argument('--spawns', type=int, default=4)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    count = build(args.output, args.spawns, args.depth, args.workers,
+                  lambda done: print('%d positions searched' % done))
+    print('%d positions (%d bytes) in %.1fs' %
+          (count, os.path.getsize(args.output), time.perf_counter()-start))
+
+
+if __name__ == '__main__':
+    main()
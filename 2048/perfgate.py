@@ -0,0 +1,253 @@
+"""
+A performance regression gate: reruns benchmarks and compares them to a baseline.
+
+The benchmarks are the cases of the module bench.  By default the gate runs the ones
+that matter most for play: Twenty.move (every direction and density), spawn_block,
+and a whole GUI frame (clear, update and draw, as GameApp runs it) with a view that
+only counts drawing commands.  A baseline is simply a report of bench, from
+
+    python 2048 perfgate baseline.json --record
+
+and the gate
+
+    python 2048 perfgate baseline.json
+
+reruns every case in the baseline, with the same number of calls, rounds, warmup and
+seed, and compares the two samples of each case.  A case is a regression when it is
+both significantly slower (a one-sided Mann-Whitney test, at level --alpha) and
+slower by more than its threshold (in the median time per call).  The test alone
+would flag tiny slowdowns once there are enough rounds, and the threshold alone
+would flag noise, so it takes both.  Thresholds are set per case or group with
+--limit, e.g. --limit gui=0.25 twenty.move.up.14=0.05; the longest matching name wins.
+
+The gate exits with status 1 if any case regressed, so a script can run it before a
+merge.  Timings only compare on the same machine, so it warns when the baseline was
+recorded on another one (or another Python).
+"""
+import json
+import statistics
+import sys
+
+import bench
+import stats
+
+# The cases the gate runs by default
+GATED = ('twenty.move', 'twenty.spawn_block', 'gui.frame')
+# The default rounds when recording a baseline (more than bench, for the test)
+REPEAT = 30
+WARMUP = 5
+# The significance level of the test
+ALPHA = 0.01
+# The largest slowdown that is not a regression, unless a limit says otherwise
+THRESHOLD = 0.10
+# The default limits of noisier cases: a GUI frame is mostly Kivy rendering text
+LIMITS = {'gui': 0.20}
+
+
+def threshold(name, limits):
+    """
+    Returns: the threshold of a case, from the longest name in limits that matches it
+
+    Parameter name: the name of the case
+    Precondition: [str]
+
+    Parameter limits: thresholds of cases or groups, by name ('' matches everything)
+    Precondition: [dict] of str to float
+    """
+    best = None
+    for prefix in limits:
+        if (prefix == '' or bench.selected(name, [prefix])) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return THRESHOLD if best is None else limits[best]
+
+
+def rerun(baseline, names=None, callback=None):
+    """
+    Returns: a report of bench, rerunning the cases of the baseline as they were run
+
+    Cases of the baseline that bench no longer has are left out.
+
+    Parameter baseline: the baseline
+    Precondition: [dict] a report of bench
+
+    Parameter names: if not None, only the cases whose names start with one of these
+    Precondition: [list] of str, or None
+
+    Parameter callback: if not None, called with the name and result of every case
+    Precondition: [callable] or None
+    """
+    seed = baseline.get('seed', 0)
+    results = {}
+    for name, make, number in bench.cases():
+        if name in baseline['cases'] and bench.selected(name, names):
+            old = baseline['cases'][name]
+            results[name] = bench.time_case(make, old['number'], old['repeat'], old['warmup'], seed)
+            if callback is not None:
+                callback(name, results[name])
+    report = bench.environment()
+    report.update(seed=seed, cases=results)
+    return report
+
+
+def compare(baseline, current, alpha=ALPHA, limits=None):
+    """
+    Returns: a list with a dict for every case of the baseline, comparing it to current
+
+    Each dict has the name, the medians before and after (microseconds), the change
+    of the median (0.1 is 10% slower), the p-values of the tests for slower and for
+    faster, the threshold, and the verdict:
+
+        regression  significantly slower, by more than the threshold
+        slower      significantly slower, but within the threshold
+        faster      significantly faster
+        same        no significant difference
+        missing     not in current
+
+    Parameter baseline: the baseline
+    Precondition: [dict] a report of bench
+
+    Parameter current: the new results
+    Precondition: [dict] a report of bench
+
+    Parameter alpha: the significance level
+    Precondition: [float] 0 < alpha < 1
+
+    Parameter limits: thresholds of cases or groups, by name (LIMITS if None)
+    Precondition: [dict] of str to float, or None
+    """
+    limits = LIMITS if limits is None else limits
+    result = []
+    for name in sorted(baseline['cases']):
+        before = baseline['cases'][name]['samples_us']
+        entry = {'name': name, 'threshold': threshold(name, limits),
+                 'baseline_median_us': statistics.median(before)}
+        if name not in current['cases']:
+            entry['verdict'] = 'missing'
+            result.append(entry)
+            continue
+        after = current['cases'][name]['samples_us']
+        entry['current_median_us'] = statistics.median(after)
+        entry['change'] = entry['current_median_us']/entry['baseline_median_us']-1
+        entry['p_slower'] = stats.mann_whitney(before, after)[1]
+        entry['p_faster'] = stats.mann_whitney(after, before)[1]
+        if entry['p_slower'] < alpha:
+            entry['verdict'] = 'regression' if entry['change'] > entry['threshold'] else 'slower'
+        elif entry['p_faster'] < alpha:
+            entry['verdict'] = 'faster'
+        else:
+            entry['verdict'] = 'same'
+        result.append(entry)
+    return result
+
+
+def describe(comparison):
+    """
+    Returns: the lines of a text table of a comparison
+
+    Parameter comparison: the comparison
+    Precondition: [list] returned by compare
+    """
+    lines = ['%-26s %12s %12s %8s %9s %6s  %s' %
+             ('case', 'baseline us', 'current us', 'change', 'p', 'limit', 'verdict')]
+    for entry in comparison:
+        if entry['verdict'] == 'missing':
+            lines.append('%-26s %12.2f %12s %8s %9s %5.0f%%  missing' %
+                         (entry['name'], entry['baseline_median_us'], '-', '-', '-',
+                          100*entry['threshold']))
+            continue
+        p = entry['p_faster'] if entry['verdict'] == 'faster' else entry['p_slower']
+        lines.append('%-26s %12.2f %12.2f %+7.1f%% %9.2g %5.0f%%  %s' %
+                     (entry['name'], entry['baseline_median_us'], entry['current_median_us'],
+                      100*entry['change'], p, 100*entry['threshold'],
+                      entry['verdict'].upper() if entry['verdict'] == 'regression' else entry['verdict']))
+    return lines
+
+
+def _limit(text):
+    """
+    Returns: a pair (name, threshold) from an option NAME=FRACTION
+    """
+    import argparse
+    name, sep, value = text.rpartition('=')
+    try:
+        value = float(value)
+    except ValueError:
+        value = -1.0
+    if not sep or value < 0:
+        raise argparse.ArgumentTypeError('%s is not NAME=FRACTION' % repr(text))
+    return name, value
+
+
+def main(argv=None):
+    """
+    Reruns the benchmarks of a baseline and fails if any of them got slower.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='perfgate', description=main.__doc__.strip())
+    parser.add_argument('baseline', help='the baseline, a report of bench')
+    parser.add_argument('--record', action='store_true',
+                        help='run the cases and write them as the baseline, instead of comparing')
+    parser.add_argument('--cases', nargs='+', help='only these cases or groups (default %s)' %
+                        ' '.join(GATED))
+    parser.add_argument('--current', help='compare this report of bench instead of rerunning')
+    parser.add_argument('--alpha', type=float, default=ALPHA, help='the significance level')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='the largest slowdown that is not a regression')
+    parser.add_argument('--limit', type=_limit, nargs='+', default=[], metavar='NAME=FRACTION',
+                        help='the threshold of a case or group')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='the timed rounds (with --record)')
+    parser.add_argument('--warmup', type=int, default=WARMUP, help='the untimed rounds (with --record)')
+    parser.add_argument('--seed', type=int, default=0, help='the seed (with --record)')
+    parser.add_argument('--output', help='also write the comparison to this file, as JSON')
+    args = parser.parse_args(argv)
+    if not 0 < args.alpha < 1 or args.threshold < 0:
+        parser.error('--alpha must be between 0 and 1, and --threshold not negative')
+
+    def progress(name, result):
+        print('%-26s %12.2f us' % (name, result['median_us']), file=sys.stderr)
+
+    if args.record:
+        if args.repeat < 8 or args.warmup < 0:
+            parser.error('--repeat must be at least 8 (for the test), and --warmup not negative')
+        report = bench.run(args.cases or list(GATED), args.repeat, args.warmup, seed=args.seed,
+                           callback=progress)
+        with open(args.baseline, 'w') as file:
+            file.write(json.dumps(report, indent=2)+'\n')
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if args.cases is not None:
+        baseline['cases'] = dict((name, case) for name, case in baseline['cases'].items()
+                                 if bench.selected(name, args.cases))
+    if not baseline['cases']:
+        parser.error('the baseline has no cases to compare')
+    if args.current is not None:
+        with open(args.current) as file:
+            current = json.load(file)
+    else:
+        here = bench.environment()
+        for key in ('python', 'implementation', 'platform', 'cpus'):
+            if key in baseline and baseline[key] != here[key]:
+                print('warning: the baseline was recorded with %s %s, this is %s' %
+                      (key, baseline[key], here[key]), file=sys.stderr)
+        current = rerun(baseline, callback=progress)
+
+    limits = dict(LIMITS)
+    limits[''] = args.threshold
+    limits.update(args.limit)
+    comparison = compare(baseline, current, args.alpha, limits)
+    print('\n'.join(describe(comparison)))
+    regressions = [entry['name'] for entry in comparison if entry['verdict'] == 'regression']
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            file.write(json.dumps({'alpha': args.alpha, 'regressions': regressions,
+                                   'cases': comparison}, indent=2)+'\n')
+    if regressions:
+        print('%d regression%s: %s' % (len(regressions), '' if len(regressions) == 1 else 's',
+                                      ' '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,394 @@
+"""
+A compact binary format for game replays.
+
+A game is fully determined by its seed and its moves: the seed drives every spawn
+(see agents.play_game), so the boards never need to be stored.  A replay file is a
+short header and then one record per game:
+
+    magic    6 bytes   b'2048RP'
+    version  uint16    FORMAT_VERSION
+    length   uint32    the size of the metadata
+    metadata length bytes of UTF-8 JSON (e.g. the agent)
+
+and then for every game
+
+    seed     uint64
+    count    uint32    the number of moves
+    moves    ceil(count/4) bytes, four moves per byte, the first in the low bits
+
+All numbers are little-endian.  A game of n moves thus takes 12+n/4 bytes, whatever
+the size of its tiles.  The writer and reader stream the records, so files of any
+size can be written and read with constant memory.
+
+fast_forward rebuilds the positions of a game on packed boards (see the module board),
+without Twenty, its animations or a window, so a whole game takes milliseconds.
+"""
+import json
+import random
+import struct
+
+import agents
+import board
+
+MAGIC = b'2048RP'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<6sHI')
+_RECORD = struct.Struct('<QI')
+
+# The four moves packed in every byte value
+_UNPACK = [bytes((value & 3, value >> 2 & 3, value >> 4 & 3, value >> 6)) for value in range(256)]
+
+
+def pack_moves(moves):
+    """
+    Returns: the moves packed four to a byte
+
+    Parameter moves: the moves
+    Precondition: [bytes, bytearray or list] of directions from the module board
+    """
+    data = bytes(moves)+bytes(-len(moves) % 4)
+    return bytes(a | b << 2 | c << 4 | d << 6
+                 for a, b, c, d in zip(data[0::4], data[1::4], data[2::4], data[3::4]))
+
+
+def unpack_moves(data, count):
+    """
+    Returns: the first count moves packed in data, as bytes
+
+    Parameter data: the packed moves
+    Precondition: [bytes-like] with at least count/4 bytes
+
+    Parameter count: the number of moves
+    Precondition: [int] count >= 0
+    """
+    return b''.join(map(_UNPACK.__getitem__, data[:(count+3)//4]))[:count]
+
+
+def fast_forward(seed, moves, stop=None):
+    """
+    Returns: a tuple (board, score) for a game after its first stop moves
+
+    Parameter seed: the seed of the game
+    Precondition: [int]
+
+    Parameter moves: the moves of the game
+    Precondition: [bytes or list] of directions from the module board
+
+    Parameter stop: the number of moves to play, or None for all of them
+    Precondition: [int] 0 <= stop <= len(moves), or None
+    """
+    rng = random.Random(seed)
+    b = board.new_board(rng)
+    score = 0
+    play = board.play
+    for direction in (moves if stop is None else moves[:stop]):
+        b, gain = play(b, direction, rng)
+        score += gain
+    return b, score
+
+
+def positions(seed, moves):
+    """
+    Yields: the board (packed) before the first move, and after every move
+
+    Parameter seed: the seed of the game
+    Precondition: [int]
+
+    Parameter moves: the moves of the game
+    Precondition: [bytes or list] of directions from the module board
+    """
+    rng = random.Random(seed)
+    b = board.new_board(rng)
+    yield b
+    for direction in moves:
+        b = board.play(b, direction, rng)[0]
+        yield b
+
+
+class Timeline(object):
+    """
+    An instance gives fast random access to the positions of one recorded game.
+
+    Replaying a long game from the start to reach a late move would be slow, so the
+    timeline keeps a keyframe every interval moves: the board, the score and the state
+    of the random number generator.  A position is then at most interval moves of
+    replay away from a keyframe, or from the previous position asked for, whatever the
+    length of the game.
+
+    Instance Variables:
+        seed: [int] the seed of the game
+        moves: [bytes or list] the moves of the game
+        interval: [int > 0] the number of moves between keyframes
+    """
+
+    def __init__(self, seed, moves, interval=64):
+        """
+        Creates a timeline, replaying the whole game once to make the keyframes.
+
+        Parameter seed: the seed of the game
+        Precondition: [int]
+
+        Parameter moves: the moves of the game
+        Precondition: [bytes or list] of directions from the module board
+
+        Parameter interval: the number of moves between keyframes
+        Precondition: [int] interval > 0
+        """
+        assert type(interval) == int and interval > 0, '%s is not a valid interval' % repr(interval)
+        self.seed = seed
+        self.moves = moves
+        self.interval = interval
+        self._rng = random.Random(seed)
+        self._board = board.new_board(self._rng)
+        self._score = 0
+        self._at = 0
+        self._keyframes = []
+        for index in range(0, len(moves)+1, interval):
+            self._advance(index)
+            self._keyframes.append((self._board, self._score, self._rng.getstate()))
+
+    def __len__(self):
+        return len(self.moves)
+
+    def _advance(self, index):
+        """
+        Replays the moves from the current position up to move index.
+        """
+        b = self._board
+        score = self._score
+        rng = self._rng
+        for direction in self.moves[self._at:index]:
+            b, gain = board.play(b, direction, rng)
+            score += gain
+        self._board = b
+        self._score = score
+        self._at = index
+
+    def position(self, index):
+        """
+        Returns: a tuple (board, score) for the game after its first index moves
+
+        Parameter index: the number of moves played
+        Precondition: [int] 0 <= index <= len(self)
+        """
+        assert 0 <= index <= len(self.moves), '%s is not a valid move' % repr(index)
+        if not self._at <= index < self._at+self.interval:
+            key = index // self.interval
+            self._board, self._score, state = self._keyframes[key]
+            self._rng.setstate(state)
+            self._at = key*self.interval
+        self._advance(index)
+        return self._board, self._score
+
+
+class ReplayWriter(object):
+    """
+    An instance appends games to a new replay file.
+
+    Instance Variables:
+        path: [str] the replay file
+        count: [int >= 0] the number of games written
+    """
+
+    def __init__(self, path, metadata=None):
+        """
+        Creates a replay file and writes its header.
+
+        Parameter path: the replay file
+        Precondition: [str] a file name
+
+        Parameter metadata: information about the games, such as the agent
+        Precondition: [dict] JSON-friendly, or None
+        """
+        self.path = path
+        self.count = 0
+        text = json.dumps(metadata or {}).encode('utf-8')
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(text)))
+        self._file.write(text)
+
+    def write(self, seed, moves):
+        """
+        Appends a game.
+
+        Parameter seed: the seed of the game
+        Precondition: [int] 0 <= seed < 2**64
+
+        Parameter moves: the moves of the game
+        Precondition: [bytes, bytearray or list] of directions from the module board
+        """
+        self._file.write(_RECORD.pack(seed, len(moves)))
+        self._file.write(pack_moves(moves))
+        self.count += 1
+
+    def close(self):
+        """
+        Flushes and closes the file.
+        """
+        self._file.close()
+
+
+class ReplayReader(object):
+    """
+    An instance reads the games of a replay file in order.
+
+    Iterating over a reader yields a pair (seed, moves) for every game, where moves is
+    a bytes object of directions.
+
+    Instance Variables:
+        path: [str] the replay file
+        metadata: [dict] the metadata written with the file
+    """
+
+    def __init__(self, path):
+        """
+        Opens a replay file.
+
+        Parameter path: the replay file
+        Precondition: [str] a file written by ReplayWriter
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        header = self._file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            self._file.close()
+            raise IOError('%s is not a replay file' % repr(path))
+        magic, version, length = _HEADER.unpack(header)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._file.close()
+            raise IOError('%s is not a replay file' % repr(path))
+        self.metadata = json.loads(self._file.read(length).decode('utf-8'))
+
+    def __iter__(self):
+        read = self._file.read
+        size = _RECORD.size
+        unpack = _RECORD.unpack
+        while True:
+            record = read(size)
+            if len(record) < size:
+                if record:
+                    raise IOError('%s is truncated' % repr(self.path))
+                return
+            seed, count = unpack(record)
+            data = read((count+3)//4)
+            if len(data) < (count+3)//4:
+                raise IOError('%s is truncated' % repr(self.path))
+            yield seed, unpack_moves(data, count)
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        self._file.close()
+
+
+_worker_agent = None
+
+
+def _init_worker(spec):
+    """
+    Initializes a pool worker with its own agent.
+    """
+    global _worker_agent
+    _worker_agent = agents.make_agent(spec[0], **spec[1])
+
+
+def _record_game(seed):
+    """
+    Returns: a tuple (seed, moves) for one game of the worker agent
+    """
+    moves = []
+    agents.play_game(_worker_agent, seed, record=moves)
+    return seed, bytes(moves)
+
+
+def record(path, spec, games, seed=0, workers=None):
+    """
+    Returns: the number of moves in a new replay file of games played by an agent
+
+    Game i of the file uses the seed agents.game_seed(seed, i).
+
+    Parameter path: the replay file
+    Precondition: [str] a file name
+
+    Parameter spec: the agent
+    Precondition: [tuple] a pair (name, options) as returned by agents.parse_agent
+
+    Parameter games: the number of games
+    Precondition: [int] games >= 0
+
+    Parameter seed: the run seed
+    Precondition: [int] seed >= 0
+
+    Parameter workers: the number of processes, or None for one per core
+    Precondition: [int] workers > 0, or None
+    """
+    import multiprocessing
+    writer = ReplayWriter(path, {'agent': list(spec), 'seed': seed})
+    total = 0
+    seeds = (agents.game_seed(seed, index) for index in range(games))
+    with multiprocessing.Pool(workers, _init_worker, (spec,)) as pool:
+        for game_seed, moves in pool.imap(_record_game, seeds, chunksize=16):
+            writer.write(game_seed, moves)
+            total += len(moves)
+    writer.close()
+    return total
+
+
+def main(argv=None):
+    """
+    Records, checks and shows game replays.
+    """
+    import argparse, os, time
+    parser = argparse.ArgumentParser(prog='replay', description=main.__doc__.strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('record', help='record the games of an agent')
+    command.add_argument('agent', help="the agent, e.g. 'greedy'")
+    command.add_argument('output', help='the replay file to write')
+    command.add_argument('--games', type=int, default=1000)
+    command.add_argument('--seed', type=int, default=0)
+    command.add_argument('--workers', type=int, default=None)
+    command = commands.add_parser('check', help='fast-forward every game of a file')
+    command.add_argument('input', help='the replay file')
+    command = commands.add_parser('show', help='show the final board of one game')
+    command.add_argument('input', help='the replay file')
+    command.add_argument('index', type=int, help='the game number in the file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        start = time.perf_counter()
+        moves = record(args.output, agents.parse_agent(args.agent), args.games, args.seed,
+                       args.workers)
+        size = os.path.getsize(args.output)
+        print('%d games, %d moves in %.1fs' % (args.games, moves, time.perf_counter()-start))
+        per_game = float(size)/max(args.games, 1)
+        print('%d bytes: %.1f bytes per game, so %.1f MB per million games' %
+              (size, per_game, per_game))
+    elif args.command == 'check':
+        reader = ReplayReader(args.input)
+        games = moves = score = 0
+        start = time.perf_counter()
+        for seed, played in reader:
+            score += fast_forward(seed, played)[1]
+            games += 1
+            moves += len(played)
+        seconds = time.perf_counter()-start
+        reader.close()
+        print('%d games, %d moves, mean score %.1f' % (games, moves, float(score)/max(games, 1)))
+        print('fast-forward: %.0f moves/s' % (moves/seconds if seconds else 0))
+    else:
+        reader = ReplayReader(args.input)
+        for index, (seed, played) in enumerate(reader):
+            if index == args.index:
+                b, score = fast_forward(seed, played)
+                print('game %d: seed %d, %d moves, score %d' % (index, seed, len(played), score))
+                for row in board.to_grid(b):
+                    print(' '.join('%5d' % value for value in row))
+                break
+        else:
+            parser.error('%s has no game %d' % (repr(args.input), args.index))
+        reader.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+A small binary format for saved games.
+
+A save holds everything needed to carry on a game of Twenty exactly where it was left:
+the board, the score, the number of moves, the state of the random number generator
+(so the next spawns are the same as they would have been) and the undo history.  It
+holds plain numbers only, never Block or GLabel objects, so it is small and does not
+depend on the classes of the GUI.  The layout is
+
+    magic    6 bytes   b'2048SV'
+    version  uint16    FORMAT_VERSION
+    board    uint64    the packed board (see the module board)
+    score    uint64
+    moves    uint32
+    rng      uint32    the version of the random module state
+    key      625 x uint32, the Mersenne Twister state and position
+    gauss    uint8     1 if a cached Gaussian value follows, else 0
+             float64   that value (0 if there is none)
+    undo     uint32    the number of undo entries, then for each, oldest first,
+             3 x uint64, the board, score and moves
+    check    uint32    the CRC-32 of everything before it
+
+All numbers are little-endian.  A save with a full undo history of 100 moves is under
+6 KB.  The undo history is kept as an array of 64-bit words, which is copied into the
+save as it is, so encoding costs about the same whatever its length: mostly copying
+the 625 words of the random state.
+
+save writes a save to a temporary file and renames it over the old one, so a crash
+in the middle of a save leaves the previous save intact.  It does not sync the file
+to disk, which would cost milliseconds on every move.  Even without a sync, opening
+and renaming files can take a millisecond or more, so an Autosaver does the writing
+on a background thread.
+"""
+import array
+import os
+import struct
+import sys
+import threading
+import zlib
+
+MAGIC = b'2048SV'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<6sHQQI')
+_RNG = struct.Struct('<I625IBd')
+_COUNT = struct.Struct('<I')
+_ENTRY = 24
+_CHECK = struct.Struct('<I')
+
+
+def _little(words):
+    """
+    Returns: the bytes of an array of words, in little-endian order
+    """
+    if sys.byteorder == 'big':
+        words = array.array(words.typecode, words)
+        words.byteswap()
+    return words.tobytes()
+
+
+def encode(board, score, moves, rng, undo=None):
+    """
+    Returns: the bytes of a save
+
+    Parameter board: the board
+    Precondition: [int] a packed board
+
+    Parameter score: the score
+    Precondition: [int] score >= 0
+
+    Parameter moves: the number of moves made
+    Precondition: [int] moves >= 0
+
+    Parameter rng: the state of the random number generator
+    Precondition: [tuple] a state returned by random.getstate()
+
+    Parameter undo: the undo history, the board, score and moves of each entry in
+    turn, oldest first
+    Precondition: [array.array] of typecode 'Q' and a length divisible by 3, or None
+    """
+    version, key, gauss = rng
+    undo = array.array('Q') if undo is None else undo
+    data = b''.join((_HEADER.pack(MAGIC, FORMAT_VERSION, board, score, moves),
+                     _RNG.pack(version, *key, gauss is not None, gauss or 0.0),
+                     _COUNT.pack(len(undo)//3), _little(undo)))
+    return data+_CHECK.pack(zlib.crc32(data))
+
+
+def decode(data):
+    """
+    Returns: a tuple (board, score, moves, rng, undo) with the contents of a save
+
+    The undo history is an array.array of typecode 'Q', in the form encode takes.
+
+    Parameter data: the bytes of a save
+    Precondition: [bytes] returned by encode
+
+    Raises ValueError if data is not a whole save of this version.
+    """
+    if len(data) < _HEADER.size+_RNG.size+_COUNT.size+_CHECK.size:
+        raise ValueError('the save is truncated')
+    magic, version, board, score, moves = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('the data is not a save of version %d' % FORMAT_VERSION)
+    if _CHECK.unpack_from(data, len(data)-_CHECK.size)[0] != zlib.crc32(data[:-_CHECK.size]):
+        raise ValueError('the save is corrupt')
+    values = _RNG.unpack_from(data, _HEADER.size)
+    rng = (values[0], values[1:626], values[627] if values[626] else None)
+    offset = _HEADER.size+_RNG.size
+    count = _COUNT.unpack_from(data, offset)[0]
+    offset += _COUNT.size
+    if len(data) != offset+count*_ENTRY+_CHECK.size:
+        raise ValueError('the save is truncated')
+    undo = array.array('Q', data[offset:offset+count*_ENTRY])
+    if sys.byteorder == 'big':
+        undo.byteswap()
+    return board, score, moves, rng, undo
+
+
+def save(path, data):
+    """
+    Writes the bytes of a save to path atomically.
+
+    Parameter path: the save file
+    Precondition: [str] a file name
+
+    Parameter data: the bytes of a save
+    Precondition: [bytes] returned by encode
+    """
+    temp = path+'.tmp'
+    with open(temp, 'wb') as file:
+        file.write(data)
+    os.replace(temp, path)
+
+
+def load(path):
+    """
+    Returns: the bytes of the save in path
+
+    Parameter path: the save file
+    Precondition: [str] a file written by save
+    """
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+class Autosaver(object):
+    """
+    An instance writes saves to one file on a background thread.
+
+    Only the latest save matters, so a save still waiting to be written when a newer
+    one arrives is simply replaced.  Neither put nor remove ever waits for the disk.
+
+    Instance Variables:
+        path: [str] the save file
+    """
+
+    def __init__(self, path):
+        """
+        Starts the thread.
+
+        Parameter path: the save file
+        Precondition: [str] a file name
+        """
+        self.path = path
+        self._ready = threading.Condition()
+        self._pending = None
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """
+        The body of the thread.
+        """
+        while True:
+            with self._ready:
+                while self._pending is None and not self._stopping:
+                    self._ready.wait()
+                data = self._pending
+                self._pending = None
+            if data is None:
+                break
+            if data:
+                save(self.path, data)
+            elif os.path.exists(self.path):
+                os.remove(self.path)
+
+    def put(self, data):
+        """
+        Writes a save, replacing any save not yet written.
+
+        Parameter data: the save
+        Precondition: [bytes] returned by encode
+        """
+        with self._ready:
+            self._pending = data
+            self._ready.notify()
+
+    def remove(self):
+        """
+        Removes the save file, replacing any save not yet written.
+        """
+        self.put(b'')
+
+    def stop(self):
+        """
+        Writes the last save, if it is still waiting, and stops the thread.
+        """
+        with self._ready:
+            self._stopping = True
+            self._ready.notify()
+        self._thread.join(5.0)
@@ -0,0 +1,367 @@
+"""
+Expectimax search over packed boards.
+
+A search alternates between max nodes, where the player picks a direction, and chance
+nodes, where the game spawns a tile.  Leaves are scored by a heuristic built from four
+features of the board: the number of empty cells, the monotonicity of the rows and
+columns, their smoothness, and how large the tile in the best corner is.  The features
+are combined with a Weights tuple, so the same search can be used with tuned weights.
+
+Chance nodes are the expensive part of the tree, and the same afterstate is reached
+along many different paths.  A search can therefore be given a transposition table
+(see the module transposition) that remembers the value of each chance node.
+"""
+import collections
+import random
+
+import board
+
+Weights = collections.namedtuple('Weights', ['empty', 'monotonicity', 'smoothness', 'corner'])
+
+DEFAULT_WEIGHTS = Weights(empty=2.7, monotonicity=1.0, smoothness=0.1, corner=1.0)
+
+# The value of a max node with no legal moves
+LOSS = -1e5
+
+
+class SearchAborted(Exception):
+    """
+    Raised inside a search when its abort function returns True.
+    """
+    pass
+
+# Line heuristic tables, one per weight vector (oldest dropped past _MAX_TABLES)
+_LINE_TABLES = {}
+_MAX_TABLES = 8
+
+
+def _line_value(line, weights):
+    """
+    Returns: the heuristic value of a single row or column
+
+    Parameter line: the four exponents of the line
+    Precondition: [list] a list of 4 ints
+
+    Parameter weights: the feature weights
+    Precondition: [Weights] a weight vector
+    """
+    empty = line.count(0)
+    inc = 0
+    dec = 0
+    smooth = 0
+    for i in range(3):
+        a = line[i]
+        b = line[i+1]
+        if a > b:
+            dec += a-b
+        else:
+            inc += b-a
+        if a and b:
+            smooth -= abs(a-b)
+    mono = -min(inc, dec)
+    return weights.empty*empty + weights.monotonicity*mono + weights.smoothness*smooth
+
+
+def line_table(weights):
+    """
+    Returns: the table of heuristic values for every possible 16-bit line
+
+    Tables are built once for each weight vector and then shared.  Only the most
+    recent few are kept, as a tuning run may try thousands of weight vectors.
+
+    Parameter weights: the feature weights
+    Precondition: [Weights] a weight vector
+    """
+    weights = Weights(*weights)
+    table = _LINE_TABLES.get(weights)
+    if table is None:
+        table = [0.0] * 65536
+        for row in range(65536):
+            line = [(row >> (4*i)) & board.CELL_MASK for i in range(4)]
+            table[row] = _line_value(line, weights)
+        if len(_LINE_TABLES) >= _MAX_TABLES:
+            del _LINE_TABLES[next(iter(_LINE_TABLES))]
+        _LINE_TABLES[weights] = table
+    return table
+
+
+class Search(object):
+    """
+    The base class for searches, holding the heuristic.
+
+    Instance Variables:
+        weights: [Weights] the heuristic feature weights
+        nodes: [int >= 0] the number of nodes expanded since creation
+        abort: [callable or None] if set, a search raises SearchAborted as soon as a
+            call to abort() returns True
+    """
+
+    def __init__(self, weights=DEFAULT_WEIGHTS):
+        """
+        Creates a new search.
+
+        Parameter weights: the heuristic feature weights
+        Precondition: [Weights] (or any sequence of 4 numbers)
+        """
+        self.weights = Weights(*weights)
+        self.nodes = 0
+        self.abort = None
+        self._line = line_table(self.weights)
+
+    def evaluate(self, b):
+        """
+        Returns: the heuristic value of the board b
+
+        Parameter b: the board to evaluate
+        Precondition: [int] a packed board
+        """
+        line = self._line
+        m = board.ROW_MASK
+        t = board.transpose(b)
+        corner = max(b & 0xF, (b >> 12) & 0xF, (b >> 48) & 0xF, b >> 60)
+        return (line[b & m] + line[(b >> 16) & m] + line[(b >> 32) & m] + line[b >> 48] +
+                line[t & m] + line[(t >> 16) & m] + line[(t >> 32) & m] + line[t >> 48] +
+                self.weights.corner*corner)
+
+    def choose(self, b):
+        """
+        Returns: the best direction for the board b, or None if there are no moves
+
+        Parameter b: the board to search from
+        Precondition: [int] a packed board
+        """
+        raise NotImplementedError()
+
+
+class Expectimax(Search):
+    """
+    An instance is a depth-limited expectimax search with a fixed heuristic.
+
+    Instance Variables:
+        depth: [int > 0] the number of chance layers searched below each move
+        table: [transposition table or None] the cache for chance nodes
+    """
+
+    def __init__(self, depth=2, weights=DEFAULT_WEIGHTS, table=None):
+        """
+        Creates a new search.
+
+        Parameter depth: the number of chance layers to search
+        Precondition: [int] depth > 0
+
+        Parameter weights: the heuristic feature weights
+        Precondition: [Weights] (or any sequence of 4 numbers)
+
+        Parameter table: the cache for chance nodes
+        Precondition: an object with probe(board,depth) and store(board,depth,value),
+        or None for no cache
+        """
+        assert type(depth) == int and depth > 0, '%s is not a valid depth' % repr(depth)
+        Search.__init__(self, weights)
+        self.depth = depth
+        self.table = table
+
+    def score_move(self, b, direction):
+        """
+        Returns: the expected value of moving b in direction, or None if illegal
+
+        The four directions of a position are independent searches, so they can be
+        handed to different workers.
+
+        Parameter b: the board to search from
+        Precondition: [int] a packed board
+
+        Parameter direction: the direction to move
+        Precondition: [int] one of board.UP, board.DOWN, board.LEFT or board.RIGHT
+        """
+        after = board.shift(b, direction)
+        if after == b:
+            return None
+        return self._chance(after, self.depth)
+
+    def score_moves(self, b):
+        """
+        Returns: a dict mapping each legal direction to its expected value
+
+        Parameter b: the board to search from
+        Precondition: [int] a packed board
+        """
+        result = {}
+        for direction in range(4):
+            value = self.score_move(b, direction)
+            if value is not None:
+                result[direction] = value
+        return result
+
+    def choose(self, b):
+        """
+        Returns: the best direction for the board b, or None if there are no moves
+
+        Parameter b: the board to search from
+        Precondition: [int] a packed board
+        """
+        scores = self.score_moves(b)
+        if not scores:
+            return None
+        return max(scores, key=scores.get)
+
+    def _max(self, b, depth):
+        """
+        Returns: the value of the max node b with depth chance layers left
+        """
+        self.nodes += 1
+        best = LOSS
+        for direction in range(4):
+            after = board.shift(b, direction)
+            if after != b:
+                value = self._chance(after, depth)
+                if value > best:
+                    best = value
+        return best
+
+    def _chance(self, after, depth):
+        """
+        Returns: the expected value of the afterstate after with depth chance layers left
+        """
+        if depth == 0:
+            return self.evaluate(after)
+        table = self.table
+        if table is not None:
+            cached = table.probe(after, depth)
+            if cached is not None:
+                return cached
+
+        self.nodes += 1
+        if self.abort is not None and self.abort():
+            raise SearchAborted()
+        cells = board.empty_cells(after)
+        exps = [value.bit_length()-1 for value in board.SPAWNABLE]
+        total = 0.0
+        for cell in cells:
+            for exp in exps:
+                total += self._max(after | exp << cell, depth-1)
+        value = total/(len(cells)*len(exps))
+
+        if table is not None:
+            table.store(after, depth, value)
+        return value
+
+
+class BeamSearch(Search):
+    """
+    An instance is a beam search with a fixed budget of work per move.
+
+    Each ply expands the afterstates in the beam.  A chance node is represented by at
+    most samples of its spawns (all of them if there are fewer), and each sampled
+    board is answered by its best move under the heuristic.  An afterstate is valued
+    by the mean over its samples, and only the width best afterstates survive to the
+    next ply.  The move played is the first move of the afterstate with the best value
+    in the last ply searched.
+
+    The work per move is therefore at most about 4*width*samples*depth heuristic
+    calls, however open the board is, which makes the cost per move predictable.
+
+    Instance Variables:
+        width: [int > 0] the number of afterstates kept per ply
+        depth: [int > 0] the number of plies searched
+        samples: [int > 0] the number of spawns sampled per chance node
+    """
+
+    def __init__(self, width=8, depth=3, samples=4, weights=DEFAULT_WEIGHTS, seed=0):
+        """
+        Creates a new beam search.
+
+        Parameter width: the number of afterstates kept per ply
+        Precondition: [int] width > 0
+
+        Parameter depth: the number of plies searched
+        Precondition: [int] depth > 0
+
+        Parameter samples: the number of spawns sampled per chance node
+        Precondition: [int] samples > 0
+
+        Parameter weights: the heuristic feature weights
+        Precondition: [Weights] (or any sequence of 4 numbers)
+
+        Parameter seed: the seed for sampling spawns
+        Precondition: [int]
+        """
+        assert type(width) == int and width > 0, '%s is not a valid width' % repr(width)
+        assert type(depth) == int and depth > 0, '%s is not a valid depth' % repr(depth)
+        assert type(samples) == int and samples > 0, '%s is not a valid sample size' % repr(samples)
+        Search.__init__(self, weights)
+        self.width = width
+        self.depth = depth
+        self.samples = samples
+        self.rng = random.Random(seed)
+
+    def budget(self):
+        """
+        Returns: the largest number of heuristic calls one move can take
+        """
+        return 4 + 4*self.width*self.samples*self.depth
+
+    def _spawns(self, after):
+        """
+        Returns: the list of boards sampled from the chance node after
+        """
+        outcomes = [(cell, value.bit_length()-1) for cell in board.empty_cells(after)
+                    for value in board.SPAWNABLE]
+        if len(outcomes) > self.samples:
+            outcomes = self.rng.sample(outcomes, self.samples)
+        return [after | exp << cell for cell, exp in outcomes]
+
+    def _best_reply(self, b):
+        """
+        Returns: a tuple (value, afterstate) for the best move on b, or (LOSS, None)
+        """
+        best = LOSS
+        choice = None
+        for direction in range(4):
+            after = board.shift(b, direction)
+            if after != b:
+                self.nodes += 1
+                value = self.evaluate(after)
+                if value > best:
+                    best = value
+                    choice = after
+        return best, choice
+
+    def choose(self, b):
+        """
+        Returns: the best direction for the board b, or None if there are no moves
+
+        Parameter b: the board to search from
+        Precondition: [int] a packed board
+        """
+        beam = []
+        for direction in range(4):
+            after = board.shift(b, direction)
+            if after != b:
+                self.nodes += 1
+                beam.append((self.evaluate(after), after, direction))
+        if not beam:
+            return None
+        scores = dict((root, value) for value, after, root in beam)
+
+        for ply in range(self.depth):
+            beam.sort(reverse=True)
+            scores = {}
+            replies = {}
+            for value, after, root in beam[:self.width]:
+                if self.abort is not None and self.abort():
+                    raise SearchAborted()
+                spawns = self._spawns(after)
+                total = 0.0
+                for child in spawns:
+                    reply_value, reply = self._best_reply(child)
+                    total += reply_value
+                    if reply is not None and (reply not in replies or replies[reply][0] < reply_value):
+                        replies[reply] = (reply_value, root)
+                mean = total/len(spawns)
+                if root not in scores or scores[root] < mean:
+                    scores[root] = mean
+            beam = [(value, reply, root) for reply, (value, root) in replies.items()]
+            if not beam:
+                break
+        return max(scores, key=scores.get)
@@ -0,0 +1,633 @@
+"""
+A game server that hosts many games of 2048 in one process.
+
+Clients connect over TCP or a Unix socket and speak JSON lines: every request is one
+JSON object on a line, and every request gets one response line, in order.  The
+requests are
+
+    {"op": "new"}                          starts a game
+    {"op": "new", "id": ID, "cells": CELLS, "score": S, "moves": M}
+                                           starts a game with this id and state
+    {"op": "move", "id": ID, "dir": DIR}   moves (DIR is 0-3 or a name in board.DIRECTIONS)
+    {"op": "get", "id": ID}                the whole state of a game
+    {"op": "close", "id": ID}              ends a game
+    {"op": "stats"}                        the counters of the server
+
+A request may carry a "tag", which is copied into its response.  Responses have "ok"
+true or false (with an "error").  A new game and get return the 16 cell exponents,
+row by row, and the score.  A move returns only what changed: whether the board moved,
+the points gained, the new score, the cells that changed as [index, exponent] pairs,
+and whether the game is over.  Games belong to the connection that created them, and
+end when it closes.  A get or close waits for the moves of the game sent before it.
+
+A new game normally gets a fresh random id.  Giving the id, and optionally the cells
+(as get returns them), score and moves, is how the router of the module cluster places
+games on its workers and moves them between workers.
+
+Every live game is a slot in a GameTable, a set of dense NumPy arrays of packed
+boards (see the module board), scores and move counts.  Moves are not applied as they
+arrive.  They are queued, and once per tick all the queued moves are applied in one
+vectorized step (see the module batch), however many games they are for.  A tick
+runs as soon as a move arrives if the last one was at least TICK seconds ago, so a
+lone client is not slowed down, while a busy server applies hundreds of moves at once.
+
+Run the server, and the load generator against it, as
+
+    python 2048 server serve --port 2048
+    python 2048 server load --port 2048 --connections 8 --games 32
+
+Requires NumPy.
+"""
+import asyncio
+import collections
+import json
+import secrets
+import time
+
+import numpy as np
+
+import batch
+import board
+
+# The least number of seconds between two ticks
+TICK = 0.002
+
+# The largest request line a client may send
+LINE_LIMIT = 4096
+
+# The most responses a connection may have waiting to be written.  Past this, its
+# requests are not read until the client reads some responses.
+BACKLOG = 1024
+
+
+class GameTable(object):
+    """
+    An instance holds the state of many games in dense arrays.
+
+    Game sessions are mapped to slots of the arrays.  Freed slots are reused, and the
+    arrays double in size when they are full.
+
+    Instance Variables:
+        boards: [numpy.ndarray] the packed board of every slot (uint64)
+        scores: [numpy.ndarray] the score of every slot (uint64)
+        moves: [numpy.ndarray] the number of moves of every slot (uint32)
+        slots: [dict] the slot of every live session id
+    """
+
+    def __init__(self, capacity=1024, seed=None):
+        """
+        Creates an empty table.
+
+        Parameter capacity: the number of slots to start with
+        Precondition: [int] capacity > 0
+
+        Parameter seed: the seed of the spawns, or None for a random one
+        Precondition: [int] seed >= 0, or None
+        """
+        assert type(capacity) == int and capacity > 0, '%s is not a valid capacity' % repr(capacity)
+        self.boards = np.zeros(capacity, dtype=np.uint64)
+        self.scores = np.zeros(capacity, dtype=np.uint64)
+        self.moves = np.zeros(capacity, dtype=np.uint32)
+        self.slots = {}
+        self._free = list(range(capacity-1, -1, -1))
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def create(self, session=None, b=None, score=0, moves=0):
+        """
+        Returns: the id of a new game
+
+        Parameter session: the id of the game, or None for a fresh random id
+        Precondition: [str] not the id of a live game, or None
+
+        Parameter b: the board, or None for a new board
+        Precondition: [int] a packed board, or None
+
+        Parameter score: the score so far
+        Precondition: [int] score >= 0
+
+        Parameter moves: the number of moves so far
+        Precondition: [int] moves >= 0
+        """
+        assert session not in self.slots, '%s is already a game' % repr(session)
+        if not self._free:
+            size = len(self.boards)
+            self.boards = np.concatenate([self.boards, np.zeros(size, dtype=np.uint64)])
+            self.scores = np.concatenate([self.scores, np.zeros(size, dtype=np.uint64)])
+            self.moves = np.concatenate([self.moves, np.zeros(size, dtype=np.uint32)])
+            self._free = list(range(2*size-1, size-1, -1))
+        slot = self._free.pop()
+        if session is None:
+            session = secrets.token_hex(8)
+        self.slots[session] = slot
+        self.boards[slot] = batch.new_boards(1, self._rng)[0] if b is None else b
+        self.scores[slot] = score
+        self.moves[slot] = moves
+        return session
+
+    def remove(self, session):
+        """
+        Ends a game, freeing its slot.
+
+        Parameter session: the id of the game
+        Precondition: [str] a live session id
+        """
+        self._free.append(self.slots.pop(session))
+
+    def state(self, session):
+        """
+        Returns: a dict with the cells, score and moves of a game, and whether it is over
+
+        Parameter session: the id of the game
+        Precondition: [str] a live session id
+        """
+        slot = self.slots[session]
+        boards = self.boards[slot:slot+1]
+        return {'cells': batch.cells(boards)[0].tolist(), 'score': int(self.scores[slot]),
+                'moves': int(self.moves[slot]), 'over': bool(batch.is_over(boards)[0])}
+
+    def apply(self, slots, directions):
+        """
+        Returns: a tuple (moved, gains, scores, changes, over) of arrays for one move
+        in each of the given slots, applied at once
+
+        moved says whether each board changed, gains and scores are the points of the
+        move and the new totals, changes is an n x 16 array of the new cell exponents,
+        with -1 for cells that did not change, and over says whether each game is over.
+
+        Parameter slots: the slots
+        Precondition: [numpy.ndarray] of distinct slots of live games
+
+        Parameter directions: the direction of each move
+        Precondition: [numpy.ndarray] of ints, each UP, DOWN, LEFT or RIGHT
+        """
+        before = self.boards[slots]
+        after, gains = batch.move(before, directions)
+        moved = after != before
+        after[moved] = batch.spawn(after[moved], self._rng)
+        self.boards[slots] = after
+        self.scores[slots] += gains
+        self.moves[slots] += moved
+        old = batch.cells(before)
+        new = batch.cells(after)
+        changes = np.where(old != new, new.astype(np.int8), -1)
+        return moved, gains, self.scores[slots], changes, batch.is_over(after)
+
+
+class GameServer(object):
+    """
+    An instance serves the games of a GameTable to clients over asyncio streams.
+
+    Instance Variables:
+        table: [GameTable] the live games
+        tick: [float > 0] the least number of seconds between two ticks
+        applied: [int >= 0] the number of moves applied
+        ticks: [int >= 0] the number of ticks that applied moves
+    """
+
+    def __init__(self, table=None, tick=TICK):
+        """
+        Creates a server.
+
+        Parameter table: the game table, or None for a new one
+        Precondition: [GameTable] or None
+
+        Parameter tick: the least number of seconds between two ticks
+        Precondition: [int or float] tick >= 0
+        """
+        self.table = GameTable() if table is None else table
+        self.tick = tick
+        self.applied = 0
+        self.ticks = 0
+        self._pending = []
+        self._queued = collections.Counter()
+        self._arrived = None
+        self._last = 0.0
+
+    async def serve(self, host=None, port=None, path=None):
+        """
+        Serves clients until cancelled, on a Unix socket if path is given, or else on TCP.
+
+        Parameter host: the TCP host, or None for all interfaces
+        Precondition: [str] or None
+
+        Parameter port: the TCP port
+        Precondition: [int] 0 <= port < 65536, or None with a path
+
+        Parameter path: the Unix socket, or None for TCP
+        Precondition: [str] or None
+        """
+        self._arrived = asyncio.Event()
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path, limit=LINE_LIMIT)
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=LINE_LIMIT)
+        ticker = asyncio.ensure_future(self._run_ticks())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            ticker.cancel()
+
+    async def _run_ticks(self):
+        """
+        Applies the queued moves once per tick, for as long as the server runs.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._arrived.wait()
+            delay = self._last+self.tick-loop.time()
+            # Even with no delay, let the moves already received this round come in
+            await asyncio.sleep(max(delay, 0))
+            self._arrived.clear()
+            self._last = loop.time()
+            self._apply()
+
+    def _apply(self):
+        """
+        Applies the queued moves in one step, and completes their responses.
+
+        A game can only move once per step, so any later requests of the same game stay
+        queued for the next tick.  A queued get or close is answered in the step after
+        the moves before it.
+        """
+        taken = {}
+        later = []
+        for item in self._pending:
+            if item[0] in taken:
+                later.append(item)
+            else:
+                taken[item[0]] = item
+        self._pending = later
+        if later:
+            self._arrived.set()
+        items = []
+        for item in taken.values():
+            session = item[1]
+            self._queued[session] -= 1
+            if not self._queued[session]:
+                del self._queued[session]
+            # The game may have been closed, and its slot even reused, since the move came
+            if self.table.slots.get(session) != item[0]:
+                response = _error('the game has ended', item[4])
+            elif type(item[2]) == str:
+                response = self._answer(item[2], session, item[4])
+            else:
+                items.append(item)
+                continue
+            if not item[3].cancelled():
+                item[3].set_result(response)
+        if not items:
+            return
+        slots = np.array([item[0] for item in items], dtype=np.intp)
+        directions = np.array([item[2] for item in items], dtype=np.intp)
+        # Plain lists are much faster than NumPy for one element at a time
+        results = zip(items, *[array.tolist() for array in self.table.apply(slots, directions)])
+        for (slot, session, direction, future, tag), moved, gain, score, changes, over in results:
+            cells = [[j, value] for j, value in enumerate(changes) if value >= 0]
+            response = {'ok': True, 'moved': moved, 'gain': gain, 'score': score,
+                        'cells': cells, 'over': over}
+            if not future.cancelled():
+                future.set_result(_encode(response, tag))
+        self.applied += len(items)
+        self.ticks += 1
+
+    def _request(self, message, owned):
+        """
+        Returns: the response to one request, as bytes or as a future of bytes
+
+        Parameter message: the request line
+        Precondition: [bytes]
+
+        Parameter owned: the ids of the games of the connection
+        Precondition: [set] of str
+        """
+        try:
+            request = json.loads(message)
+            op = request['op']
+        except (ValueError, TypeError, KeyError):
+            return _error('the request is not a JSON object with an op', None)
+        tag = request.get('tag')
+        if op == 'new':
+            return self._create(request, owned, tag)
+        if op == 'stats':
+            return _encode({'ok': True, 'games': len(self.table), 'moves': self.applied,
+                            'ticks': self.ticks}, tag)
+        if op not in ('get', 'close', 'move'):
+            return _error('%s is not an op' % repr(op), tag)
+        session = request.get('id')
+        if type(session) != str or session not in owned:
+            return _error('there is no game %s' % repr(session), tag)
+        if op != 'move':
+            if op == 'close':
+                owned.discard(session)
+            if self._queued[session]:
+                return self._queue(session, op, tag)
+            return self._answer(op, session, tag)
+        direction = request.get('dir')
+        if direction in board.DIRECTIONS:
+            direction = board.DIRECTIONS.index(direction)
+        if direction not in (0, 1, 2, 3) or type(direction) == bool:
+            return _error('%s is not a direction' % repr(direction), tag)
+        return self._queue(session, direction, tag)
+
+    def _create(self, request, owned, tag):
+        """
+        Returns: the response to a request for a new game
+        """
+        session = request.get('id')
+        if session is not None and (type(session) != str or not 0 < len(session) <= 64 or
+                                    session in self.table.slots):
+            return _error('%s is not a free game id' % repr(session), tag)
+        b = None
+        cells = request.get('cells')
+        if cells is not None:
+            if (type(cells) != list or len(cells) != 16 or
+                    any(type(cell) != int or not 0 <= cell < 16 for cell in cells)):
+                return _error('%s are not the cells of a board' % repr(cells), tag)
+            b = sum(cell << 4*i for i, cell in enumerate(cells))
+        score = request.get('score', 0)
+        moves = request.get('moves', 0)
+        if type(score) != int or not 0 <= score < 2**63 or type(moves) != int or not 0 <= moves < 2**32:
+            return _error('the score and moves must be counts', tag)
+        session = self.table.create(session, b, score, moves)
+        owned.add(session)
+        response = {'ok': True, 'id': session}
+        response.update(self.table.state(session))
+        return _encode(response, tag)
+
+    def _answer(self, op, session, tag):
+        """
+        Returns: the response to a get or close of a live game
+        """
+        if op == 'close':
+            self.table.remove(session)
+            return _encode({'ok': True}, tag)
+        response = {'ok': True}
+        response.update(self.table.state(session))
+        return _encode(response, tag)
+
+    def _queue(self, session, action, tag):
+        """
+        Returns: the future response of a request that waits for the next tick
+
+        The action is a direction, or 'get' or 'close'.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((self.table.slots[session], session, action, future, tag))
+        self._queued[session] += 1
+        self._arrived.set()
+        return future
+
+    async def handle(self, reader, writer):
+        """
+        Serves one connection until it closes, then ends its games.
+        """
+        owned = set()
+        try:
+            await serve_lines(reader, writer, lambda line: self._request(line, owned))
+        finally:
+            for session in owned:
+                if session in self.table.slots:
+                    self.table.remove(session)
+            writer.close()
+
+
+async def serve_lines(reader, writer, respond):
+    """
+    Answers the request lines of one connection until it closes.
+
+    Requests are read as fast as they come, and responses written in the same order.
+    A response that is not ready yet does not hold up reading the next requests, so a
+    client may send many requests before reading any responses, up to BACKLOG of them.
+    Then reading stops until the client has read enough of the responses to make
+    room, so a client that never reads cannot make the server hold ever more.
+
+    Parameter reader: the input of the connection
+    Precondition: [asyncio.StreamReader] with a limit of LINE_LIMIT
+
+    Parameter writer: the output of the connection
+    Precondition: [asyncio.StreamWriter]
+
+    Parameter respond: the function giving the response to a request line, as bytes
+    or as a future of bytes
+    Precondition: [callable] taking one argument, a line of bytes
+    """
+    responses = asyncio.Queue(BACKLOG)
+    sender = asyncio.ensure_future(_send(responses, writer))
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                await _put(responses, _error('the request is too long', None), sender)
+                break
+            if not line:
+                break
+            if line.strip():
+                await _put(responses, respond(line), sender)
+    except ConnectionError:
+        pass
+    finally:
+        try:
+            await _put(responses, None, sender)
+            await sender
+        except ConnectionError:
+            pass
+
+
+async def _put(responses, response, sender):
+    """
+    Adds a response to the queue of a connection, waiting while the queue is full
+
+    Raises ConnectionError if the sender stops (the connection broke) first, as it
+    then never makes room.
+    """
+    if not responses.full():
+        responses.put_nowait(response)
+        return
+    put = asyncio.ensure_future(responses.put(response))
+    await asyncio.wait([put, sender], return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
+        raise ConnectionError('the connection is closed')
+
+
+async def _send(responses, writer):
+    """
+    Writes the responses of a connection in order, waiting for the slow client.
+
+    Every response that is ready goes out in one write, so that a tick answering many
+    moves of a connection costs it one system call rather than one each.
+    """
+    ready = []
+    while True:
+        if responses.empty() and ready:
+            writer.write(b''.join(ready))
+            ready = []
+            await writer.drain()
+        response = await responses.get()
+        if response is None:
+            break
+        if not isinstance(response, bytes):
+            if not response.done() and ready:
+                writer.write(b''.join(ready))
+                ready = []
+            response = await response
+        ready.append(response)
+    if ready:
+        writer.write(b''.join(ready))
+
+
+def _encode(response, tag):
+    """
+    Returns: the response line for a response dict
+    """
+    if tag is not None:
+        response['tag'] = tag
+    return json.dumps(response, separators=(',', ':')).encode('utf-8')+b'\n'
+
+
+def _error(message, tag):
+    """
+    Returns: the response line of a failed request
+    """
+    return _encode({'ok': False, 'error': message}, tag)
+
+
+async def _connect(host, port, path):
+    """
+    Returns: the streams (reader, writer) of a connection to the server
+    """
+    if path is not None:
+        return await asyncio.open_unix_connection(path, limit=1 << 20)
+    return await asyncio.open_connection(host, port, limit=1 << 20)
+
+
+async def load(host='127.0.0.1', port=None, path=None, connections=8, games=32, seconds=10.0,
+               seed=0):
+    """
+    Returns: a dict with the throughput and latency of a load test
+
+    Every connection plays games games at once, each sending a random move and
+    waiting for its response before the next, and starting a new game when one ends.
+    The result has the moves per second (requests, and legal moves), and the median,
+    99th percentile and largest latency of a move in milliseconds.
+
+    Parameter host: the TCP host
+    Precondition: [str]
+
+    Parameter port: the TCP port, or None with a path
+    Precondition: [int] or None
+
+    Parameter path: the Unix socket, or None for TCP
+    Precondition: [str] or None
+
+    Parameter connections: the number of connections
+    Precondition: [int] connections > 0
+
+    Parameter games: the number of games played at once on each connection
+    Precondition: [int] games > 0
+
+    Parameter seconds: the length of the test
+    Precondition: [int or float] seconds > 0
+
+    Parameter seed: the seed of the moves
+    Precondition: [int]
+    """
+    import random
+    rng = random.Random(seed)
+    latencies = []
+    legal = [0]
+    stop = time.perf_counter()+seconds
+
+    async def connection():
+        reader, writer = await _connect(host, port, path)
+        waiting = collections.deque()
+
+        async def receive():
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                waiting.popleft().set_result(json.loads(line))
+
+        def call(request):
+            future = asyncio.get_running_loop().create_future()
+            waiting.append(future)
+            writer.write(json.dumps(request).encode('utf-8')+b'\n')
+            return future
+
+        async def play():
+            game = (await call({'op': 'new'}))['id']
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                response = await call({'op': 'move', 'id': game, 'dir': rng.randrange(4)})
+                latencies.append(time.perf_counter()-start)
+                legal[0] += response['moved']
+                if response['over']:
+                    await call({'op': 'close', 'id': game})
+                    game = (await call({'op': 'new'}))['id']
+
+        receiver = asyncio.ensure_future(receive())
+        await asyncio.gather(*[play() for _ in range(games)])
+        receiver.cancel()
+        writer.close()
+
+    begin = time.perf_counter()
+    await asyncio.gather(*[connection() for _ in range(connections)])
+    elapsed = time.perf_counter()-begin
+    latencies.sort()
+    reader, writer = await _connect(host, port, path)
+    writer.write(b'{"op":"stats"}\n')
+    stats = json.loads(await reader.readline())
+    writer.close()
+    return {'seconds': elapsed, 'requests_per_second': len(latencies)/elapsed,
+            'moves_per_second': legal[0]/elapsed,
+            'median_ms': 1000*latencies[len(latencies)//2],
+            'p99_ms': 1000*latencies[min(int(0.99*len(latencies)), len(latencies)-1)],
+            'max_ms': 1000*latencies[-1],
+            'moves_per_tick': stats['moves']/max(stats['ticks'], 1)}
+
+
+def main(argv=None):
+    """
+    Runs the game server, or a load test against it.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='server', description=main.__doc__.strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('serve', help='run the server')
+    command.add_argument('--tick', type=float, default=TICK,
+                         help='the least seconds between two ticks')
+    command.add_argument('--seed', type=int, default=None, help='the seed of the spawns')
+    command = commands.add_parser('load', help='measure the throughput and latency of a server')
+    command.add_argument('--connections', type=int, default=8)
+    command.add_argument('--games', type=int, default=32, help='games at once per connection')
+    command.add_argument('--seconds', type=float, default=10.0)
+    command.add_argument('--seed', type=int, default=0, help='the seed of the moves')
+    for command in commands.choices.values():
+        command.add_argument('--host', default='127.0.0.1')
+        command.add_argument('--port', type=int, default=2048)
+        command.add_argument('--unix', help='use this Unix socket instead of TCP')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        server = GameServer(GameTable(seed=args.seed), args.tick)
+        try:
+            asyncio.run(server.serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+    else:
+        result = asyncio.run(load(args.host, args.port, args.unix, args.connections, args.games,
+                                  args.seconds, args.seed))
+        print('%.0f moves/s (%.0f requests/s), latency median %.2f ms, p99 %.2f ms, max %.2f ms, '
+              '%.1f moves per tick' % (result['moves_per_second'], result['requests_per_second'],
+                                       result['median_ms'], result['p99_ms'], result['max_ms'],
+                                       result['moves_per_tick']))
+
+
+if __name__ == '__main__':
+    main()
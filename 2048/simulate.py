@@ -0,0 +1,351 @@
+"""
+Plays a large number of games with one agent and summarizes the results.
+
+The games are split into chunks of consecutive game numbers, and every chunk runs as
+one task on a process pool.  A worker sends back only the aggregate of its chunk (an
+evaluate.AgentStats), which the parent merges into the running totals, so memory does
+not grow with the number of games.  Game i always uses agents.game_seed(seed, i), so
+the games of a run do not depend on the number of workers.
+
+Progress is printed every few seconds, and the final summary (the agent report of
+evaluate.AgentStats plus throughput) is written as JSON.  The summary includes the
+exact aggregate, so a big run can be split into shards, on separate machines if need
+be, with different --first game numbers, and the shards merged afterwards.
+
+With --checkpoint, a long run saves its progress every few minutes and resumes from
+the file when started again with the same options, without playing or counting any
+game twice.  The final summary is the same as for a run that was never stopped.
+
+With --history, every game is also written to a game history database (see the module
+history), in batches, as the chunks come in.
+
+Run it as
+
+    python 2048 simulate greedy --games 1000000 --output greedy.json
+"""
+import bisect
+import json
+import os
+import time
+
+import agents
+from evaluate import AgentStats
+from history import History
+
+# The format of the checkpoint files
+CHECKPOINT_VERSION = 1
+
+_worker_agent = None
+
+
+def _init_worker(spec):
+    """
+    Initializes a pool worker with its own agent.
+    """
+    global _worker_agent
+    _worker_agent = agents.make_agent(spec[0], **spec[1])
+
+
+def _play_chunk(task):
+    """
+    Returns: a tuple (start, count, stats, games) with the AgentStats of a chunk of games
+
+    If the task asks for them, games is a list of (result, seconds) for every game,
+    and otherwise None.
+    """
+    seed, start, count, keep = task
+    result = AgentStats()
+    games = [] if keep else None
+    for index in range(start, start+count):
+        clock = time.perf_counter()
+        game = agents.play_game(_worker_agent, agents.game_seed(seed, index))
+        result.add(game)
+        if keep:
+            games.append((game, time.perf_counter()-clock))
+    return start, count, result, games
+
+
+def chunks(games, chunk, seed=0, start=0, done=()):
+    """
+    Yields: the tasks (seed, start, count) that cover games start to games-1
+
+    Parameter games: the end of the range of game numbers
+    Precondition: [int] games >= start
+
+    Parameter chunk: the largest number of games in a task
+    Precondition: [int] chunk > 0
+
+    Parameter seed: the run seed
+    Precondition: [int] seed >= 0
+
+    Parameter start: the first game number
+    Precondition: [int] start >= 0
+
+    Parameter done: the ranges of games to skip
+    Precondition: [list] of sorted, disjoint ranges [first, end)
+    """
+    for skip, resume in list(done)+[(games, games)]:
+        stop = min(skip, games)
+        for first in range(start, stop, chunk):
+            yield (seed, first, min(chunk, stop-first))
+        start = max(start, resume)
+
+
+def add_range(done, first, end):
+    """
+    Adds the range of games [first, end) to a list of done ranges.
+
+    Neighbouring ranges are joined, so the list stays short when the games are
+    finished roughly in order.
+
+    Parameter done: the ranges done so far
+    Precondition: [list] of sorted, disjoint ranges [first, end), as lists
+
+    Parameter first: the first game of the range
+    Precondition: [int] first >= 0, and the range overlaps none in done
+
+    Parameter end: the end of the range
+    Precondition: [int] end > first
+    """
+    i = bisect.bisect(done, [first, end])
+    if i > 0 and done[i-1][1] == first:
+        i -= 1
+        done[i][1] = end
+    else:
+        done.insert(i, [first, end])
+    if i+1 < len(done) and done[i+1][0] == done[i][1]:
+        done[i][1] = done.pop(i+1)[1]
+
+
+def new_checkpoint(spec, games, seed=0, first=0):
+    """
+    Returns: the checkpoint of a simulation that has not started
+
+    A checkpoint is a JSON-friendly dict with the parameters of the run, the ranges
+    of games done, the exact aggregate of those games and the time spent on them.
+    Game i uses agents.game_seed(seed, i) and every game restarts its agent, so the
+    next game number is the whole random state of the run.  The games done are thus
+    all that is needed to resume it.
+
+    Parameter spec: the agent
+    Precondition: [tuple] a pair (name, options) as returned by agents.parse_agent
+
+    Parameter games: the number of games to play
+    Precondition: [int] games > 0
+
+    Parameter seed: the run seed
+    Precondition: [int] seed >= 0
+
+    Parameter first: the number of the first game
+    Precondition: [int] first >= 0
+    """
+    return {'version': CHECKPOINT_VERSION, 'agent': list(spec), 'seed': seed,
+            'first': first, 'games': games, 'done': [], 'seconds': 0.0,
+            'summary': AgentStats().as_dict()}
+
+
+def load_checkpoint(path):
+    """
+    Returns: the checkpoint saved in path
+
+    Parameter path: the checkpoint file
+    Precondition: [str] a file written by save_checkpoint
+    """
+    with open(path) as file:
+        state = json.load(file)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise IOError('%s is not a simulation checkpoint' % repr(path))
+    return state
+
+
+def save_checkpoint(state, path):
+    """
+    Writes a checkpoint to path atomically.
+
+    The checkpoint goes to a temporary file first, which then replaces path.  A crash
+    in the middle of a save leaves the previous checkpoint intact.
+
+    Parameter state: the checkpoint
+    Precondition: [dict] a checkpoint from new_checkpoint
+
+    Parameter path: the checkpoint file
+    Precondition: [str] a file name
+    """
+    temp = path+'.tmp'
+    with open(temp, 'w') as file:
+        json.dump(state, file)
+    os.replace(temp, path)
+
+
+def simulate(spec, games, seed=0, workers=None, chunk=64, every=10.0, callback=None,
+             first=0, checkpoint=None, interval=60.0, history=None):
+    """
+    Returns: a pair (stats, seconds) with the aggregate of games and the time taken
+
+    The games played are numbers first to first+games-1 of the run.
+
+    With a checkpoint file, the games done and their aggregate are saved to it every
+    interval seconds, and when the run stops for any reason.  If the file already
+    exists, the run resumes from it: it plays only the games that are not done, and
+    the result is exactly the same as a run that was never interrupted.  The time
+    taken then includes the time of the earlier runs.
+
+    With a history, every game is also added to it, and the history is flushed before
+    every checkpoint, so a resumed run never loses a game that the checkpoint counts.
+
+    Parameter spec: the agent
+    Precondition: [tuple] a pair (name, options) as returned by agents.parse_agent
+
+    Parameter games: the number of games to play
+    Precondition: [int] games > 0
+
+    Parameter seed: the run seed
+    Precondition: [int] seed >= 0
+
+    Parameter workers: the number of processes, or None for one per core
+    Precondition: [int] workers > 0, or None
+
+    Parameter chunk: the number of games in each task
+    Precondition: [int] chunk > 0
+
+    Parameter every: the least number of seconds between calls to callback
+    Precondition: [int or float] every >= 0
+
+    Parameter callback: called with (stats, seconds) as the games come in
+    Precondition: a function of two arguments, or None
+
+    Parameter first: the number of the first game
+    Precondition: [int] first >= 0
+
+    Parameter checkpoint: the checkpoint file, or None for no checkpoints
+    Precondition: [str] a file name, or None
+
+    Parameter interval: the least number of seconds between checkpoints
+    Precondition: [int or float] interval >= 0
+
+    Parameter history: the history to add every game to, or None
+    Precondition: [History] or None
+    """
+    import multiprocessing
+    assert type(games) == int and games > 0, '%s is not a valid game count' % repr(games)
+    assert type(chunk) == int and chunk > 0, '%s is not a valid chunk size' % repr(chunk)
+    state = new_checkpoint(spec, games, seed, first)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        saved = load_checkpoint(checkpoint)
+        for key in ('agent', 'seed', 'first', 'games'):
+            if saved[key] != json.loads(json.dumps(state[key])):
+                raise ValueError('%s is for a different %s: %s' %
+                                 (repr(checkpoint), key, repr(saved[key])))
+        state = saved
+    total = AgentStats.from_dict(state['summary'])
+
+    def save():
+        if history is not None:
+            history.flush()
+        state['summary'] = total.as_dict()
+        state['seconds'] = before+time.perf_counter()-start
+        save_checkpoint(state, checkpoint)
+
+    before = state['seconds']
+    start = time.perf_counter()
+    last = saved_at = start
+    tasks = chunks(first+games, chunk, seed, first, [tuple(span) for span in state['done']])
+    tasks = (task+(history is not None,) for task in tasks)
+    agent = agents.describe_agent(spec)
+    try:
+        with multiprocessing.Pool(workers, _init_worker, (spec,)) as pool:
+            for begin, count, result, played in pool.imap_unordered(_play_chunk, tasks):
+                total.merge(result)
+                if history is not None:
+                    for game, seconds in played:
+                        history.add(agent, game.seed, game.score, game.max_tile, game.moves,
+                                    seconds)
+                add_range(state['done'], begin, begin+count)
+                now = time.perf_counter()
+                if callback is not None and now-last >= every:
+                    last = now
+                    callback(total, before+now-start)
+                if checkpoint is not None and now-saved_at >= interval:
+                    saved_at = now
+                    save()
+    finally:
+        if checkpoint is not None:
+            save()
+        elif history is not None:
+            history.flush()
+    return total, before+time.perf_counter()-start
+
+
+def report(stats, seconds, confidence=0.95):
+    """
+    Returns: a JSON-friendly dict summarizing a simulation
+
+    This is the report of AgentStats, plus the total moves, the moves and games per
+    second, and the aggregate itself under 'summary' (see AgentStats.as_dict), so that
+    the summaries of several runs can be merged later (see the module merge).
+
+    Parameter stats: the aggregate of the games
+    Precondition: [AgentStats]
+
+    Parameter seconds: the time taken
+    Precondition: [int or float] seconds > 0
+
+    Parameter confidence: the confidence level of the intervals
+    Precondition: [float] 0 < confidence < 1
+    """
+    result = stats.report(confidence)
+    moves = stats.moves.total
+    result.update({'total_moves': moves, 'seconds': seconds,
+                   'games_per_second': stats.score.count/seconds,
+                   'moves_per_second': moves/seconds, 'summary': stats.as_dict()})
+    return result
+
+
+def main(argv=None):
+    """
+    Plays many games with one agent on a process pool and summarizes them.
+    """
+    import argparse, sys
+    parser = argparse.ArgumentParser(prog='simulate', description=main.__doc__.strip())
+    parser.add_argument('agent', help="the agent, e.g. 'greedy' or 'expectimax:depth=1'")
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--first', type=int, default=0, help='the number of the first game')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk', type=int, default=64, help='games per task')
+    parser.add_argument('--every', type=float, default=10.0,
+                        help='seconds between progress lines')
+    parser.add_argument('--checkpoint', help='save progress to this file, and resume from it')
+    parser.add_argument('--interval', type=float, default=60.0,
+                        help='seconds between checkpoints')
+    parser.add_argument('--history', help='also write every game to this history database')
+    parser.add_argument('--output', help='write the summary to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    def progress(stats, seconds):
+        print('%d/%d games  mean score %.0f  median %.0f  %.0f moves/s' %
+              (stats.score.count, args.games, stats.score.mean, stats.scores.percentile(50),
+               stats.moves.total/seconds), file=sys.stderr)
+
+    history = None if args.history is None else History(args.history)
+    try:
+        stats, seconds = simulate(agents.parse_agent(args.agent), args.games, args.seed,
+                                  args.workers, args.chunk, args.every, progress, args.first,
+                                  args.checkpoint, args.interval, history)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        if history is not None:
+            history.close()
+    result = {'agent': args.agent, 'seed': args.seed, 'first': args.first}
+    result.update(report(stats, seconds))
+    text = json.dumps(result, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as file:
+            file.write(text+'\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+A spectator view that shows dozens of autoplayed games at once.
+
+The boards are played by an AutoplayGroup (see the module autoplay) in background
+processes, and drawn here as a grid of small boards with the agent of each board
+above it.  Boards are dealt the agents in turn, so the boards of one deal play the
+same games and the agents can be compared side by side.
+
+Drawing one GLabel per tile does not scale to this many boards: 64 boards are over
+a thousand labels, each with its own instruction group to rebuild and submit every
+frame.  A BoardGrid instead draws every board through a fixed, shared set of Kivy
+instructions.  The backdrops, empty cells and titles never change, so they are built
+once.  The tiles are one mesh per tile value for the fills and one textured mesh per
+value for the numbers, with every value rendered to a texture only once.  When the
+boards change, the vertices of all the meshes are recomputed at once with NumPy.
+
+Run this module to open the view, for example
+
+    python spectator.py --boards 36 --agents greedy expectimax:depth=1 random
+"""
+import math
+import os
+
+if __name__ == '__main__':
+    # Keep Kivy from parsing our command line options
+    os.environ.setdefault('KIVY_NO_ARGS', '1')
+
+import numpy as np
+from kivy.core.text import Label as CoreLabel
+from kivy.graphics import Color, InstructionGroup, Mesh, Rectangle
+
+from game2d import *
+from consts import *
+import autoplay
+
+# The shift of every cell of a packed board
+_SHIFTS = np.arange(0, 64, 4, dtype=np.uint64)
+
+
+def _gl_color(color):
+    """
+    Returns: a Kivy Color instruction for a color of consts
+
+    Parameter color: the color
+    Precondition: [introcs.RGB]
+    """
+    return Color(*color.glColor())
+
+
+def _text_texture(text, size):
+    """
+    Returns: a texture with the given text rendered in the game font
+
+    Parameter text: the text to render
+    Precondition: [str]
+
+    Parameter size: the font size
+    Precondition: [int or float] size > 0
+    """
+    label = CoreLabel(text=text, font_name='ClearSans', font_size=size)
+    label.refresh()
+    return label.texture
+
+
+def _quads(left, bottom, width, height, coords):
+    """
+    Returns: the vertices of a batch of textured quads, as a flat list
+
+    The arguments are NumPy arrays (or scalars broadcast against them) with one entry
+    per quad.
+
+    Parameter left, bottom, width, height: the rectangles of the quads
+
+    Parameter coords: the texture coordinates (u0, v0, ..., u3, v3) of the corners
+    bottom left, bottom right, top right and top left (as in Texture.tex_coords)
+    Precondition: [tuple] of 8 floats
+    """
+    count = len(left)
+    right = left+width
+    top = bottom+height
+    vertices = np.empty((count, 16))
+    vertices[:, 0] = left
+    vertices[:, 1] = bottom
+    vertices[:, 4] = right
+    vertices[:, 5] = bottom
+    vertices[:, 8] = right
+    vertices[:, 9] = top
+    vertices[:, 12] = left
+    vertices[:, 13] = top
+    vertices[:, 2::4] = coords[0::2]
+    vertices[:, 3::4] = coords[1::2]
+    return vertices.ravel().tolist()
+
+
+class BoardGrid(object):
+    """
+    An instance draws a grid of small boards with a fixed set of batched instructions.
+
+    Instance Variables:
+        count: [int > 0] the number of boards
+        columns: [int > 0] the number of boards in each row of the grid
+        side: [float > 0] the side of each board
+    """
+
+    def __init__(self, count, columns, left, top, pitch, titles=None):
+        """
+        Creates the drawing instructions for a grid of boards.
+
+        Board i is drawn in row i // columns (counting from the top) and column
+        i % columns of the grid.
+
+        Parameter count: the number of boards
+        Precondition: [int] count > 0
+
+        Parameter columns: the number of boards in each row
+        Precondition: [int] columns > 0
+
+        Parameter left: the left edge of the grid
+        Precondition: [int or float]
+
+        Parameter top: the top edge of the grid
+        Precondition: [int or float]
+
+        Parameter pitch: the distance between neighbouring boards (the board, its
+        title and the gap around them)
+        Precondition: [int or float] pitch > 0
+
+        Parameter titles: the text drawn above each board, or None for no titles
+        Precondition: [list] of count strings, or None
+        """
+        self.count = count
+        self.columns = columns
+        title = 0 if titles is None else max(10, pitch*0.12)
+        gap = pitch*0.04
+        self.side = pitch-title-2*gap
+        scale = self.side/GAME_WIDTH
+        border = BORDER*scale
+        self._rec = REC_SIDE*scale
+        self._scale = scale
+
+        # The bottom left corner of every cell, in board order then cell order
+        index = np.arange(count)
+        board_left = left+(index % columns)*pitch+gap+(pitch-2*gap-self.side)/2
+        board_bottom = top-(index // columns+1)*pitch+gap
+        cell = np.arange(16)
+        step = border+self._rec
+        self._left = (board_left[:, None]+border+(cell % 4)*step).ravel()
+        self._bottom = (board_bottom[:, None]+self.side-border-self._rec
+                        -(cell // 4)*step).ravel()
+
+        # The fixed part: backdrops, empty cells and titles
+        self._fixed = InstructionGroup()
+        self._fixed.add(_gl_color(BACK_COLOR))
+        self._fixed.add(Mesh(vertices=_quads(board_left, board_bottom, self.side, self.side,
+                                             (0,)*8), indices=self._indices(count), mode='triangles'))
+        self._fixed.add(_gl_color(DEFAULT_REC_COLOR))
+        self._fixed.add(Mesh(vertices=_quads(self._left, self._bottom, self._rec, self._rec,
+                                             (0,)*8), indices=self._indices(16*count), mode='triangles'))
+        if titles is not None:
+            self._fixed.add(_gl_color(AUTOPLAY_COLOR))
+            textures = {}
+            for i, text in enumerate(titles):
+                if text not in textures:
+                    textures[text] = _text_texture(text, title*0.75)
+                texture = textures[text]
+                width = min(texture.width, self.side)
+                self._fixed.add(Rectangle(texture=texture, size=(width, texture.height),
+                    pos=(board_left[i], board_bottom[i]+self.side+gap/2)))
+
+        # The tiles: a fill mesh and a number mesh for every tile value
+        self._tiles = InstructionGroup()
+        self._fills = {}
+        self._numbers = {}
+        self._textures = {}
+        for exp in range(1, 16):
+            value = 1 << exp
+            self._tiles.add(_gl_color(tile_color(value)))
+            self._fills[exp] = Mesh(mode='triangles')
+            self._tiles.add(self._fills[exp])
+        self._tiles.add(Color(0, 0, 0, 1))
+        for exp in range(1, 16):
+            self._textures[exp] = _text_texture(str(1 << exp), max(6, 30*scale))
+            self._numbers[exp] = Mesh(mode='triangles', texture=self._textures[exp])
+            self._tiles.add(self._numbers[exp])
+        self._boards = None
+
+    def _indices(self, quads):
+        """
+        Returns: the triangle indices for the given number of quads
+        """
+        return (np.arange(4*quads).reshape(-1, 4)[:, [0, 1, 2, 0, 2, 3]]).ravel().tolist()
+
+    def update(self, boards):
+        """
+        Updates the tiles to show the given boards.
+
+        This does nothing if the boards have not changed since the last update.
+
+        Parameter boards: the packed boards, in grid order
+        Precondition: [numpy.ndarray] of count uint64 values
+        """
+        if self._boards is not None and np.array_equal(boards, self._boards):
+            return
+        self._boards = boards.copy()
+        exps = ((boards[:, None] >> _SHIFTS) & np.uint64(15)).astype(np.intp).ravel()
+        order = np.argsort(exps, kind='stable')
+        ends = np.cumsum(np.bincount(exps, minlength=16))
+        for exp in range(1, 16):
+            cells = order[ends[exp-1]:ends[exp]]
+            fill = self._fills[exp]
+            number = self._numbers[exp]
+            if len(cells) == 0:
+                if fill.indices:
+                    fill.vertices = fill.indices = number.vertices = number.indices = []
+                continue
+            left = self._left[cells]
+            bottom = self._bottom[cells]
+            indices = self._indices(len(cells))
+            fill.vertices = _quads(left, bottom, self._rec, self._rec, (0,)*8)
+            fill.indices = indices
+            texture = self._textures[exp]
+            width = min(texture.width, self._rec*0.9)
+            height = texture.height*width/texture.width
+            number.vertices = _quads(left+(self._rec-width)/2, bottom+(self._rec-height)/2,
+                                     width, height, texture.tex_coords)
+            number.indices = indices
+
+    def draw(self, view):
+        """
+        Draws the boards in the provided view.
+
+        Parameter view: the view to draw to
+        Precondition: [GView]
+        """
+        view.draw(self._fixed)
+        view.draw(self._tiles)
+
+
+class SpectatorGUI(GameApp):
+    """
+    A window with a grid of autoplayed boards.
+
+    Set the class attributes agents, boards, pace and workers before running it to
+    change the defaults from consts.
+    """
+    agents = SPECTATOR_AGENTS
+    boards = SPECTATOR_BOARDS
+    pace = SPECTATOR_PACE
+    workers = 1
+
+    def start(self):
+        self.group = autoplay.AutoplayGroup(self.agents, self.boards, pace = self.pace,
+                                            workers = self.workers)
+        columns = SpectatorGUI.columns(self.boards, len(self.agents))
+        titles = [self.agents[i % len(self.agents)] for i in range(self.boards)]
+        self.grid = BoardGrid(self.boards, columns, 0, self.height, self.width/columns, titles)
+        self.rate = None
+        self.status = GLabel(x = self.width/2, y = BORDER/2, width = self.width, height = BORDER,
+                             font_name = 'ClearSans', font_size = 12, linecolor = AUTOPLAY_COLOR, text = '')
+
+    @staticmethod
+    def columns(boards, agents):
+        """
+        Returns: the number of columns for a roughly square grid of boards
+
+        Whole deals of agents fit in a row when they can, so every column shows the
+        same agent.
+
+        Parameter boards: the number of boards
+        Precondition: [int] boards > 0
+
+        Parameter agents: the number of agents
+        Precondition: [int] agents > 0
+        """
+        columns = int(math.ceil(math.sqrt(boards)))
+        if agents <= columns and columns % agents:
+            columns += agents - columns % agents
+        return columns
+
+    @staticmethod
+    def size(boards, agents):
+        """
+        Returns: the window (width, height) for a grid of boards
+
+        Parameter boards: the number of boards
+        Precondition: [int] boards > 0
+
+        Parameter agents: the number of agents
+        Precondition: [int] agents > 0
+        """
+        columns = SpectatorGUI.columns(boards, agents)
+        rows = -(-boards // columns)
+        return SPECTATOR_WIDTH, int(math.ceil(rows*SPECTATOR_WIDTH/columns))+BORDER
+
+    def update(self, dt):
+        snapshot = self.group.snapshot()
+        self.grid.update(np.array(snapshot[autoplay.BOARD::autoplay.RECORD], dtype=np.uint64))
+        rate = self.group.rate()
+        if rate != self.rate:
+            self.rate = rate
+            results = []
+            for agent, (games, total) in zip(self.agents, self.group.results()):
+                results.append('%s %d' % (agent, total/games) if games else agent)
+            self.status.text = '%d moves/s   mean score: %s' % (rate, ', '.join(results))
+
+    def draw(self):
+        self.grid.draw(self.view)
+        self.status.draw(self.view)
+
+
+def main(argv=None):
+    """
+    Opens a window with a grid of autoplayed boards.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description=main.__doc__.strip())
+    parser.add_argument('--boards', type=int, default=SPECTATOR_BOARDS)
+    parser.add_argument('--agents', nargs='+', default=list(SPECTATOR_AGENTS),
+                        help='the agents, e.g. greedy expectimax:depth=1')
+    parser.add_argument('--pace', type=float, default=SPECTATOR_PACE,
+                        help='moves per second on each board (0 for full speed)')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    agents = args.agents
+    SpectatorGUI.agents = agents
+    SpectatorGUI.boards = args.boards
+    SpectatorGUI.pace = args.pace or None
+    SpectatorGUI.workers = args.workers
+    width, height = SpectatorGUI.size(args.boards, len(agents))
+    SpectatorGUI(width=width, height=height).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+"""
+Small statistics helpers for the headless tools.
+
+These keep running aggregates, so a tool can summarize millions of games without
+keeping them.  Moments and Histogram merge exactly, and save to JSON-friendly dicts,
+so the aggregates of separate processes or machines can be combined later.
+
+Requires Python 3.8 or higher (for statistics.NormalDist).
+"""
+import math
+from statistics import NormalDist
+
+
+def z_value(confidence):
+    """
+    Returns: the two-sided normal critical value for the given confidence
+
+    Parameter confidence: the confidence level
+    Precondition: [float] 0 < confidence < 1
+    """
+    return NormalDist().inv_cdf(0.5+confidence/2.0)
+
+
+def wilson_interval(successes, trials, confidence=0.95):
+    """
+    Returns: the Wilson score interval (low, high) for a proportion
+
+    Unlike the normal interval, this behaves well for rates near 0 or 1, such as the
+    rate of reaching 8192.
+
+    Parameter successes: the number of successes
+    Precondition: [int] 0 <= successes <= trials
+
+    Parameter trials: the number of trials
+    Precondition: [int] trials >= 0
+
+    Parameter confidence: the confidence level
+    Precondition: [float] 0 < confidence < 1
+    """
+    if trials == 0:
+        return (0.0, 1.0)
+    z = z_value(confidence)
+    p = float(successes)/trials
+    denom = 1+z*z/trials
+    center = (p+z*z/(2*trials))/denom
+    half = z*math.sqrt(p*(1-p)/trials+z*z/(4*trials*trials))/denom
+    low = 0.0 if successes == 0 else max(0.0, center-half)
+    high = 1.0 if successes == trials else min(1.0, center+half)
+    return (low, high)
+
+
+def mann_whitney(first, second):
+    """
+    Returns: a pair (u, p), the Mann-Whitney U of second against first and the
+    one-sided p-value that values in second tend to be larger than those in first
+
+    u counts the pairs (x from first, y from second) with y > x, ties counting half.
+    The p-value is from the normal approximation, with the corrections for ties and
+    for continuity, which is close enough from about 8 values in each sample.  It
+    assumes nothing about the shape of the distributions, which suits timings (they
+    have long tails to the right).
+
+    Parameter first: the first sample
+    Precondition: [list] of at least one number
+
+    Parameter second: the second sample
+    Precondition: [list] of at least one number
+    """
+    assert len(first) > 0 and len(second) > 0, 'the samples must not be empty'
+    n1 = len(first)
+    n2 = len(second)
+    n = n1+n2
+    values = sorted([(value, 0) for value in first]+[(value, 1) for value in second])
+    # Average ranks (from 1) for runs of equal values
+    rank_sum = 0.0
+    ties = 0
+    start = 0
+    while start < n:
+        end = start
+        while end+1 < n and values[end+1][0] == values[start][0]:
+            end += 1
+        count = end-start+1
+        rank = (start+end)/2.0+1
+        rank_sum += rank*sum(values[i][1] for i in range(start, end+1))
+        ties += count*count*count-count
+        start = end+1
+    u = rank_sum-n2*(n2+1)/2.0
+    variance = n1*n2/12.0*((n+1)-ties/float(n*(n-1))) if n > 1 else 0.0
+    if variance <= 0:
+        return (u, 0.5)
+    z = (u-n1*n2/2.0-0.5)/math.sqrt(variance)
+    return (u, 1.0-NormalDist().cdf(z))
+
+
+class RunningMean(object):
+    """
+    An instance keeps the count, mean and variance of a stream of numbers.
+
+    This uses Welford's update, and Chan's formula to merge two streams.
+
+    Instance Variables:
+        count: [int >= 0] the number of values seen
+        mean: [float] the mean of the values seen
+    """
+
+    def __init__(self):
+        """
+        Creates a new empty aggregate.
+        """
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        """
+        Adds a value to the aggregate.
+
+        Parameter value: the value to add
+        Precondition: [int or float]
+        """
+        self.count += 1
+        delta = value-self.mean
+        self.mean += delta/self.count
+        self._m2 += delta*(value-self.mean)
+
+    def merge(self, other):
+        """
+        Adds every value of another aggregate to this one.
+
+        Parameter other: the aggregate to merge
+        Precondition: [RunningMean]
+        """
+        if other.count == 0:
+            return
+        total = self.count+other.count
+        delta = other.mean-self.mean
+        self._m2 += other._m2+delta*delta*self.count*other.count/total
+        self.mean += delta*other.count/total
+        self.count = total
+
+    @property
+    def variance(self):
+        """
+        The sample variance (0 if fewer than two values).
+        """
+        return self._m2/(self.count-1) if self.count > 1 else 0.0
+
+    @property
+    def stderr(self):
+        """
+        The standard error of the mean (infinite if fewer than two values).
+        """
+        return math.sqrt(self.variance/self.count) if self.count > 1 else float('inf')
+
+    def interval(self, confidence=0.95):
+        """
+        Returns: the normal confidence interval (low, high) for the mean
+
+        Parameter confidence: the confidence level
+        Precondition: [float] 0 < confidence < 1
+        """
+        half = z_value(confidence)*self.stderr
+        return (self.mean-half, self.mean+half)
+
+
+class Moments(object):
+    """
+    An instance keeps the count, mean and variance of a stream of integers.
+
+    Unlike RunningMean, this keeps exact integer sums of the values and their squares.
+    Merging is then exact, so any number of aggregates merged in any order give
+    exactly the same result.  The sums are Python ints, so they never overflow.
+
+    Instance Variables:
+        count: [int >= 0] the number of values seen
+        total: [int] the sum of the values seen
+        squares: [int >= 0] the sum of the squares of the values seen
+    """
+
+    def __init__(self, count=0, total=0, squares=0):
+        """
+        Creates a new aggregate, empty by default.
+
+        Parameter count: the number of values
+        Precondition: [int] count >= 0
+
+        Parameter total: the sum of the values
+        Precondition: [int]
+
+        Parameter squares: the sum of the squares of the values
+        Precondition: [int] squares >= 0
+        """
+        self.count = count
+        self.total = total
+        self.squares = squares
+
+    def add(self, value):
+        """
+        Adds a value to the aggregate.
+
+        Parameter value: the value to add
+        Precondition: [int]
+        """
+        self.count += 1
+        self.total += value
+        self.squares += value*value
+
+    def merge(self, other):
+        """
+        Adds every value of another aggregate to this one.
+
+        Parameter other: the aggregate to merge
+        Precondition: [Moments]
+        """
+        self.count += other.count
+        self.total += other.total
+        self.squares += other.squares
+
+    @property
+    def mean(self):
+        """
+        The mean of the values (0 if there are none).
+        """
+        return self.total/self.count if self.count else 0.0
+
+    @property
+    def variance(self):
+        """
+        The sample variance (0 if fewer than two values).
+        """
+        if self.count < 2:
+            return 0.0
+        return (self.count*self.squares-self.total*self.total)/(self.count*(self.count-1))
+
+    @property
+    def stderr(self):
+        """
+        The standard error of the mean (infinite if fewer than two values).
+        """
+        return math.sqrt(self.variance/self.count) if self.count > 1 else float('inf')
+
+    def interval(self, confidence=0.95):
+        """
+        Returns: the normal confidence interval (low, high) for the mean
+
+        Parameter confidence: the confidence level
+        Precondition: [float] 0 < confidence < 1
+        """
+        half = z_value(confidence)*self.stderr
+        return (self.mean-half, self.mean+half)
+
+    def as_dict(self):
+        """
+        Returns: a JSON-friendly dict with the state of this aggregate
+        """
+        return {'count': self.count, 'total': self.total, 'squares': self.squares}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Returns: the aggregate saved by as_dict
+
+        Parameter data: the saved state
+        Precondition: [dict] a dict returned by as_dict
+        """
+        return cls(data['count'], data['total'], data['squares'])
+
+
+class Histogram(object):
+    """
+    An instance counts non-negative integers in buckets of bounded relative width.
+
+    Values below 2**bits have a bucket each.  Larger values keep only their top bits
+    binary digits, so a bucket is never wider than 2**(1-bits) times its values, and
+    a percentile is off by at most half that (about 0.4% with the default 8 bits).
+    The number of buckets grows only with the log of the largest value, and two
+    histograms with the same bits merge exactly.
+
+    Instance Variables:
+        bits: [int > 0] the significant binary digits kept
+        count: [int >= 0] the number of values seen
+        buckets: [dict] the number of values in each nonempty bucket
+    """
+
+    def __init__(self, bits=8):
+        """
+        Creates a new empty histogram.
+
+        Parameter bits: the significant binary digits kept
+        Precondition: [int] bits > 0
+        """
+        assert type(bits) == int and bits > 0, '%s is not a valid bit count' % repr(bits)
+        self.bits = bits
+        self.count = 0
+        self.buckets = {}
+
+    def bucket(self, value):
+        """
+        Returns: the bucket of a value
+
+        Parameter value: the value
+        Precondition: [int] value >= 0
+        """
+        shift = value.bit_length()-self.bits
+        if shift <= 0:
+            return value
+        return (shift << self.bits) | (value >> shift)
+
+    def bounds(self, bucket):
+        """
+        Returns: the range (low, high) of the values in a bucket, high exclusive
+
+        Parameter bucket: the bucket
+        Precondition: [int] a bucket of this histogram
+        """
+        shift = bucket >> self.bits
+        if shift == 0:
+            return (bucket, bucket+1)
+        low = (bucket & ((1 << self.bits)-1)) << shift
+        return (low, low+(1 << shift))
+
+    def add(self, value, count=1):
+        """
+        Adds a value to the histogram.
+
+        Parameter value: the value to add
+        Precondition: [int] value >= 0
+
+        Parameter count: the number of times to add it
+        Precondition: [int] count > 0
+        """
+        key = self.bucket(value)
+        self.buckets[key] = self.buckets.get(key, 0)+count
+        self.count += count
+
+    def merge(self, other):
+        """
+        Adds every value of another histogram to this one.
+
+        Parameter other: the histogram to merge
+        Precondition: [Histogram] with the same bits
+        """
+        assert other.bits == self.bits, '%s has different bits' % repr(other)
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0)+count
+        self.count += other.count
+
+    def as_dict(self):
+        """
+        Returns: a JSON-friendly dict with the state of this histogram
+        """
+        return {'bits': self.bits, 'buckets': sorted(self.buckets.items())}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Returns: the histogram saved by as_dict
+
+        Parameter data: the saved state
+        Precondition: [dict] a dict returned by as_dict
+        """
+        result = cls(data['bits'])
+        for key, count in data['buckets']:
+            result.buckets[key] = count
+            result.count += count
+        return result
+
+    def percentile(self, p):
+        """
+        Returns: the p-th percentile (nearest rank), as the middle of its bucket
+
+        Parameter p: the percentile
+        Precondition: [int or float] 0 <= p <= 100, and the histogram is not empty
+        """
+        assert self.count > 0, 'the histogram is empty'
+        rank = max(1, int(math.ceil(p/100.0*self.count)))
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen >= rank:
+                low, high = self.bounds(key)
+                return low if high == low+1 else (low+high-1)/2.0
@@ -0,0 +1,362 @@
+"""
+Transposition tables for expectimax search.
+
+A transposition table remembers the value of chance nodes, keyed by the packed board.
+Both classes here have the interface Expectimax expects:
+
+    probe(board, depth) returns the cached value, or None on a miss
+    store(board, depth, value) records a value
+
+A value stored at a given depth answers any probe at that depth or shallower.
+
+LocalTable is an ordinary dict, private to one process.  SharedTable lives in a block
+of multiprocessing.shared_memory, so every worker in a process pool reads and writes
+the same cache instead of rebuilding its own.  It is a fixed-size open-addressing hash
+table whose entries are packed into a structured NumPy array.  When a probe window is
+full, the shallowest entry is replaced, but only by a search at least as deep.
+
+There are no locks.  Each entry stores the key XORed with its two data words (the
+depth, and the value as a float64, the same precision as LocalTable), so an entry torn
+by two processes writing at once fails verification and reads as a miss.
+
+Run this module as a script to compare the two kinds of table on a process pool.
+Requires Python 3.8 or higher and NumPy.
+"""
+import struct
+import numpy as np
+from multiprocessing import shared_memory
+
+import board
+
+# Each entry is three 64-bit words: check (key ^ depth ^ value), depth (0 for an empty
+# entry) and the bits of the value, a float64
+ENTRY = np.dtype([('check', '<u8'), ('depth', '<u8'), ('value', '<u8')])
+
+# The number of consecutive slots examined for each key
+PROBES = 4
+
+# Fibonacci hashing multiplier
+_GOLDEN = 0x9E3779B97F4A7C15
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+_DOUBLE = struct.Struct('<d')
+_WORD   = struct.Struct('<Q')
+
+
+class LocalTable(object):
+    """
+    An instance is a transposition table private to one process.
+
+    Instance Variables:
+        probes: [int >= 0] the number of calls to probe
+        hits: [int >= 0] the number of probes that found a usable value
+    """
+
+    def __init__(self):
+        """
+        Creates a new empty table.
+        """
+        self._entries = {}
+        self.probes = 0
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Removes every entry (but keeps the counters).
+        """
+        self._entries.clear()
+
+    def probe(self, key, depth):
+        """
+        Returns: the value stored for key at depth or deeper, or None
+
+        Parameter key: the packed board
+        Precondition: [int] a nonzero packed board
+
+        Parameter depth: the depth required
+        Precondition: [int] depth > 0
+        """
+        self.probes += 1
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] >= depth:
+            self.hits += 1
+            return entry[1]
+        return None
+
+    def store(self, key, depth, value):
+        """
+        Records the value of key searched to the given depth.
+
+        Parameter key: the packed board
+        Precondition: [int] a nonzero packed board
+
+        Parameter depth: the depth searched
+        Precondition: [int] 0 < depth < 256
+
+        Parameter value: the value found
+        Precondition: [float]
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= depth:
+            self._entries[key] = (depth, value)
+
+
+class SharedTable(object):
+    """
+    An instance is a transposition table in shared memory.
+
+    The process that creates the table owns it, and must call unlink when done.  Other
+    processes attach by name and only call close.
+
+    Instance Variables:
+        name: [str] the name of the shared memory block
+        size: [int] the number of entries (a power of 2)
+        entries: [numpy.ndarray] the entries, with dtype ENTRY
+        probes: [int >= 0] the number of calls to probe in this process
+        hits: [int >= 0] the number of those probes that found a usable value
+    """
+
+    def __init__(self, bits=20, name=None):
+        """
+        Creates a new table, or attaches to an existing one.
+
+        Parameter bits: the log2 of the number of entries
+        Precondition: [int] 4 <= bits <= 32
+
+        Parameter name: the name of an existing table, or None to create a new one
+        Precondition: [str] or None
+        """
+        assert type(bits) == int and 4 <= bits <= 32, '%s is not a valid size' % repr(bits)
+        self.size = 1 << bits
+        self._shift = 64-bits
+        self._mask = self.size-1
+        nbytes = self.size*ENTRY.itemsize
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self._shm.buf[:nbytes] = bytes(nbytes)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.name = self._shm.name
+        self.entries = np.ndarray((self.size,), dtype=ENTRY, buffer=self._shm.buf)
+        # A plain word view is much faster than NumPy for one element at a time
+        self._words = self._shm.buf[:nbytes].cast('Q')
+        self.probes = 0
+        self.hits = 0
+
+    def _slot(self, key):
+        """
+        Returns: the first slot to examine for key
+        """
+        return ((key*_GOLDEN) & _MASK64) >> self._shift
+
+    def probe(self, key, depth):
+        """
+        Returns: the value stored for key at depth or deeper, or None
+
+        Parameter key: the packed board
+        Precondition: [int] a nonzero packed board
+
+        Parameter depth: the depth required
+        Precondition: [int] depth > 0
+        """
+        self.probes += 1
+        words = self._words
+        slot = self._slot(key)
+        for i in range(PROBES):
+            j = 3*((slot+i) & self._mask)
+            stored = words[j+1]
+            if stored == 0:
+                return None
+            value = words[j+2]
+            if words[j] ^ stored ^ value == key:
+                if stored >= depth:
+                    self.hits += 1
+                    return _DOUBLE.unpack(_WORD.pack(value))[0]
+                return None
+        return None
+
+    def store(self, key, depth, value):
+        """
+        Records the value of key searched to the given depth.
+
+        If key is not in its probe window, it goes in the first empty slot.  If there
+        is none, it replaces the shallowest entry in the window, provided that entry
+        is no deeper than depth.
+
+        Parameter key: the packed board
+        Precondition: [int] a nonzero packed board
+
+        Parameter depth: the depth searched
+        Precondition: [int] 0 < depth < 256
+
+        Parameter value: the value found
+        Precondition: [float]
+        """
+        words = self._words
+        slot = self._slot(key)
+        victim = -1
+        shallowest = 256
+        for i in range(PROBES):
+            j = 3*((slot+i) & self._mask)
+            old = words[j+1]
+            if old == 0:
+                victim = j
+                break
+            if words[j] ^ old ^ words[j+2] == key:
+                if old > depth:
+                    return
+                victim = j
+                break
+            if old < shallowest:
+                victim = j
+                shallowest = old
+        else:
+            if shallowest > depth:
+                return
+        bits = _WORD.unpack(_DOUBLE.pack(value))[0]
+        words[victim+2] = bits
+        words[victim+1] = depth
+        words[victim] = key ^ depth ^ bits
+
+    def occupancy(self):
+        """
+        Returns: the fraction of entries in use
+        """
+        return float(np.count_nonzero(self.entries['depth']))/self.size
+
+    def close(self):
+        """
+        Detaches this process from the table.
+        """
+        self._words.release()
+        self.entries = None
+        self._shm.close()
+
+    def unlink(self):
+        """
+        Frees the shared memory.  Only the creator should call this, after close.
+        """
+        self._shm.unlink()
+
+
+# #mark - Benchmark
+
+_worker_search = None
+
+
+def _init_worker(depth, bits, name):
+    """
+    Initializes a pool worker with its own search, using the given shared table name
+    or a per-process LocalTable if name is None.
+    """
+    import search
+    global _worker_search
+    table = LocalTable() if name is None else SharedTable(bits, name)
+    _worker_search = search.Expectimax(depth, table=table)
+
+
+def _worker_score(task):
+    """
+    Returns: a tuple (pid, probes, hits, nodes) after searching one (position, direction)
+    task, where the counts are the worker's totals so far.
+    """
+    import os
+    s = _worker_search
+    s.score_move(*task)
+    return os.getpid(), s.table.probes, s.table.hits, s.nodes
+
+
+def sample_positions(count, seed=0):
+    """
+    Returns: a list of count positions taken from consecutive turns of random games
+
+    Parameter count: the number of positions
+    Precondition: [int] count > 0
+
+    Parameter seed: the random seed
+    Precondition: [int]
+    """
+    import random
+    rng = random.Random(seed)
+    result = []
+    b = board.new_board(rng)
+    while len(result) < count:
+        if board.is_over(b):
+            b = board.new_board(rng)
+        result.append(b)
+        moves = board.legal_moves(b)
+        # Favour two directions so that the games last and the tiles grow
+        preferred = [d for d in moves if d in (board.DOWN, board.LEFT)]
+        b = board.play(b, rng.choice(preferred or moves), rng)[0]
+    return result
+
+
+def run_pool(positions, workers, depth, bits=None):
+    """
+    Returns: a tuple (seconds, probes, hits, nodes) for searching every position
+
+    Each position is split into one task per legal direction, and tasks are handed out
+    one at a time.  The subtrees of different directions meet again (left then down is
+    often down then left), so with per-process tables each worker searches the same
+    chance nodes that its neighbours already have.
+
+    Parameter positions: the boards to search
+    Precondition: [list] a list of packed boards
+
+    Parameter workers: the number of processes
+    Precondition: [int] workers > 0
+
+    Parameter depth: the search depth
+    Precondition: [int] depth > 0
+
+    Parameter bits: the log2 size of a shared table, or None for per-process tables
+    Precondition: [int] or None
+    """
+    import multiprocessing, time
+    table = None if bits is None else SharedTable(bits)
+    name = None if table is None else table.name
+    totals = {}
+    start = time.perf_counter()
+    tasks = [(p, d) for p in positions for d in board.legal_moves(p)]
+    with multiprocessing.Pool(workers, _init_worker, (depth, bits, name)) as pool:
+        for counts in pool.imap_unordered(_worker_score, tasks, chunksize=1):
+            totals[counts[0]] = counts
+    elapsed = time.perf_counter()-start
+    if table is not None:
+        table.close()
+        table.unlink()
+    probes = sum(c[1] for c in totals.values())
+    hits = sum(c[2] for c in totals.values())
+    nodes = sum(c[3] for c in totals.values())
+    return elapsed, probes, hits, nodes
+
+
+def main(argv=None):
+    """
+    Compares per-process and shared transposition tables on a process pool.
+    """
+    import argparse, os
+    parser = argparse.ArgumentParser(description=main.__doc__.strip())
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--positions', type=int, default=400)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--bits', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    positions = sample_positions(args.positions, args.seed)
+    print('%d positions, %d workers, depth %d' % (len(positions), args.workers, args.depth))
+    results = {}
+    for label, bits in (('per-process', None), ('shared', args.bits)):
+        elapsed, probes, hits, nodes = run_pool(positions, args.workers, args.depth, bits)
+        results[label] = elapsed
+        rate = 100.0*hits/probes if probes else 0.0
+        print('%-12s %8.2fs  hit rate %5.1f%%  nodes %d' % (label, elapsed, rate, nodes))
+    print('speedup %.2fx' % (results['per-process']/results['shared']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""
+Tunes the heuristic weights of the search bots with the cross-entropy method.
+
+Each generation samples a population of weight vectors from a normal distribution,
+scores every candidate by the mean score of a batch of games, and refits the
+distribution to the best few (the elite).  Every game of every candidate runs as a
+separate task on a process pool, so a run uses all cores.
+
+All candidates in a generation play the same seeds (common random numbers).  Two
+candidates are then compared on identical spawn sequences, which removes most of the
+noise from the comparison.  Each generation gets a fresh set of seeds, so the weights
+do not overfit one batch of games.
+
+After every candidate the whole state of the run is written to a JSON file.  If the
+run is interrupted, starting it again with the same file picks up where it left off.
+"""
+import json
+import os
+import random
+
+import agents
+import search
+
+# The fraction of each population kept as the elite
+ELITE = 0.25
+
+# The smallest standard deviation allowed, so the search never stalls completely
+MIN_STD = 0.05
+
+# How much of the old distribution is kept at each update
+SMOOTHING = 0.3
+
+
+def generation_seeds(seed, generation, games):
+    """
+    Returns: the list of game seeds shared by every candidate of a generation
+
+    Parameter seed: the seed of the tuning run
+    Precondition: [int]
+
+    Parameter generation: the generation number
+    Precondition: [int] generation >= 0
+
+    Parameter games: the number of games per candidate
+    Precondition: [int] games > 0
+    """
+    rng = random.Random('%d/%d' % (seed, generation))
+    return [rng.getrandbits(63) for _ in range(games)]
+
+
+def sample_population(state):
+    """
+    Returns: a list of weight vectors drawn from the current distribution
+
+    The draw depends only on the run seed and the generation, so it is repeatable.
+
+    Parameter state: the tuning state
+    Precondition: [dict] a state from new_state
+    """
+    rng = random.Random('%d/%d/population' % (state['seed'], state['generation']))
+    result = []
+    for _ in range(state['population']):
+        result.append([rng.gauss(m, s) for m, s in zip(state['mean'], state['std'])])
+    return result
+
+
+def new_state(seed, population, games, depth, mean=search.DEFAULT_WEIGHTS, std=1.0):
+    """
+    Returns: the state of a fresh tuning run
+
+    Parameter seed: the seed of the tuning run
+    Precondition: [int]
+
+    Parameter population: the number of candidates per generation
+    Precondition: [int] population >= 4
+
+    Parameter games: the number of games per candidate
+    Precondition: [int] games > 0
+
+    Parameter depth: the search depth of the bot being tuned
+    Precondition: [int] depth > 0
+
+    Parameter mean: the starting weights
+    Precondition: [search.Weights] (or any sequence of 4 numbers)
+
+    Parameter std: the starting standard deviation of every weight
+    Precondition: [float] std > 0
+    """
+    assert population >= 4, '%s is too small a population' % repr(population)
+    state = {'seed': seed, 'population': population, 'games': games, 'depth': depth,
+             'generation': 0, 'mean': list(mean), 'std': [std]*len(mean),
+             'candidates': None, 'scores': {}, 'history': []}
+    state['candidates'] = sample_population(state)
+    return state
+
+
+def load_state(path):
+    """
+    Returns: the tuning state saved at path, or None if there is no such file
+
+    Parameter path: the state file
+    Precondition: [str] a file name
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_state(state, path):
+    """
+    Writes the tuning state to path atomically.
+
+    The state goes to a temporary file first, which then replaces path.  A crash in
+    the middle of a save leaves the previous state intact.
+
+    Parameter state: the tuning state
+    Precondition: [dict] a state from new_state
+
+    Parameter path: the state file
+    Precondition: [str] a file name
+    """
+    temp = path+'.tmp'
+    with open(temp, 'w') as file:
+        json.dump(state, file, indent=1)
+    os.replace(temp, path)
+
+
+def next_generation(state):
+    """
+    Refits the distribution to the elite of the finished generation, and samples the
+    next population.
+
+    Parameter state: the tuning state, with a score for every candidate
+    Precondition: [dict] a state from new_state
+    """
+    candidates = state['candidates']
+    scores = [state['scores'][str(i)] for i in range(len(candidates))]
+    order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)
+    elite = [candidates[i] for i in order[:max(2, int(len(candidates)*ELITE))]]
+
+    size = len(state['mean'])
+    for k in range(size):
+        values = [w[k] for w in elite]
+        mean = sum(values)/len(values)
+        std = (sum((v-mean)**2 for v in values)/len(values))**0.5
+        state['mean'][k] = SMOOTHING*state['mean'][k] + (1-SMOOTHING)*mean
+        state['std'][k] = max(MIN_STD, SMOOTHING*state['std'][k] + (1-SMOOTHING)*std)
+
+    state['history'].append({'generation': state['generation'],
+                             'best': scores[order[0]], 'weights': candidates[order[0]],
+                             'mean_score': sum(scores)/len(scores)})
+    state['generation'] += 1
+    state['scores'] = {}
+    state['candidates'] = sample_population(state)
+
+
+def _play(task):
+    """
+    Returns: a tuple (candidate, score) for one game of one candidate
+    """
+    candidate, weights, depth, seed = task
+    agent = agents.ExpectimaxAgent(depth, weights)
+    return candidate, agents.play_game(agent, seed).score
+
+
+def run_generation(state, pool, path):
+    """
+    Scores every unscored candidate of the current generation on the pool.
+
+    The state is saved each time a candidate finishes all of its games.
+
+    Parameter state: the tuning state
+    Precondition: [dict] a state from new_state
+
+    Parameter pool: the worker pool
+    Precondition: [multiprocessing.Pool]
+
+    Parameter path: the state file
+    Precondition: [str] a file name
+    """
+    seeds = generation_seeds(state['seed'], state['generation'], state['games'])
+    todo = [i for i in range(len(state['candidates'])) if str(i) not in state['scores']]
+    tasks = [(i, state['candidates'][i], state['depth'], s) for i in todo for s in seeds]
+    totals = dict((i, 0) for i in todo)
+    counts = dict((i, 0) for i in todo)
+    for candidate, score in pool.imap_unordered(_play, tasks):
+        totals[candidate] += score
+        counts[candidate] += 1
+        if counts[candidate] == len(seeds):
+            state['scores'][str(candidate)] = totals[candidate]/float(len(seeds))
+            save_state(state, path)
+            print('generation %d candidate %d: %.1f' %
+                  (state['generation'], candidate, state['scores'][str(candidate)]))
+
+
+def tune(path, generations, workers=None, **options):
+    """
+    Returns: the final tuning state after running (or resuming) a tuning run
+
+    If path holds a saved state, the run resumes from it and options are ignored.
+
+    Parameter path: the state file
+    Precondition: [str] a file name
+
+    Parameter generations: the generation to stop at
+    Precondition: [int] generations > 0
+
+    Parameter workers: the number of processes, or None for one per core
+    Precondition: [int] workers > 0, or None
+
+    Parameter options: keyword arguments for new_state
+    Precondition: valid for new_state
+    """
+    import multiprocessing
+    state = load_state(path)
+    if state is None:
+        state = new_state(**options)
+        save_state(state, path)
+    else:
+        print('resuming generation %d (%d candidates scored)' %
+              (state['generation'], len(state['scores'])))
+
+    with multiprocessing.Pool(workers) as pool:
+        while state['generation'] < generations:
+            run_generation(state, pool, path)
+            next_generation(state)
+            save_state(state, path)
+            best = state['history'][-1]
+            print('generation %d: best %.1f, mean %.1f, weights %s' %
+                  (best['generation'], best['best'], best['mean_score'],
+                   ', '.join('%.3f' % w for w in state['mean'])))
+    return state
+
+
+def main(argv=None):
+    """
+    Tunes the expectimax heuristic weights on a process pool.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description=main.__doc__.strip())
+    parser.add_argument('state', help='state file, created if missing and resumed if present')
+    parser.add_argument('--generations', type=int, default=20)
+    parser.add_argument('--population', type=int, default=16)
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--depth', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    state = tune(args.state, args.generations, args.workers, seed=args.seed,
+                 population=args.population, games=args.games, depth=args.depth)
+    print('weights: %s' % json.dumps(dict(zip(search.Weights._fields, state['mean']))))
+
+
+if __name__ == '__main__':
+    main()